@@ -1,7 +1,7 @@
-import React, { useState, useEffect, useCallback, useMemo } from "react";
+import React, { useState, useEffect, useCallback, useMemo, useRef } from "react";
 // We will use a mock component at the bottom of this file for now.
 import { SidebarNavigation } from "./SidebarNavigation";
-import api from "../services/api";
+import api, { getAllPages } from "../services/api";
 
 import {
     CalendarDays,
@@ -110,7 +110,7 @@ export default function AttendancePage() {
     const fetchSubjects = useCallback(async () => {
         setIsSubjectsLoading(true);
         try {
-            const response = await api.get("/api/subjects");
+            const response = await getAllPages("/api/subjects");
             setSubjects(response.data); // Use .data
             setApiError(null);
         } catch (error) {
@@ -121,15 +121,40 @@ export default function AttendancePage() {
         }
     }, []);
 
+    // Weeks whose scheduled classes were already created this session
+    const materializedWeeks = useRef(new Set());
+
     const fetchInstancesForDate = useCallback(async (date, storeIn) => {
         if (storeIn === 'main') setIsInstancesLoading(true);
 
-        const year = date.getFullYear();
-        const month = (date.getMonth() + 1).toString().padStart(2, '0');
-        const day = date.getDate().toString().padStart(2, '0');
-        const dateStr = `${year}-${month}-${day}`;
+        const toDateStr = (d) => {
+            const year = d.getFullYear();
+            const month = (d.getMonth() + 1).toString().padStart(2, '0');
+            const day = d.getDate().toString().padStart(2, '0');
+            return `${year}-${month}-${day}`;
+        };
+        const dateStr = toDateStr(date);
 
         try {
+            // The GET never creates classes: create the week (Mon-Sun) from the
+            // schedules once, then read the day. Only up to today, since an
+            // unmarked class counts as held (the server enforces this too).
+            const weekStart = new Date(date);
+            weekStart.setDate(date.getDate() - ((date.getDay() + 6) % 7));
+            const weekEnd = new Date(weekStart);
+            weekEnd.setDate(weekStart.getDate() + 6);
+            const todayStr = toDateStr(new Date());
+            const weekStartStr = toDateStr(weekStart);
+            const endStr = toDateStr(weekEnd) < todayStr ? toDateStr(weekEnd) : todayStr;
+            const rangeKey = `${weekStartStr}:${endStr}`;
+            if (weekStartStr <= endStr && !materializedWeeks.current.has(rangeKey)) {
+                await api.post("/api/class-instances/materialize", {
+                    start_date: weekStartStr,
+                    end_date: endStr
+                });
+                materializedWeeks.current.add(rangeKey);
+            }
+
             const response = await api.get("/api/class-instances", {
                 params: { target_date: dateStr }
             });
@@ -195,6 +220,7 @@ export default function AttendancePage() {
     const handleAddSubject = async (newSubjectData) => {
         try {
             await api.post("/api/subjects", newSubjectData);
+            materializedWeeks.current.clear(); // The new schedule adds classes to every week
             fetchSubjects();
             setShowAddSubject(false);
         } catch (error) {
@@ -1,5 +1,5 @@
 import React, { useState, useEffect } from "react";
-import api from "../services/api";
+import api, { getAllPages } from "../services/api";
 import { SidebarNavigation } from "./SidebarNavigation";
 import {
   Search,
@@ -42,7 +42,7 @@ export default function LostFoundPage() {
       setIsLoading(true);
       setError(null);
       try {
-        const response = await api.get("/lost_and_found_items");
+        const response = await getAllPages("/lost_and_found_items");
         // Map backend response to the frontend's expected data structure
         const mappedItems = response.data.map((item) => ({
           id: item.id,
@@ -96,7 +96,7 @@ export default function LostFoundPage() {
       });
 
       // Refetch all items to show the new one
-      const fetchResponse = await api.get("/lost_and_found_items");
+      const fetchResponse = await getAllPages("/lost_and_found_items");
       setItems(
         fetchResponse.data.map((item) => ({
           // Re-map the data
@@ -2,7 +2,7 @@ import React, { useState, useEffect, useRef, useCallback, useMemo} from "react";
 import { SidebarNavigation } from "../SidebarNavigation";
 import { Send, BookOpen, Trash2, FileText, Paperclip, Tag, AlertTriangle, CheckCircle, Loader, Copy, Bot, X , Eye, ChevronDown} from "lucide-react";
 import ReactMarkdown from 'react-markdown';
-import api from "../../services/api";
+import api, { getAllPages } from "../../services/api";
 
 const cn = (...classes) => classes.filter(Boolean).join(' ');
 const Modal = ({ isOpen, onClose, children }) => {
@@ -74,7 +74,7 @@ function StudyAssistantChatPageContent({ user }) {
   // We wrap them in useCallback to prevent them from being recreated on every render.
   const fetchConversations = useCallback(async () => {
     try {
-      const response = await api.get("/conversations");
+      const response = await getAllPages("/conversations");
       setConversations(response.data);
     } catch (err) {
       console.error("Failed to fetch conversations:", err);
@@ -107,7 +107,7 @@ function StudyAssistantChatPageContent({ user }) {
 
   const fetchDocuments = useCallback(async () => {
     try {
-      const response = await api.get("/documents");
+      const response = await getAllPages("/documents");
       setDocuments(response.data);
       response.data.forEach(doc => {
         if (doc.status === 'processing') {
@@ -139,9 +139,11 @@ function StudyAssistantChatPageContent({ user }) {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [user, fetchConversations, fetchDocuments]);
 
+  // Scroll down for new messages, but not when earlier ones are prepended
+  const lastMessage = selectedConversation?.messages?.[selectedConversation.messages.length - 1];
   useEffect(() => {
     chatEndRef.current?.scrollIntoView({ behavior: 'smooth' });
-  }, [selectedConversation?.messages]);
+  }, [selectedConversation?.id, lastMessage]);
 
   const handleFileChange = (e) => {
     const selectedFile = e.target.files[0];
@@ -233,7 +235,8 @@ const handleViewDocument = (docId, docName, tag) => {
     setIsLoading(true);
     try {
       const response = await api.get(`/conversations/${convId}`);
-      setSelectedConversation(response.data);
+      // Only the latest messages come back; the header points at older ones
+      setSelectedConversation({ ...response.data, olderCursor: response.headers["x-next-cursor"] || null });
     } catch (err) {
       console.error("Failed to load conversation:", err);
       setError("Could not load conversation details.");
@@ -242,6 +245,25 @@ const handleViewDocument = (docId, docName, tag) => {
     }
   };
 
+  const loadEarlierMessages = async () => {
+    if (!selectedConversation?.olderCursor) return;
+    const convId = selectedConversation.id;
+    try {
+      const response = await api.get(`/conversations/${convId}/messages`, {
+        params: { cursor: selectedConversation.olderCursor },
+      });
+      setSelectedConversation(prev => prev?.id !== convId ? prev : {
+        ...prev,
+        messages: [...response.data, ...prev.messages],
+        olderCursor: response.headers["x-next-cursor"] || null,
+      });
+    } catch (err) {
+      console.error("Failed to load earlier messages:", err);
+      setError("Could not load earlier messages.");
+      setTimeout(() => setError(null), 3000);
+    }
+  };
+
   // This function can now correctly call `fetchConversations`
   const handleAskQuestion = async (e) => {
     e.preventDefault();
@@ -281,13 +303,10 @@ const handleViewDocument = (docId, docName, tag) => {
       } else {
          // If it's a NEW conversation, we need to handle it differently.
          await fetchConversations(); // Update the sidebar list
-         // Instead of re-fetching (which would lose the sources), we construct the new conversation state
-         // using the data we just received.
+         // The question and the answer (with its sources) are saved together, so the
+         // fetched conversation already holds both messages.
          const newConvResponse = await api.get(`/conversations/${conversation_id}`);
-         setSelectedConversation({
-             ...newConvResponse.data,
-             messages: [...newConvResponse.data.messages, assistantMessage]
-         });
+         setSelectedConversation({ ...newConvResponse.data, olderCursor: null });
       }
     } catch (err) {
       console.error("Failed to ask question:", err);
@@ -450,6 +469,13 @@ const handleViewDocument = (docId, docName, tag) => {
             <style>{animationStyles}</style>
 
             <div className="flex-1 overflow-y-auto p-6 space-y-6">
+              {selectedConversation?.olderCursor && (
+                <div className="flex justify-center">
+                  <button onClick={loadEarlierMessages} className="text-sm text-blue-600 hover:underline">
+                    Load earlier messages
+                  </button>
+                </div>
+              )}
               {selectedConversation?.messages?.map((msg, index) => (
                 <div key={index} className={cn("flex gap-4", msg.role === 'user' ? 'justify-end' : 'justify-start')}>
                   {msg.role === 'assistant' && <div className="h-8 w-8 rounded-full bg-blue-600 flex items-center justify-center text-white shrink-0"><Bot size={20} /></div>}
@@ -18,7 +18,7 @@ import {
   Check,
   Award,
 } from "lucide-react";
-import api from "../../services/api"; // Ensure this path is correct
+import api, { getAllPages } from "../../services/api"; // Ensure this path is correct
 
 // Helper function for class names
 const cn = (...classes) => classes.filter(Boolean).join(" ");
@@ -37,6 +37,9 @@ const DocumentStatusIcon = ({ status }) => {
   }
 };
 
+const QUIZ_POLL_INTERVAL_MS = 2000;
+const QUIZ_POLL_MAX_ATTEMPTS = 90;
+
 export default function StudyAssistantQuizPage() {
   const [step, setStep] = useState(1); // 1: Upload, 2: Customize, 3: Quiz, 4: Results
 
@@ -108,7 +111,7 @@ export default function StudyAssistantQuizPage() {
 
   const fetchDocuments = useCallback(async () => {
     try {
-      const response = await api.get("/documents");
+      const response = await getAllPages("/documents");
       setDocuments(response.data);
       response.data.forEach((doc) => {
         if (doc.status === "processing") {
@@ -122,7 +125,7 @@ export default function StudyAssistantQuizPage() {
 
   const fetchQuizHistory = useCallback(async () => {
     try {
-      const response = await api.get("/quiz/history");
+      const response = await getAllPages("/quiz/history");
       setQuizHistory(response.data);
     } catch (err) {
       console.error("Failed to fetch quiz history:", err);
@@ -297,6 +300,18 @@ export default function StudyAssistantQuizPage() {
     setStep(2);
   };
 
+  // Quiz generation runs in a background worker; poll until it finishes
+  const waitForQuizGeneration = async (sessionId) => {
+    for (let attempt = 0; attempt < QUIZ_POLL_MAX_ATTEMPTS; attempt++) {
+      await new Promise((resolve) => setTimeout(resolve, QUIZ_POLL_INTERVAL_MS));
+      const response = await api.get(`/quiz/session/${sessionId}/status`);
+      const { status, error: generationError } = response.data;
+      if (status === "COMPLETED") return;
+      if (status === "FAILED") throw new Error(generationError || "Failed to generate quiz.");
+    }
+    throw new Error("Quiz generation is taking longer than expected. Check your quiz history shortly.");
+  };
+
   const handleGenerateQuiz = async () => {
     setIsGenerating(true);
     setError(null);
@@ -324,15 +339,21 @@ export default function StudyAssistantQuizPage() {
     }
 
     try {
-      const response = await api.post("/generate_quiz", formData);
-      setCurrentQuizSession(response.data); // Save the full quiz session
+      const queued = await api.post("/generate_quiz", formData);
+      let session = queued.data;
+      if (session.generation_status !== "COMPLETED") {
+        await waitForQuizGeneration(session.id);
+        const response = await api.get(`/quiz/session/${session.id}`);
+        session = response.data;
+      }
+      setCurrentQuizSession(session); // Save the full quiz session
       setUserAnswers({});
       setCurrentQuestionIndex(0);
       fetchQuizHistory(); // Refetch history
       setStep(3);
     } catch (err) {
       console.error("Failed to generate quiz:", err);
-      setError(err.response?.data?.detail || "Failed to generate quiz.");
+      setError(err.response?.data?.detail || err.message || "Failed to generate quiz.");
     } finally {
       setIsGenerating(false);
     }
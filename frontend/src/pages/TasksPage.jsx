@@ -1,7 +1,7 @@
 import React, { useState, useEffect, useMemo } from 'react';
 import { SidebarNavigation } from './SidebarNavigation';
 import { CheckSquare, Plus, Search, Filter, BarChart3, Users, X, Calendar, Clock, AlertTriangle, Trash } from 'lucide-react';
-import api from '../services/api';
+import api, { getAllPages } from '../services/api';
 
 function TasksPageContent({ user }) {
     const [tasks, setTasks] = useState([]);
@@ -30,7 +30,7 @@ function TasksPageContent({ user }) {
     useEffect(() => {
         const fetchTasks = async () => {
             try {
-                const response = await api.get("/tasks");
+                const response = await getAllPages("/tasks");
                 setTasks(response.data.map(task => ({ ...task, tags: task.tags || [] })));
             } catch (err) {
                 console.error("Failed to fetch tasks:", err);
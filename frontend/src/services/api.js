@@ -35,4 +35,21 @@ api.interceptors.request.use(
   (error) => Promise.reject(error)
 );
 
+// List endpoints return one page and the next page's cursor in the
+// X-Next-Cursor header. Follows the cursors and resolves with every row,
+// shaped like an axios response ({ data }) so callers can swap it in for api.get.
+export async function getAllPages(url, config = {}) {
+  const rows = [];
+  let cursor = null;
+  do {
+    const response = await api.get(url, {
+      ...config,
+      params: { limit: 100, ...(config.params || {}), ...(cursor ? { cursor } : {}) },
+    });
+    rows.push(...response.data);
+    cursor = response.headers["x-next-cursor"] || null;
+  } while (cursor);
+  return { data: rows };
+}
+
 export default api;
@@ -0,0 +1,33 @@
+"""quiz session generation status
+
+Revision ID: 0001_quiz_generation_status
+Revises:
+Create Date: 2026-10-19
+
+Tables that predate migrations are created by `create_all` (see app.main), so
+this revision only adds what is new. Statements use IF NOT EXISTS so running
+it against a database that create_all already brought up to date is a no-op.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0001_quiz_generation_status"
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The generationstatus enum type already exists for generated_documents.status
+    op.execute(
+        "ALTER TABLE quiz_sessions "
+        "ADD COLUMN IF NOT EXISTS generation_status generationstatus NOT NULL DEFAULT 'COMPLETED'"
+    )
+    op.execute("ALTER TABLE quiz_sessions ADD COLUMN IF NOT EXISTS error_message TEXT")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE quiz_sessions DROP COLUMN IF EXISTS error_message")
+    op.execute("ALTER TABLE quiz_sessions DROP COLUMN IF EXISTS generation_status")
@@ -0,0 +1,25 @@
+"""document topic index
+
+Revision ID: 0002_document_topic_index
+Revises: 0001_quiz_generation_status
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0002_document_topic_index"
+down_revision: Union[str, None] = "0001_quiz_generation_status"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Filled at ingestion; older documents get it on their first quiz
+    op.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS topic_index JSONB")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE documents DROP COLUMN IF EXISTS topic_index")
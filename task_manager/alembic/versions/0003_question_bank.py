@@ -0,0 +1,47 @@
+"""question bank
+
+Revision ID: 0003_question_bank
+Revises: 0002_document_topic_index
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision: str = "0003_question_bank"
+down_revision: Union[str, None] = "0002_document_topic_index"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table("question_bank_items"):
+        return  # Already created by create_all
+    op.create_table(
+        "question_bank_items",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("document_id", sa.String(), sa.ForeignKey("documents.id", ondelete="CASCADE"), nullable=False),
+        sa.Column("topic", sa.String(), nullable=True),
+        sa.Column("question_type", sa.String(), nullable=False),
+        sa.Column("language", sa.String(), nullable=False),
+        sa.Column("hard_mode", sa.Boolean(), nullable=False),
+        sa.Column("question_text", sa.Text(), nullable=False),
+        sa.Column("options", postgresql.JSONB(), nullable=True),
+        sa.Column("correct_answer", sa.String(), nullable=False),
+        sa.Column("times_served", sa.Integer(), nullable=False, server_default="0"),
+        sa.Column("created_at", sa.DateTime(), nullable=True),
+    )
+    op.create_index(
+        "ix_question_bank_lookup",
+        "question_bank_items",
+        ["document_id", "language", "hard_mode", "question_type"],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_question_bank_lookup", table_name="question_bank_items")
+    op.drop_table("question_bank_items")
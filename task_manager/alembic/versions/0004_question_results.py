@@ -0,0 +1,29 @@
+"""per-question quiz results
+
+Revision ID: 0004_question_results
+Revises: 0003_question_bank
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0004_question_results"
+down_revision: Union[str, None] = "0003_question_bank"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Sessions graded before this keep their results in quiz_sessions.results_data
+    op.execute("ALTER TABLE questions ADD COLUMN IF NOT EXISTS user_answer VARCHAR")
+    op.execute("ALTER TABLE questions ADD COLUMN IF NOT EXISTS is_correct BOOLEAN")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_questions_session_id ON questions (session_id)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_questions_session_id")
+    op.execute("ALTER TABLE questions DROP COLUMN IF EXISTS is_correct")
+    op.execute("ALTER TABLE questions DROP COLUMN IF EXISTS user_answer")
@@ -0,0 +1,56 @@
+"""quiz topic stats
+
+Revision ID: 0005_quiz_topic_stats
+Revises: 0004_question_results
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0005_quiz_topic_stats"
+down_revision: Union[str, None] = "0004_question_results"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("ALTER TABLE questions ADD COLUMN IF NOT EXISTS topic VARCHAR")
+    if not sa.inspect(op.get_bind()).has_table("quiz_topic_stats"):
+        op.create_table(
+            "quiz_topic_stats",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("document_id", sa.String(), nullable=False, server_default=""),
+            sa.Column("topic", sa.String(), nullable=False, server_default=""),
+            sa.Column("question_type", sa.String(), nullable=False),
+            sa.Column("attempts", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("correct", sa.Integer(), nullable=False, server_default="0"),
+            sa.Column("last_attempt_at", sa.DateTime(), nullable=True),
+            sa.UniqueConstraint("user_id", "document_id", "topic", "question_type", name="uq_quiz_topic_stats_key"),
+        )
+    # Seed from quizzes already graded per question, also when create_all made
+    # the table: grading writes questions.is_correct too, so the recount covers
+    # any rows an app started before this migration added. Sessions that only
+    # have the legacy results_data blob carry no question type and are not counted.
+    op.execute("""
+        INSERT INTO quiz_topic_stats (user_id, document_id, topic, question_type, attempts, correct, last_attempt_at)
+        SELECT s.user_id, COALESCE(s.document_id, ''), COALESCE(q.topic, ''), q.question_type,
+               COUNT(*), COUNT(*) FILTER (WHERE q.is_correct), MAX(s.created_at)
+        FROM questions q
+        JOIN quiz_sessions s ON s.id = q.session_id
+        WHERE q.is_correct IS NOT NULL
+        GROUP BY s.user_id, COALESCE(s.document_id, ''), COALESCE(q.topic, ''), q.question_type
+        ON CONFLICT (user_id, document_id, topic, question_type) DO UPDATE SET
+            attempts = EXCLUDED.attempts,
+            correct = EXCLUDED.correct,
+            last_attempt_at = GREATEST(quiz_topic_stats.last_attempt_at, EXCLUDED.last_attempt_at)
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table("quiz_topic_stats")
+    op.execute("ALTER TABLE questions DROP COLUMN IF EXISTS topic")
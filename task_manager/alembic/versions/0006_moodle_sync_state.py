@@ -0,0 +1,25 @@
+"""moodle sync state
+
+Revision ID: 0006_moodle_sync_state
+Revises: 0005_quiz_topic_stats
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0006_moodle_sync_state"
+down_revision: Union[str, None] = "0005_quiz_topic_stats"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Empty until the account's next sync, which then does a full pass
+    op.execute("ALTER TABLE moodle_accounts ADD COLUMN IF NOT EXISTS sync_state JSONB")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE moodle_accounts DROP COLUMN IF EXISTS sync_state")
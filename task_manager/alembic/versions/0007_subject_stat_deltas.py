@@ -0,0 +1,37 @@
+"""subject stat deltas
+
+Revision ID: 0007_subject_stat_deltas
+Revises: 0006_moodle_sync_state
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0007_subject_stat_deltas"
+down_revision: Union[str, None] = "0006_moodle_sync_state"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing jobs keep subject_id NULL and are handled as full recounts
+    op.execute(
+        "ALTER TABLE subject_stat_jobs ADD COLUMN IF NOT EXISTS subject_id INTEGER "
+        "REFERENCES subjects(id) ON DELETE CASCADE"
+    )
+    op.execute("ALTER TABLE subject_stat_jobs ADD COLUMN IF NOT EXISTS held_delta INTEGER NOT NULL DEFAULT 0")
+    op.execute("ALTER TABLE subject_stat_jobs ADD COLUMN IF NOT EXISTS attended_delta INTEGER NOT NULL DEFAULT 0")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_subject_stat_jobs_pending ON subject_stat_jobs (subject_id) "
+        "WHERE status = 'PENDING'"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_subject_stat_jobs_pending")
+    op.execute("ALTER TABLE subject_stat_jobs DROP COLUMN IF EXISTS attended_delta")
+    op.execute("ALTER TABLE subject_stat_jobs DROP COLUMN IF EXISTS held_delta")
+    op.execute("ALTER TABLE subject_stat_jobs DROP COLUMN IF EXISTS subject_id")
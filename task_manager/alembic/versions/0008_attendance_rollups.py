@@ -0,0 +1,75 @@
+"""attendance rollups
+
+Revision ID: 0008_attendance_rollups
+Revises: 0007_subject_stat_deltas
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0008_attendance_rollups"
+down_revision: Union[str, None] = "0007_subject_stat_deltas"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _counter(name: str) -> sa.Column:
+    return sa.Column(name, sa.Integer(), nullable=False, server_default="0")
+
+
+def upgrade() -> None:
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("attendance_daily_stats"):
+        op.create_table(
+            "attendance_daily_stats",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("date", sa.Date(), nullable=False),
+            _counter("held"), _counter("attended"), _counter("present"), _counter("absent"), _counter("cancelled"),
+            sa.UniqueConstraint("user_id", "date", name="uq_attendance_daily_stats_key"),
+        )
+    if not inspector.has_table("attendance_weekly_stats"):
+        op.create_table(
+            "attendance_weekly_stats",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("week_start", sa.Date(), nullable=False),
+            _counter("held"), _counter("attended"),
+            sa.UniqueConstraint("user_id", "week_start", name="uq_attendance_weekly_stats_key"),
+        )
+
+    # Seed from the existing classes even when create_all made the tables
+    # first: the rows an app started before this migration wrote only cover
+    # the marks made since, so every key is overwritten with the full count.
+    op.execute("""
+        INSERT INTO attendance_daily_stats (user_id, date, held, attended, present, absent, cancelled)
+        SELECT s.user_id, ci.date,
+               COUNT(*) FILTER (WHERE ar.status IS NULL OR ar.status <> 'cancelled'),
+               COUNT(*) FILTER (WHERE ar.status = 'present'),
+               COUNT(*) FILTER (WHERE ar.status = 'present'),
+               COUNT(*) FILTER (WHERE ar.status = 'absent'),
+               COUNT(*) FILTER (WHERE ar.status = 'cancelled')
+        FROM class_instances ci
+        JOIN subjects s ON s.id = ci.subject_id
+        LEFT JOIN attendance_records ar ON ar.class_instance_id = ci.id
+        GROUP BY s.user_id, ci.date
+        ON CONFLICT (user_id, date) DO UPDATE SET
+            held = EXCLUDED.held, attended = EXCLUDED.attended, present = EXCLUDED.present,
+            absent = EXCLUDED.absent, cancelled = EXCLUDED.cancelled
+    """)
+    op.execute("""
+        INSERT INTO attendance_weekly_stats (user_id, week_start, held, attended)
+        SELECT user_id, date_trunc('week', date)::date, SUM(held), SUM(attended)
+        FROM attendance_daily_stats
+        GROUP BY user_id, date_trunc('week', date)::date
+        ON CONFLICT (user_id, week_start) DO UPDATE SET held = EXCLUDED.held, attended = EXCLUDED.attended
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table("attendance_weekly_stats")
+    op.drop_table("attendance_daily_stats")
@@ -0,0 +1,98 @@
+"""class instance slots
+
+Revision ID: 0009_class_instance_slots
+Revises: 0008_attendance_rollups
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0009_class_instance_slots"
+down_revision: Union[str, None] = "0008_attendance_rollups"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Keep one class per (subject, date, time): a marked one if there is one,
+    # else the oldest. The subject totals and the rollups 0008 seeded counted
+    # the duplicates, so the affected subjects and users are recounted below.
+    op.execute("""
+        CREATE TEMP TABLE duplicate_class_instances ON COMMIT DROP AS
+        SELECT id, subject_id FROM (
+            SELECT ci.id, ci.subject_id, row_number() OVER (
+                PARTITION BY ci.subject_id, ci.date, ci.time ORDER BY (ar.id IS NULL), ci.id
+            ) AS rn
+            FROM class_instances ci
+            LEFT JOIN attendance_records ar ON ar.class_instance_id = ci.id
+        ) ranked
+        WHERE rn > 1
+    """)
+    op.execute("DELETE FROM attendance_records WHERE class_instance_id IN (SELECT id FROM duplicate_class_instances)")
+    op.execute("DELETE FROM class_instances WHERE id IN (SELECT id FROM duplicate_class_instances)")
+
+    # Recount the affected subjects. Their pending jobs hold deltas the recount
+    # already includes, so they are settled instead of applied on top.
+    op.execute("""
+        UPDATE subjects s
+        SET total_classes_held = c.held, total_classes_attended = c.attended
+        FROM (
+            SELECT ci.subject_id,
+                   COUNT(*) FILTER (WHERE ar.status IS NULL OR ar.status <> 'cancelled') AS held,
+                   COUNT(*) FILTER (WHERE ar.status = 'present') AS attended
+            FROM class_instances ci
+            LEFT JOIN attendance_records ar ON ar.class_instance_id = ci.id
+            WHERE ci.subject_id IN (SELECT subject_id FROM duplicate_class_instances)
+            GROUP BY ci.subject_id
+        ) c
+        WHERE c.subject_id = s.id
+    """)
+    op.execute("""
+        UPDATE subject_stat_jobs SET status = 'SUCCESS'
+        WHERE status = 'PENDING' AND subject_id IN (SELECT subject_id FROM duplicate_class_instances)
+    """)
+
+    # Rebuild the rollups of the affected users, as 0008 seeded them
+    op.execute("""
+        CREATE TEMP TABLE duplicate_class_users ON COMMIT DROP AS
+        SELECT DISTINCT s.user_id FROM subjects s
+        WHERE s.id IN (SELECT subject_id FROM duplicate_class_instances)
+    """)
+    op.execute("DELETE FROM attendance_daily_stats WHERE user_id IN (SELECT user_id FROM duplicate_class_users)")
+    op.execute("DELETE FROM attendance_weekly_stats WHERE user_id IN (SELECT user_id FROM duplicate_class_users)")
+    op.execute("""
+        INSERT INTO attendance_daily_stats (user_id, date, held, attended, present, absent, cancelled)
+        SELECT s.user_id, ci.date,
+               COUNT(*) FILTER (WHERE ar.status IS NULL OR ar.status <> 'cancelled'),
+               COUNT(*) FILTER (WHERE ar.status = 'present'),
+               COUNT(*) FILTER (WHERE ar.status = 'present'),
+               COUNT(*) FILTER (WHERE ar.status = 'absent'),
+               COUNT(*) FILTER (WHERE ar.status = 'cancelled')
+        FROM class_instances ci
+        JOIN subjects s ON s.id = ci.subject_id
+        LEFT JOIN attendance_records ar ON ar.class_instance_id = ci.id
+        WHERE s.user_id IN (SELECT user_id FROM duplicate_class_users)
+        GROUP BY s.user_id, ci.date
+    """)
+    op.execute("""
+        INSERT INTO attendance_weekly_stats (user_id, week_start, held, attended)
+        SELECT user_id, date_trunc('week', date)::date, SUM(held), SUM(attended)
+        FROM attendance_daily_stats
+        WHERE user_id IN (SELECT user_id FROM duplicate_class_users)
+        GROUP BY user_id, date_trunc('week', date)::date
+    """)
+    op.execute("""
+        DO $$ BEGIN
+            IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'uq_class_instances_slot') THEN
+                ALTER TABLE class_instances
+                    ADD CONSTRAINT uq_class_instances_slot UNIQUE (subject_id, date, time);
+            END IF;
+        END $$
+    """)
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE class_instances DROP CONSTRAINT IF EXISTS uq_class_instances_slot")
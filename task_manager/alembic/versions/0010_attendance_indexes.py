@@ -0,0 +1,37 @@
+"""attendance indexes
+
+Revision ID: 0010_attendance_indexes
+Revises: 0009_class_instance_slots
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0010_attendance_indexes"
+down_revision: Union[str, None] = "0009_class_instance_slots"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # class_instances (subject_id, date, time) already exists as the
+    # uq_class_instances_slot constraint (0009).
+    op.execute("CREATE INDEX IF NOT EXISTS ix_subjects_user_id_id ON subjects (user_id, id)")
+    op.execute("DROP INDEX IF EXISTS ix_subjects_user_id")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_schedules_subject_day ON schedules (subject_id, day) INCLUDE (time)")
+    op.execute("DROP INDEX IF EXISTS ix_schedules_subject_id")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_attendance_records_instance_status "
+        "ON attendance_records (class_instance_id) INCLUDE (status)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_attendance_records_instance_status")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_schedules_subject_id ON schedules (subject_id)")
+    op.execute("DROP INDEX IF EXISTS ix_schedules_subject_day")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_subjects_user_id ON subjects (user_id)")
+    op.execute("DROP INDEX IF EXISTS ix_subjects_user_id_id")
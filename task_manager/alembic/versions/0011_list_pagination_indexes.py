@@ -0,0 +1,43 @@
+"""list pagination indexes
+
+Revision ID: 0011_list_pagination_indexes
+Revises: 0010_attendance_indexes
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0011_list_pagination_indexes"
+down_revision: Union[str, None] = "0010_attendance_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Keyset pagination compares (created_at, id) row values, which is never true
+# for a NULL timestamp, so rows created before the column had a default get
+# the epoch and sort last.
+BACKFILL = {
+    "documents": "created_at",
+    "conversations": "created_at",
+    "quiz_sessions": "created_at",
+    "tasks": "created_at",
+    "lost_and_found_items": "reported_at",
+}
+
+
+def upgrade() -> None:
+    for table, column in BACKFILL.items():
+        op.execute(f"UPDATE {table} SET {column} = '1970-01-01' WHERE {column} IS NULL")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_documents_user_created ON documents (user_id, created_at, id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_conversations_user_created ON conversations (user_id, created_at, id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_quiz_sessions_user_created ON quiz_sessions (user_id, created_at, id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_lost_and_found_items_reported ON lost_and_found_items (reported_at, id)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_lost_and_found_items_reported")
+    op.execute("DROP INDEX IF EXISTS ix_quiz_sessions_user_created")
+    op.execute("DROP INDEX IF EXISTS ix_conversations_user_created")
+    op.execute("DROP INDEX IF EXISTS ix_documents_user_created")
@@ -0,0 +1,32 @@
+"""task board indexes
+
+Revision ID: 0012_task_board_indexes
+Revises: 0011_list_pagination_indexes
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0012_task_board_indexes"
+down_revision: Union[str, None] = "0011_list_pagination_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_user_status_created "
+        "ON tasks (user_id, status, created_at, id)"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_tasks_team_status_created "
+        "ON tasks (team_id, status, created_at, id)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_tasks_team_status_created")
+    op.execute("DROP INDEX IF EXISTS ix_tasks_user_status_created")
@@ -0,0 +1,29 @@
+"""message history index
+
+Revision ID: 0013_message_history_index
+Revises: 0012_task_board_indexes
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0013_message_history_index"
+down_revision: Union[str, None] = "0012_task_board_indexes"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # History cursors compare (created_at, id), which never matches a NULL
+    op.execute("UPDATE messages SET created_at = '1970-01-01' WHERE created_at IS NULL")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_messages_conversation_created "
+        "ON messages (conversation_id, created_at, id)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_messages_conversation_created")
@@ -0,0 +1,28 @@
+"""conversation summaries
+
+Revision ID: 0014_conversation_summaries
+Revises: 0013_message_history_index
+Create Date: 2026-10-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "0014_conversation_summaries"
+down_revision: Union[str, None] = "0013_message_history_index"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Existing conversations start without a summary; the next reply in each
+    # one folds its older turns in.
+    op.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary TEXT")
+    op.execute("ALTER TABLE conversations ADD COLUMN IF NOT EXISTS summary_message_id INTEGER")
+
+
+def downgrade() -> None:
+    op.execute("ALTER TABLE conversations DROP COLUMN IF EXISTS summary_message_id")
+    op.execute("ALTER TABLE conversations DROP COLUMN IF EXISTS summary")
@@ -3,6 +3,7 @@ from celery import Celery
 import os
 from dotenv import load_dotenv
 from celery.schedules import crontab
+from kombu import Queue
 
 # This command loads all the variables from your .env file into the environment,
 # making them accessible via os.getenv().
@@ -46,10 +47,70 @@ celery_app.conf.update(
     enable_utc=True,
 )
 
-# Only schedule the extraction task
+# --- Queues and routing ---
+# Each workload has its own queue so a long OCR job never sits in front of a
+# quick stats refresh. docker-compose runs one worker service per queue, with
+# a pool/concurrency/prefetch suited to it (see README "Celery workers").
+# Tasks not listed here (and unnamed ad-hoc ones) go to the default queue.
+INGESTION_QUEUE = "ingestion"  # CPU heavy: OCR, chunking, embeddings
+LLM_QUEUE = "llm"              # Waiting on Gemini: quizzes, question banks, documents
+MOODLE_QUEUE = "moodle"        # Waiting on Moodle: per-user syncs
+STATS_QUEUE = "stats"          # Short DB-only jobs
+
+celery_app.conf.update(
+    task_default_queue="default",
+    task_queues=[
+        Queue("default"),
+        Queue(INGESTION_QUEUE),
+        Queue(LLM_QUEUE),
+        Queue(MOODLE_QUEUE),
+        Queue(STATS_QUEUE),
+    ],
+    task_routes={
+        "process_document_task": {"queue": INGESTION_QUEUE},
+        "process_quiz_document": {"queue": INGESTION_QUEUE},
+        "build_question_bank_task": {"queue": LLM_QUEUE},
+        "generate_quiz_task": {"queue": LLM_QUEUE},
+        "generate_document_task": {"queue": LLM_QUEUE},
+        "update_conversation_summary": {"queue": LLM_QUEUE},
+        "extract_data_task": {"queue": MOODLE_QUEUE},
+        "extract_all_users_data_task": {"queue": MOODLE_QUEUE},
+        "update_subject_stats": {"queue": STATS_QUEUE},
+        "reconcile_subject_stats": {"queue": STATS_QUEUE},
+        "refresh_attendance_rollups": {"queue": STATS_QUEUE},
+        "materialize_class_instances_task": {"queue": STATS_QUEUE},
+    },
+    # Time limits and acks_late are set per task in celery_worker.py. With
+    # acks_late a message stays unacknowledged while its task runs, and Redis
+    # hands it to another worker once the visibility timeout passes, so the
+    # timeout has to be longer than the longest hard time limit.
+    broker_transport_options={"visibility_timeout": int(os.getenv("CELERY_VISIBILITY_TIMEOUT", 2 * 3600))},
+    # A task whose worker process died (OOM on a huge PDF) is redelivered
+    # instead of being lost; only matters for acks_late tasks.
+    task_reject_on_worker_lost=True,
+)
+
+# Only schedule the extraction task. The task itself spreads the users over
+# the interval, so keep MOODLE_SYNC_INTERVAL_MINUTES the same for beat and workers.
+MOODLE_SYNC_INTERVAL_MINUTES = int(os.getenv("MOODLE_SYNC_INTERVAL_MINUTES", 15))
+
 celery_app.conf.beat_schedule = {
     "extract-task-every-15-mins": {
         "task": "extract_all_users_data_task",  # only this task
-        "schedule": crontab(minute="*/15"),
+        "schedule": crontab(minute=f"*/{MOODLE_SYNC_INTERVAL_MINUTES}"),
+    },
+    # Subject totals are kept up to date with deltas; this recount only
+    # catches drift (failed jobs, manual DB edits).
+    "reconcile-subject-stats-nightly": {
+        "task": "reconcile_subject_stats",
+        "schedule": crontab(hour=3, minute=30),
+    },
+    "materialize-class-instances-nightly": {
+        "task": "materialize_class_instances_task",
+        "schedule": crontab(hour=0, minute=5),
+    },
+    "refresh-attendance-rollups-nightly": {
+        "task": "refresh_attendance_rollups",
+        "schedule": crontab(hour=3, minute=45),
     },
 }
\ No newline at end of file
@@ -6,17 +6,53 @@ from .celery_config import celery_app
 from app.utils import populate_database as populate_db
 from app.utils.tasks import fetch_and_store_moodle_tasks
 from app.utils import quiz as quiz
+from app.utils import question_bank
+from app.utils import attendance
+from app.utils import memory
+from app.utils.redis_store import get_redis
 from app import models
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy import func, case
 from app.utils.basic_1 import run_full_generation_process
-from sqlalchemy.orm import aliased
+from app.utils import metrics
+from celery.signals import task_prerun, task_postrun, worker_process_init
+import threading
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
 # We import the database URL so the worker knows how to connect to your main SQL database.
 from dotenv import load_dotenv
 load_dotenv()
 import os
 
+# --- Metrics export ---
+# Each prefork child keeps its own in-memory metrics, so every child serves them
+# on its own port: METRICS_PORT + pool index (9101, 9102, ... by default).
+METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", 9101))
+_task_started_at = {}
+
+
+@worker_process_init.connect
+def start_worker_metrics(**kwargs):
+    from billiard.process import current_process
+    index = getattr(current_process(), "index", 0) or 0
+    metrics.start_metrics_server(METRICS_PORT + index)
+
+
+@task_prerun.connect
+def record_task_start(task_id=None, **kwargs):
+    _task_started_at[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def record_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started_at.pop(task_id, None)
+    if started is None:
+        return
+    metrics.observe(metrics.STAGE_HISTOGRAM, time.perf_counter() - started, stage="celery_task", task=task.name)
+    metrics.inc("celery_tasks_total", task=task.name, state=state or "UNKNOWN")
+
 # --- Standalone DB Session for Background Task ---
 # The background task runs in a separate context and needs its own DB connection.
 engine = create_engine(os.getenv("DATABASE_URL"))
@@ -24,11 +60,23 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def get_standalone_session():
     return SessionLocal()
+
+# --- Per-task delivery and time limits ---
+# acks_late (redeliver if the worker dies mid-task) is only used where running a
+# task twice is harmless: ingestion writes chunks under deterministic ids, the
+# bank and Moodle syncs skip duplicates, stats are recomputed from scratch.
+# Quiz and document generation would create a second result, so they are
+# acknowledged on receipt. Soft limits raise SoftTimeLimitExceeded inside the
+# task (handled like any other failure); the hard limit kills the process.
+INGESTION_TIME_LIMITS = {"soft_time_limit": 55 * 60, "time_limit": 60 * 60}
+LLM_TIME_LIMITS = {"soft_time_limit": 15 * 60, "time_limit": 20 * 60}
+STATS_TIME_LIMITS = {"soft_time_limit": 60, "time_limit": 120}
+
 # This is a "decorator". It's a special instruction that tells Celery:
 # "The function directly below this line is a background task."
 # name="process_document_task": This gives the task a unique name. This is how
 # your FastAPI app will refer to this specific job.
-@celery_app.task(name="process_document_task")
+@celery_app.task(name="process_document_task", acks_late=True, **INGESTION_TIME_LIMITS)
 def process_document_task(doc_id: str, file_path: str, tag: str, user_id: str):
     """
     This is the Celery task that wraps your existing ingestion pipeline.
@@ -56,7 +104,7 @@ def process_document_task(doc_id: str, file_path: str, tag: str, user_id: str):
     # The worker prints this message when the job is complete.
     print(f"CELERY WORKER: Finished job for doc_id: {doc_id}")
     
-@celery_app.task(name="process_quiz_document")
+@celery_app.task(name="process_quiz_document", acks_late=True, **INGESTION_TIME_LIMITS)
 def process_quiz_document(doc_id: str, file_path: str, tag: str, user_id: str):
     """
     This is the Celery task that wraps your existing ingestion pipeline.
@@ -78,36 +126,251 @@ def process_quiz_document(doc_id: str, file_path: str, tag: str, user_id: str):
     
     print(f"CELERY WORKER: Finished job for Quiz doc_id: {doc_id}")
 
-    
-@celery_app.task(name="extract_data_task")
-def extract_data_task(user_id: int):
-    """Fetch Moodle tasks for a specific user."""
+    # Pre-generate the question bank so the first quiz on this document is instant
+    db = get_standalone_session()
+    try:
+        doc_status = db.query(models.Document.status).filter(models.Document.id == doc_id).scalar()
+    finally:
+        db.close()
+    if doc_status == models.DocumentStatus.COMPLETED:
+        build_question_bank_task.delay(doc_id=doc_id, tag=tag)
+
+
+QUESTION_BANK_LOCK_SECONDS = 30 * 60
+
+
+@celery_app.task(name="build_question_bank_task", acks_late=True, **LLM_TIME_LIMITS)
+def build_question_bank_task(doc_id: str, tag: str, language: str = "English", hard_mode: bool = False):
+    """
+    Generates bank questions for a document. Builds and top-ups for the same
+    document and settings never run concurrently; duplicates are dropped.
+    """
+    lock_key = f"question_bank:lock:{doc_id}:{language}:{int(hard_mode)}"
+    try:
+        if not get_redis().set(lock_key, "1", nx=True, ex=QUESTION_BANK_LOCK_SECONDS):
+            return f"Question bank build already running for doc_id {doc_id}"
+    except Exception as e:
+        print(f"CELERY WORKER: Could not take question bank lock for doc_id {doc_id}: {e}")
+
+    db = get_standalone_session()
+    try:
+        added = question_bank.build_question_bank(db, doc_id, tag, language, hard_mode)
+        return f"Added {added} bank questions for doc_id {doc_id}"
+    except Exception as e:
+        db.rollback()
+        print(f"CELERY WORKER: Question bank build failed for doc_id {doc_id}: {e}")
+        return f"Error building question bank for doc_id {doc_id}: {e}"
+    finally:
+        db.close()
+        try:
+            get_redis().delete(lock_key)
+        except Exception:
+            pass
 
-        
-    new_tasks = fetch_and_store_moodle_tasks(user_id)
-    
-    return f"Inserted {len(new_tasks)} tasks for user {user_id}"
     
+QUIZ_QUESTION_FLUSH_SIZE = 5
+
+
+@celery_app.task(name="generate_quiz_task", **LLM_TIME_LIMITS)
+def generate_quiz_task(session_id: int, tag: str | None = None):
+    """
+    Builds the quiz content (document chunks or pasted text), calls the LLM and
+    stores the questions of a QuizSession created by /generate_quiz.
+    """
+    db = get_standalone_session()
+    db_session = None
+    try:
+        db_session = db.query(models.QuizSession).filter(models.QuizSession.id == session_id).first()
+        if not db_session:
+            raise Exception(f"Quiz session {session_id} not found in database.")
+
+        db_session.generation_status = models.GenerationStatus.PROCESSING
+        db.commit()
+        quiz.publish_quiz_status(session_id, models.GenerationStatus.PROCESSING.value)
+
+        if db_session.document_id:
+            source_document = db_session.source_document
+            if source_document is not None and not source_document.topic_index:
+                # Ingested before topic indexes existed: build it once from Chroma and keep it
+                try:
+                    source_document.topic_index = populate_db.build_topic_index_from_collection(tag, source_document.id)
+                except Exception as e:
+                    print(f"CELERY WORKER: Could not build topic index for doc_id {source_document.id}: {e}")
+            contents = quiz.get_representative_chunks_by_topic(
+                tag=tag,
+                source_doc_id=db_session.document_id,
+                topic_index=source_document.topic_index if source_document is not None else None
+            )
+        else:
+            contents = [db_session.raw_content] if db_session.raw_content else []
+        if not contents:
+            raise ValueError("Content for quiz generation is empty or could not be found.")
+
+        # Questions are stored in small multi-row inserts as they are parsed from
+        # the stream, so the status endpoint can report progress (question_count)
+        # while the model is still writing. Batches run in parallel threads; the
+        # session is shared under a lock.
+        db_lock = threading.Lock()
+        pending = []
+
+        def store_question(q_data):
+            with db_lock:
+                pending.append(q_data)
+                if len(pending) >= QUIZ_QUESTION_FLUSH_SIZE:
+                    quiz.bulk_insert_questions(db, session_id, pending)
+                    db.commit()
+                    pending.clear()
+
+        questions = quiz.generate_quiz_batched(contents, db_session.quiz_settings, on_question=store_question)
+        if not questions:
+            raise ValueError("The model did not return any valid questions.")
+
+        quiz.bulk_insert_questions(db, session_id, pending)
+        db_session.generation_status = models.GenerationStatus.COMPLETED
+        with metrics.span("db_commit", site="quiz"):
+            db.commit()
+        quiz.publish_quiz_status(session_id, models.GenerationStatus.COMPLETED.value)
+        print(f"CELERY WORKER: Generated quiz for session {session_id}")
+        return {"status": "completed", "session_id": session_id}
+
+    except Exception as e:
+        print(f"CELERY WORKER: Quiz generation failed for session {session_id}: {e}")
+        db.rollback()
+        if db_session:
+            # Drop the questions flushed before the failure; a failed quiz has none
+            db.query(models.Question).filter(models.Question.session_id == session_id).delete(synchronize_session=False)
+            db_session.generation_status = models.GenerationStatus.FAILED
+            db_session.error_message = str(e)
+            db.commit()
+            quiz.publish_quiz_status(session_id, models.GenerationStatus.FAILED.value, str(e))
+        return {"status": "failed", "error": str(e)}
+
+    finally:
+        db.close()
+
+
+# --- Moodle sync scheduling ---
+# Every beat run spreads the auto-sync users over the whole interval: a user
+# always gets the same offset (crc32 of the id), so each one is synced once per
+# interval without everyone hitting Moodle at :00/:15/:30/:45.
+MOODLE_SYNC_INTERVAL_SECONDS = int(os.getenv("MOODLE_SYNC_INTERVAL_MINUTES", 15)) * 60
+MOODLE_SYNC_MIN_AGE_SECONDS = int(os.getenv("MOODLE_SYNC_MIN_AGE_SECONDS", MOODLE_SYNC_INTERVAL_SECONDS // 2))
+MOODLE_SYNC_MAX_RUNTIME_SECONDS = int(os.getenv("MOODLE_SYNC_MAX_RUNTIME_SECONDS", 600))
+MOODLE_SCHEDULE_BATCH_SIZE = int(os.getenv("MOODLE_SCHEDULE_BATCH_SIZE", 500))
+
+
+def moodle_sync_lock_key(user_id: int) -> str:
+    return f"moodle:sync:lock:{user_id}"
 
 
-@celery_app.task(name="extract_all_users_data_task")
+def moodle_sync_offset(user_id: int) -> int:
+    return zlib.crc32(str(user_id).encode("utf-8")) % MOODLE_SYNC_INTERVAL_SECONDS
+
+
+# The hard limit matches the lock TTL, so a killed sync never outlives its lock
+@celery_app.task(name="extract_data_task", acks_late=True,
+                 soft_time_limit=MOODLE_SYNC_MAX_RUNTIME_SECONDS - 30, time_limit=MOODLE_SYNC_MAX_RUNTIME_SECONDS)
+def extract_data_task(user_id: int, lock_token: str | None = None):
+    """
+    Fetch Moodle tasks for a specific user.
+
+    The per-user sync lock holds "queued:<token>" from the moment the scheduler
+    queues a run and "running:<token>" while one runs. Scheduled runs carry
+    their token and stand down if a manual run took over in the meantime;
+    manual runs (no token) are only skipped while another sync is running.
+    """
+    lock_key = moodle_sync_lock_key(user_id)
+    running = None
+    try:
+        client = get_redis()
+        current = client.get(lock_key)
+        if lock_token is not None and current != f"queued:{lock_token}":
+            return f"Skipped user {user_id}: synced by another run"
+        if lock_token is None and current and current.startswith("running:"):
+            return f"Skipped user {user_id}: a sync is already in progress"
+        running = f"running:{lock_token or uuid.uuid4().hex}"
+        client.set(lock_key, running, ex=MOODLE_SYNC_MAX_RUNTIME_SECONDS)
+    except Exception as e:
+        # Without Redis we cannot coordinate; syncing anyway is better than never
+        print(f"CELERY WORKER: Could not take Moodle sync lock for user {user_id}: {e}")
+
+    try:
+        new_tasks = fetch_and_store_moodle_tasks(user_id)
+        return f"Inserted {len(new_tasks)} tasks for user {user_id}"
+    finally:
+        if running:
+            try:
+                client = get_redis()
+                if client.get(lock_key) == running:
+                    client.delete(lock_key)
+            except Exception as e:
+                print(f"CELERY WORKER: Could not release Moodle sync lock for user {user_id}: {e}")
+
+
+@celery_app.task(name="extract_all_users_data_task", soft_time_limit=240, time_limit=300)
 def extract_all_users_data_task():
+    """
+    Queues one staggered extract_data_task per auto-sync user. Users are read
+    in id-ordered batches (keyset pagination); users whose last sync is less
+    than MOODLE_SYNC_MIN_AGE_SECONDS before the run being scheduled, or with a
+    sync still queued/running, are skipped.
+    """
     db = get_standalone_session()
     try:
-        users = (
-            db.query(models.User)
-            .filter(models.User.moodle_account != None)
-            .join(models.MoodleAccount)
-            .filter(models.MoodleAccount.auto_sync == True)  # 👈 only auto_sync users
-            .all()
-        )
-        for user in users:
-            extract_data_task.delay(user.id)
-        return f"Queued extraction for {len(users)} users"
+        client = get_redis()
+    except Exception as e:
+        # Queue without locks rather than skipping every user this interval
+        print(f"CELERY WORKER: Redis unavailable, scheduling Moodle syncs without locks: {e}")
+        client = None
+    now = datetime.now(timezone.utc)
+    queued = skipped = 0
+    last_id = 0
+    try:
+        while True:
+            batch = (
+                db.query(models.MoodleAccount.user_id, models.MoodleAccount.last_synced_at)
+                .filter(models.MoodleAccount.auto_sync == True, models.MoodleAccount.user_id > last_id)
+                .order_by(models.MoodleAccount.user_id)
+                .limit(MOODLE_SCHEDULE_BATCH_SIZE)
+                .all()
+            )
+            if not batch:
+                break
+            last_id = batch[-1].user_id
+
+            for user_id, last_synced_at in batch:
+                countdown = moodle_sync_offset(user_id)
+                if last_synced_at is not None:
+                    if last_synced_at.tzinfo is None:
+                        last_synced_at = last_synced_at.replace(tzinfo=timezone.utc)
+                    # Measured from when this run will start, not from now: the
+                    # previous run started at the same offset, so its
+                    # last_synced_at is about one interval (plus its runtime) earlier
+                    scheduled_at = now + timedelta(seconds=countdown)
+                    if scheduled_at - last_synced_at < timedelta(seconds=MOODLE_SYNC_MIN_AGE_SECONDS):
+                        skipped += 1
+                        continue
+
+                lock_token = None
+                if client is not None:
+                    lock_token = uuid.uuid4().hex
+                    try:
+                        # The lock covers the wait before the task starts and its run
+                        if not client.set(moodle_sync_lock_key(user_id), f"queued:{lock_token}", nx=True,
+                                          ex=countdown + MOODLE_SYNC_MAX_RUNTIME_SECONDS):
+                            skipped += 1
+                            continue
+                    except Exception as e:
+                        print(f"CELERY WORKER: Could not take Moodle sync lock for user {user_id}: {e}")
+                        lock_token = None
+                extract_data_task.apply_async(args=[user_id], kwargs={"lock_token": lock_token}, countdown=countdown)
+                queued += 1
+
+        return f"Queued extraction for {queued} users, skipped {skipped}"
     finally:
         db.close()
 
-@celery_app.task(name="generate_document_task")
+@celery_app.task(name="generate_document_task", **LLM_TIME_LIMITS)
 def generate_document_task(output_file_path: str, task_id: str, user_id: int, payload_dict: dict):
     """
     Celery worker task.
@@ -141,7 +404,8 @@ def generate_document_task(output_file_path: str, task_id: str, user_id: int, pa
         print(f"[Task {task_id}] Generation successful. Updating DB status to COMPLETED.")
         db_doc.status = models.GenerationStatus.COMPLETED
         db_doc.generated_content = final_path # Store the *actual* final path
-        db.commit()
+        with metrics.span("db_commit", site="document_generation"):
+            db.commit()
         
         return {"status": "completed", "task_id": task_id}
 
@@ -164,75 +428,100 @@ def generate_document_task(output_file_path: str, task_id: str, user_id: int, pa
         if db:
             db.close()
 
-@celery_app.task(name="update_subject_stats")
-def update_subject_stats(subject_id: int, job_id: str):
+@celery_app.task(name="update_subject_stats", acks_late=True, **STATS_TIME_LIMITS)
+def update_subject_stats(subject_id: int, job_id: int):
     """
-    A Celery task to recalculate stats.
-    
-    --- UPGRADED LOGIC ---
-    - total_classes_held: Now EXCLUDES cancelled classes.
-    - total_classes_attended: Only counts 'present' classes.
+    Applies a SubjectStatJob to its subject's totals.
+
+    The job carries the held/attended deltas of every class added or mark
+    changed since it was created (see app/utils/attendance.py), so this is a
+    single UPDATE instead of a recount of all the subject's classes. Jobs
+    queued before deltas existed are applied as a recount.
     """
     db = get_standalone_session()
-    
-    job = db.query(models.SubjectStatJob).filter(models.SubjectStatJob.id == job_id).first()
-    if not job:
-        print(f"FATAL: SubjectStatJob {job_id} not found.")
-        return
-
-    job.status = models.JobStatusEnum.RUNNING
-    db.commit()
-    
     try:
-        subject = db.query(models.Subject).filter(models.Subject.id == subject_id).first()
-        if not subject:
-            raise Exception(f"Subject {subject_id} not found.")
-
-        # --- UPGRADED STATS LOGIC ---
-        
-        # Alias for the optional relationship
-        AR = aliased(models.AttendanceRecord)
-
-        # Count 1 if status is 'present', 0 otherwise
-        attended_case = case(
-            (AR.status == models.AttendanceStatus.present, 1),
-            else_=0
-        )
-        
-        # Count 1 if status is NOT 'cancelled' (including NULL/unmarked), 0 otherwise
-        held_case = case(
-            (AR.status == models.AttendanceStatus.cancelled, 0),
-            else_=1
-        )
-
-        stats = (
-            db.query(
-                func.sum(held_case).label("total_held"),
-                func.sum(attended_case).label("total_attended")
-            )
-            .select_from(models.ClassInstance) # Start from ClassInstance
-            .outerjoin(AR, models.ClassInstance.attendance_record) # Use the alias
-            .filter(models.ClassInstance.subject_id == subject_id)
-        ).one()
-        
-        # --- END OF UPGRADED STATS LOGIC ---
-
-        subject.total_classes_held = stats.total_held
-        subject.total_classes_attended = stats.total_attended
-        
-        job.status = models.JobStatusEnum.SUCCESS
-        db.commit()
-        
+        job = attendance.apply_stat_job(db, job_id, subject_id)
+        if job is None:
+            print(f"FATAL: SubjectStatJob {job_id} not found.")
+            return
+        with metrics.span("db_commit", site="subject_stats"):
+            db.commit()
         print(f"CELERY TASK SUCCESS (Job ID: {job_id}): Stats updated for Subject {subject_id}")
-        return f"Stats updated for Subject {subject_id}: Held={stats.total_held}, Attended={stats.total_attended}"
+        return f"Stats updated for Subject {subject_id}: held {job.held_delta:+d}, attended {job.attended_delta:+d}"
 
     except Exception as e:
         print(f"!!!!!!!!!!!!!!! CELERY JOB FAILED (Job ID: {job_id}) !!!!!!!!!!!!!!!")
-        # ... (rest of your error handling)
         db.rollback()
-        job.status = models.JobStatusEnum.FAILURE
-        job.error_message = str(e)
-        db.commit()
+        job = db.query(models.SubjectStatJob).filter(models.SubjectStatJob.id == job_id).first()
+        if job:
+            job.status = models.JobStatusEnum.FAILURE
+            job.error_message = str(e)
+            db.commit()
         return f"Error updating stats for Subject {subject_id}: {e}"
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+
+@celery_app.task(name="reconcile_subject_stats", acks_late=True, soft_time_limit=25 * 60, time_limit=30 * 60)
+def reconcile_subject_stats():
+    """
+    Nightly consistency check: recounts every subject's totals from its
+    classes and fixes the ones the delta updates got wrong.
+    """
+    db = get_standalone_session()
+    try:
+        checked, corrected = attendance.reconcile_subject_stats(db)
+        return f"Checked {checked} subjects, corrected {corrected}"
+    finally:
+        db.close()
+
+
+@celery_app.task(name="materialize_class_instances_task", acks_late=True, soft_time_limit=25 * 60, time_limit=30 * 60)
+def materialize_class_instances_task():
+    """
+    Nightly: creates the ClassInstance rows up to each user's local today
+    from every user's schedules, so the attendance read endpoints never have
+    to write. Future classes are never created (they would count as held).
+    """
+    db = get_standalone_session()
+    try:
+        created = attendance.materialize_upcoming_classes(db, datetime.now(timezone.utc))
+        return f"Created {created} class instances"
+    finally:
+        db.close()
+
+
+@celery_app.task(name="refresh_attendance_rollups", acks_late=True, soft_time_limit=25 * 60, time_limit=30 * 60)
+def refresh_attendance_rollups():
+    """
+    Nightly rebuild of the daily/weekly attendance rollups from the classes,
+    in case a write path ever missed an update.
+    """
+    db = get_standalone_session()
+    try:
+        refreshed = attendance.refresh_all_attendance_rollups(db)
+        return f"Rebuilt attendance rollups for {refreshed} users"
+    finally:
+        db.close()
+
+
+@celery_app.task(name="update_conversation_summary", acks_late=True, soft_time_limit=2 * 60, time_limit=3 * 60)
+def update_conversation_summary(conversation_id: str):
+    """
+    Folds the conversation's turns that left the prompt window into its
+    rolling summary (see app/utils/memory.py), one batch per run; a long
+    backlog queues the next run. Safe to run twice: the summary is only
+    written if no other run moved it meanwhile.
+    """
+    db = get_standalone_session()
+    try:
+        folded, more = memory.update_conversation_summary(db, conversation_id)
+        if more:
+            update_conversation_summary.delay(conversation_id)
+        return f"Folded {folded} messages into the summary of conversation {conversation_id}"
+    except Exception as e:
+        print(f"Summary update failed for conversation {conversation_id}: {e}")
+        db.rollback()
+        return f"Error updating summary of conversation {conversation_id}: {e}"
+    finally:
+        db.close()
@@ -1,7 +1,8 @@
 from fastapi import FastAPI, Depends, HTTPException, status, Request, Response, Cookie, UploadFile, File, Form, BackgroundTasks, Header, Security
-from fastapi.responses import JSONResponse, RedirectResponse
-from sqlalchemy.orm import Session, joinedload, aliased
-from sqlalchemy import desc, func, extract, and_ , case
+from fastapi.responses import JSONResponse, RedirectResponse, PlainTextResponse, StreamingResponse
+from sqlalchemy.orm import Session
+from sqlalchemy import func, and_ , update
+from sqlalchemy.exc import IntegrityError
 from fastapi.responses import FileResponse
 from datetime import datetime, date , timezone
 import uuid
@@ -26,6 +27,13 @@ from fastapi.staticfiles import StaticFiles
 import app.utils.summarize as summarize 
 import app.utils.tasks as tasks
 import app.utils.moderation as moderation
+from app.utils import metrics
+from app.utils import profiling
+from app.utils import question_bank
+from app.utils import attendance
+from app.utils.pagination import paginate, clamp_limit, DEFAULT_PAGE_SIZE, NEXT_CURSOR_HEADER
+from app.utils import task_board
+from app.utils import memory
 from redis import asyncio as aioredis
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadTimeSignature
 from pydantic_settings import BaseSettings
@@ -76,6 +84,34 @@ def get_db():
     finally:
         db.close()
 
+REDIS_HOST = os.environ.get("REDIS_HOST", "redis")
+REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
+
+redis_client = aioredis.from_url(
+    f"redis://{REDIS_HOST}:{REDIS_PORT}",
+    decode_responses=True, # Decode responses from bytes to strings
+    health_check_interval=30
+)
+
+async def get_redis_client():
+    """
+    Dependency to provide the Redis client.
+    Handles connection errors gracefully.
+    """
+    try:
+        # The client pool handles the connection. We just return the client.
+        # A quick ping to check if the connection is alive.
+        await redis_client.ping()
+        return redis_client
+    except Exception as e:
+        # This will be caught by FastAPI
+        print(f"Could not connect to Redis at {REDIS_HOST}:{REDIS_PORT}: {e}")
+        raise HTTPException(
+            status_code=503, # 503 Service Unavailable
+            detail=f"Could not connect to Redis cache: {e}"
+        )
+
+
 def _build_cors_origins() -> list[str]:
     origins = {
         "http://localhost:3000",
@@ -99,6 +135,8 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # List endpoints return the cursor of their next page in this header
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
 # Session middleware
@@ -108,6 +146,14 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def request_profiler(request: Request, call_next):
+    # Opt-in only: X-Profile header matching PROFILING_TOKEN, or PROFILING_SAMPLE_RATE
+    if not profiling.should_profile(request):
+        return await call_next(request)
+    return await profiling.profile_request(request, call_next, redis_client)
+
+
 
     
 SES_CLIENT = boto3.client(
@@ -194,6 +240,15 @@ def _set_login_cookies(response: Response, user_id: int):
 @app.get("/")
 def read_root():
     return {"message": "Hello World"}
+
+
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def prometheus_metrics(authorization: Optional[str] = Header(None)):
+    # Scrapers authenticate with a static bearer token when METRICS_TOKEN is set
+    metrics_token = os.getenv("METRICS_TOKEN")
+    if metrics_token and authorization != f"Bearer {metrics_token}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
 @app.post("/upload_doc")
 async def upload_doc(
    # background_tasks: BackgroundTasks,
@@ -320,16 +375,18 @@ async def get_document_status(
 
 @app.get("/documents", response_model=List[schemas.Document])
 async def read_user_documents(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
     """
-    Retrieves all documents uploaded by the currently authenticated user.
+    Retrieves a page of the documents uploaded by the currently authenticated
+    user, newest first. The next page's cursor is in the X-Next-Cursor header.
     """
-    # Query the Document table, filtering by the current user's ID.
-    # The '.all()' executes the query and returns a list of results.
-    documents = db.query(models.Document).filter(models.Document.user_id == current_user.id).all()
-    return documents
+    query = db.query(models.Document).filter(models.Document.user_id == current_user.id)
+    return paginate(query, (models.Document.created_at, models.Document.id), cursor, limit, response)
 @app.delete("/documents/{doc_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_document(
     doc_id: str, 
@@ -372,22 +429,55 @@ async def delete_all_documents(
     return {"message": "Documents are Deleted Successfully"}
 @app.get("/conversations", response_model=List[schemas.Conversation])
 async def get_conversations(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    conversations = db.query(models.Conversation).filter(models.Conversation.user_id == current_user.id).order_by(desc(models.Conversation.created_at)).all()
-    return conversations
+    query = db.query(models.Conversation).filter(models.Conversation.user_id == current_user.id)
+    return paginate(query, (models.Conversation.created_at, models.Conversation.id), cursor, limit, response)
 
 @app.get("/conversations/{conversation_id}", response_model=schemas.ConversationWithMessages)
 async def get_conversation_history(
     conversation_id: str,
+    response: Response,
+    limit: int = memory.HISTORY_PAGE_SIZE,
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db)
 ):
-    conversation = db.query(models.Conversation).filter(models.Conversation.id == conversation_id, models.Conversation.user_id == current_user.id).first()
+    """
+    The conversation with its latest `limit` messages, oldest first. If there
+    are older ones, X-Next-Cursor is the cursor for /conversations/{id}/messages.
+    """
+    conversation, messages = memory.history_page(db, conversation_id, current_user.id, None, limit, response)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
-    return conversation
+    return schemas.ConversationWithMessages(
+        id=conversation.id,
+        title=conversation.title,
+        user_id=conversation.user_id,
+        created_at=conversation.created_at,
+        messages=[schemas.Message.model_validate(message) for message in messages],
+    )
+
+@app.get("/conversations/{conversation_id}/messages", response_model=List[schemas.Message])
+async def get_conversation_messages(
+    conversation_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = memory.HISTORY_PAGE_SIZE,
+    current_user: models.User = Depends(get_current_active_user),
+    db: Session = Depends(get_db)
+):
+    """
+    Scroll-back: the `limit` messages before `cursor`, oldest first, with
+    X-Next-Cursor set while even older messages exist.
+    """
+    conversation, messages = memory.history_page(db, conversation_id, current_user.id, cursor, limit, response)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return messages
 
 # delete a conversation and its messages
 @app.delete("/conversations/{conversation_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -416,27 +506,21 @@ async def ask_question(
 
     conversation_id = ask_request.conversation_id
     chat_history_messages = []
+    new_conversation = None
+    asked_at = datetime.now(timezone.utc)
 
-    # If a conversation_id is provided, load its history
+    # If a conversation_id is provided, load it with its recent history (one query)
     if conversation_id:
-        conversation = db.query(models.Conversation).filter(models.Conversation.id == conversation_id).first()
-        if not conversation or conversation.user_id != current_user.id:
+        conversation, chat_history_messages = memory.prompt_history(db, conversation_id, current_user.id)
+        if not conversation:
             raise HTTPException(status_code=404, detail="Conversation not found or not owned by user")
-        # Fetch last 6 messages to keep the context window reasonable
-        chat_history_messages = db.query(models.Message).filter(models.Message.conversation_id == conversation_id).order_by(desc(models.Message.created_at)).limit(6).all()
-        chat_history_messages.reverse() # Reverse to get chronological order
+        # Don't hold a pooled connection (idle in transaction) while the LLM runs
+        db.close()
     else:
-        # If no ID, create a new conversation
+        # If no ID, create a new conversation; it is saved with its first messages
         conversation_id = str(uuid.uuid4())
         title = ask_request.question[:50] # Use first 50 chars as title
-        conversation = models.Conversation(id=conversation_id, title=title, user_id=current_user.id)
-        db.add(conversation)
-        db.commit()
-
-    # Save the user's new message
-    user_message = models.Message(conversation_id=conversation_id, role="user", content=ask_request.question)
-    db.add(user_message)
-    db.commit()
+        new_conversation = models.Conversation(id=conversation_id, title=title, user_id=current_user.id)
 
     # Tree-based lexical retrieval (topic/page hierarchy aware)
     context_docs = populate_db.retrieve_tree_based_context(
@@ -449,11 +533,23 @@ async def ask_question(
 
     # Get response from Gemini-backed RAG answerer
     formatted_history = populate_db.format_chat_history(chat_history_messages)
-    answer = populate_db.query_llm(ask_request.question, context_text, formatted_history)
-    # Save the assistant's response
-    assistant_message = models.Message(conversation_id=conversation_id, role="assistant", content=answer, sources=sources)
-    db.add(assistant_message)
-    db.commit()
+    summary = conversation.summary if new_conversation is None else None
+    answer = populate_db.query_llm(ask_request.question, context_text, formatted_history, summary)
+    # Save the question and the response together, in one transaction
+    if new_conversation is not None:
+        db.add(new_conversation)
+    db.add_all([
+        models.Message(conversation_id=conversation_id, role="user", content=ask_request.question, created_at=asked_at),
+        models.Message(conversation_id=conversation_id, role="assistant", content=answer, sources=sources),
+    ])
+    with metrics.span("db_commit", site="ask"):
+        db.commit()
+
+    # Fold the turns that just left the prompt window into the rolling summary
+    try:
+        celery_app.send_task("update_conversation_summary", args=[conversation_id])
+    except Exception as e:
+        print(f"Could not queue summary update for conversation {conversation_id}: {e}")
 
     return schemas.AskResponse(answer=answer, sources=sources, conversation_id=conversation_id)
 
@@ -731,33 +827,30 @@ async def create_task(
 #     return tasks
 @app.get("/tasks", response_model=List[schemas.Task])
 async def read_tasks(
+    response: Response,
     current_user: models.User = Depends(get_current_active_user),
-    skip: int = 0,
+    cursor: Optional[str] = None,
     limit: int = 60,
+    if_none_match: Optional[str] = Header(None),
     db: Session = Depends(get_db),
 ):
-    user_teams = db.query(models.UserTeam).filter(models.UserTeam.user_id == current_user.id).all()
-    team_ids = [team.team_id for team in user_teams] + [0]
-
-    # base filter (user or team)
-    base_filter = (models.Task.user_id == current_user.id) | (models.Task.team_id.in_(team_ids))
-
-    # Query all todo and inprogress tasks
-    todo_and_inprogress_tasks = db.query(models.Task).filter(
-        base_filter,
-        models.Task.status.in_(["todo", "in_progress"])
-    ).offset(skip).limit(limit).all()
-
-    # Query only 5 most recent done tasks
-    done_tasks = db.query(models.Task).filter(
-        base_filter,
-        models.Task.status == "done"
-    ).order_by(models.Task.created_at.desc()).limit(5).all()
-
-    # Combine them (done last if you want order preserved)  
-    tasks = todo_and_inprogress_tasks + done_tasks
-
-    return tasks
+    """
+    A page of the user's and their teams' todo/in-progress tasks, newest
+    first, followed on the first page by the 5 most recent done tasks. One
+    query; answers 304 when the board matches the client's ETag.
+    """
+    tasks = task_board.load_task_board(db, current_user.id, cursor, clamp_limit(limit), response)
+    payload = task_board.serialize_board(tasks)
+    next_cursor = response.headers.get(NEXT_CURSOR_HEADER)
+    etag = task_board.board_etag(payload, next_cursor)
+
+    # Per user and always revalidated, so edits show up immediately
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if next_cursor:
+        headers[NEXT_CURSOR_HEADER] = next_cursor
+    if task_board.etag_matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return JSONResponse(content=payload, headers=headers)
 
 @app.put("/tasks/{task_id}", response_model=schemas.Task)
 async def update_task(
@@ -890,6 +983,9 @@ async def logout():
 
 @app.get("/admin/users", response_model=List[schemas.User])
 def get_all_users(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
     current_user: models.User = Depends(get_current_active_user),
     db: Session = Depends(get_db),
 ):
@@ -897,7 +993,18 @@ def get_all_users(
     if not current_user.is_admin:
         raise HTTPException(status_code=403, detail="Admins only")
 
-    return db.query(models.User).all()
+    return paginate(db.query(models.User), (models.User.id,), cursor, limit, response, descending=False)
+
+
+@app.get("/admin/traces")
+def get_recent_traces(
+    limit: int = 100,
+    current_user: models.User = Depends(get_current_active_user),
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admins only")
+
+    return metrics.recent_spans(limit)
 
 @app.post("/teams", response_model=schemas.Team)
 async def create_team(
@@ -1004,8 +1111,11 @@ async def report_lost_and_found_item(
 
 @app.get("/lost_and_found_items", response_model=List[schemas.LostAndFoundItem])
 async def get_lost_and_found_items(
+    response: Response,
     status: Optional[str] = None,
     item_type: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
@@ -1016,8 +1126,7 @@ async def get_lost_and_found_items(
     if item_type:
         query = query.filter(models.LostAndFoundItem.item_type == item_type)
 
-    items = query.order_by(desc(models.LostAndFoundItem.reported_at)).all()
-    return items
+    return paginate(query, (models.LostAndFoundItem.reported_at, models.LostAndFoundItem.id), cursor, limit, response)
 
 @app.put("/lost_and_found_items/{item_id}", response_model=schemas.LostAndFoundItem)
 async def update_lost_and_found_item(
@@ -1135,8 +1244,14 @@ async def generate_quiz(
     tag: Optional[str] = Form(None), # <-- Renamed from document_tag
     text_content: Optional[str] = Form(None)
 ):
+    """
+    Samples the quiz from the document's question bank when possible.
+    Otherwise creates a QUEUED quiz session and hands content selection and the LLM call
+    to the generate_quiz_task Celery worker. Clients poll
+    /quiz/session/{id}/status (or subscribe to /quiz/session/{id}/events) and
+    fetch the questions from /quiz/session/{id} once it is COMPLETED.
+    """
     quiz_settings = schemas.QuizSettings(**json.loads(settings_json))
-    content_for_llm = ""
     source_document_id = document_id
 
     if source_document_id:
@@ -1148,86 +1263,246 @@ async def generate_quiz(
         doc_status = db.query(models.Document.status).filter(models.Document.id == source_document_id).scalar()
         if doc_status != models.DocumentStatus.COMPLETED:
              raise HTTPException(status_code=400, detail="Document is still processing or failed. Cannot generate quiz.")
-            
-        content_for_llm = quiz.get_representative_chunks_for_quiz(
-            tag=tag, 
-            source_doc_id=source_document_id
-        )
     
-    elif text_content:
+    elif text_content and text_content.strip():
         # FLOW 2: Raw text was pasted
-        content_for_llm = text_content
+        pass
     
     else:
         raise HTTPException(status_code=400, detail="No content source provided. Please provide a 'document_id' or 'text_content'.")
 
-    # === Step 2: Generate the quiz using the LLM ===
-    if not content_for_llm:
-        raise HTTPException(status_code=400, detail="Content for quiz generation is empty or could not be found.")
-
-    generated_data = quiz.quiz_generation(content_for_llm, quiz_settings.dict())
+    settings_dict = quiz_settings.dict()
+    if source_document_id:
+        # Serve straight from the pre-generated question bank when it can fill the quiz
+        bank_items, needs_top_up = question_bank.sample_questions(db, source_document_id, settings_dict)
+        if needs_top_up:
+            try:
+                celery_app.send_task("build_question_bank_task", kwargs={
+                    "doc_id": source_document_id,
+                    "tag": tag,
+                    "language": quiz_settings.language,
+                    "hard_mode": quiz_settings.hard_mode
+                })
+            except Exception as e:
+                print(f"Could not queue question bank top-up for doc_id {source_document_id}: {e}")
+        if bank_items:
+            db_session = models.QuizSession(
+                user_id=current_user.id,
+                quiz_settings=settings_dict,
+                document_id=source_document_id,
+                generation_status=models.GenerationStatus.COMPLETED
+            )
+            db.add(db_session)
+            db.flush()
+            quiz.bulk_insert_questions(db, db_session.id, [
+                {
+                    "question_text": item.question_text,
+                    "question_type": item.question_type,
+                    "options": item.options,
+                    "correct_answer": item.correct_answer,
+                    "topic": item.topic
+                }
+                for item in bank_items
+            ])
+            with metrics.span("db_commit", site="quiz"):
+                db.commit()
+            db.refresh(db_session)
+            return db_session
 
-    # === Step 3: Save the session and questions to the database ===
-    # (Your existing Step 3 logic is perfect and remains unchanged)
     db_session = models.QuizSession(
         user_id=current_user.id,
-        quiz_settings=quiz_settings.dict(),
+        quiz_settings=settings_dict,
         document_id=source_document_id,
-        raw_content=text_content if not source_document_id else None
+        raw_content=text_content if not source_document_id else None,
+        generation_status=models.GenerationStatus.QUEUED
     )
     db.add(db_session)
-    db.flush()  # Flush to get the session ID
-    for q_data in generated_data.get("questions", []):
-        db_question = models.Question(
-            session_id=db_session.id,
-            **q_data
-        )
-        db.add(db_question)
-
     db.commit()
     db.refresh(db_session)
-    
+
+    try:
+        celery_app.send_task("generate_quiz_task", kwargs={"session_id": db_session.id, "tag": tag})
+    except Exception as e:
+        db_session.generation_status = models.GenerationStatus.FAILED
+        db_session.error_message = f"Failed to queue task: {e}"
+        db.commit()
+        raise HTTPException(status_code=500, detail=f"Failed to queue task: {str(e)}")
+
     return db_session
 
 
+@app.get("/quiz/session/{session_id}/status", response_model=schemas.QuizGenerationStatus)
+def get_quiz_generation_status(
+    session_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    Polls the generation status of a quiz session.
+    """
+    db_session = db.query(models.QuizSession).filter(
+        models.QuizSession.id == session_id,
+        models.QuizSession.user_id == current_user.id
+    ).first()
+
+    if not db_session:
+        raise HTTPException(status_code=404, detail="Quiz session not found")
+
+    question_count = db.query(func.count(models.Question.id)).filter(models.Question.session_id == session_id).scalar()
+    return schemas.QuizGenerationStatus(
+        session_id=db_session.id,
+        status=db_session.generation_status,
+        error=db_session.error_message,
+        question_count=question_count or 0
+    )
+
+
+QUIZ_EVENTS_TIMEOUT_SECONDS = 300
+
+
+@app.get("/quiz/session/{session_id}/events")
+async def stream_quiz_generation_status(
+    session_id: int,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user),
+    redis_client: aioredis.Redis = Depends(get_redis_client)
+):
+    """
+    Server-sent events stream of generation status changes. Emits the current
+    status first and closes once the quiz is COMPLETED or FAILED.
+    """
+    db_session = db.query(models.QuizSession).filter(
+        models.QuizSession.id == session_id,
+        models.QuizSession.user_id == current_user.id
+    ).first()
+
+    if not db_session:
+        raise HTTPException(status_code=404, detail="Quiz session not found")
+
+    finished = (models.GenerationStatus.COMPLETED.value, models.GenerationStatus.FAILED.value)
+
+    async def event_stream():
+        pubsub = redis_client.pubsub()
+        # Subscribe before re-reading the status so no transition is missed
+        await pubsub.subscribe(quiz.quiz_status_channel(session_id))
+        try:
+            # The request's db session is already closed while the body streams
+            stream_db = database.SessionLocal()
+            try:
+                generation_status, error_message = stream_db.query(
+                    models.QuizSession.generation_status, models.QuizSession.error_message
+                ).filter(models.QuizSession.id == session_id).one()
+            finally:
+                stream_db.close()
+            current = {"session_id": session_id, "status": generation_status.value, "error": error_message}
+            yield f"data: {json.dumps(current)}\n\n"
+            if current["status"] in finished:
+                return
+
+            deadline = datetime.now(timezone.utc) + timedelta(seconds=QUIZ_EVENTS_TIMEOUT_SECONDS)
+            while datetime.now(timezone.utc) < deadline:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=15)
+                if message is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {message['data']}\n\n"
+                if json.loads(message["data"]).get("status") in finished:
+                    return
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.close()
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+QUIZ_HISTORY_MAX_PAGE_SIZE = 100
+
+
 @app.get("/quiz/history", response_model=List[schemas.QuizSessionHistoryItem])
 def get_user_quiz_history(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
     """
-    Retrieves the quiz history for the currently logged-in user.
-    This endpoint fetches all quiz sessions, including their score and the
-    name of the source document if applicable, ordered by the most recent first.
+    Retrieves a page of the quiz history for the currently logged-in user,
+    including the score and the name of the source document if applicable,
+    ordered by the most recent first. The next page's cursor is in the
+    X-Next-Cursor header.
     """
-    
-    # 1. Query the database for QuizSession objects.
-    # We use 'joinedload' to efficiently fetch the related Document in the same query,
-    # which prevents performance issues (the "N+1 problem").
-    sessions = (
-        db.query(models.QuizSession)
-        .options(joinedload(models.QuizSession.source_document))
+    # Only the columns the list needs: no session settings, raw content or results
+    query = (
+        db.query(
+            models.QuizSession.id,
+            models.QuizSession.created_at,
+            models.QuizSession.status,
+            models.QuizSession.score,
+            models.Document.filename
+        )
+        .outerjoin(models.Document, models.QuizSession.document_id == models.Document.id)
         .filter(models.QuizSession.user_id == current_user.id)
-        .order_by(models.QuizSession.created_at.desc())
-        .all()
     )
-    
-    # 2. Manually construct the response to ensure correct formatting.
-    # This gives us full control over the data sent to the frontend.
-    response_items = []
-    for session in sessions:
-        response_items.append(
-            schemas.QuizSessionHistoryItem(
-                id=session.id,
-                created_at=session.created_at,
-                status=session.status.value,  # Convert Enum to string
-                score=session.score,
-                # Safely get the filename only if a source document exists
-                source_document_filename=session.source_document.filename if session.source_document else None
-            )
+    rows = paginate(
+        query, (models.QuizSession.created_at, models.QuizSession.id), cursor, limit, response,
+        max_limit=QUIZ_HISTORY_MAX_PAGE_SIZE,
+    )
+
+    return [
+        schemas.QuizSessionHistoryItem(
+            id=row.id,
+            created_at=row.created_at,
+            status=row.status.value,  # Convert Enum to string
+            score=row.score,
+            source_document_filename=row.filename
         )
-        
-    return response_items
+        for row in rows
+    ]
+
+@app.get("/quiz/analytics", response_model=List[schemas.QuizTopicStat])
+def get_quiz_analytics(
+    document_id: Optional[str] = None,
+    min_attempts: int = 1,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    Returns the user's quiz accuracy per document, topic and question type,
+    weakest first. Reads the QuizTopicStat aggregates maintained by
+    /quiz/submit, so the cost grows with the number of topics, not sessions.
+    Pass document_id="" for pasted-text quizzes.
+    """
+    QTS = models.QuizTopicStat
+    query = (
+        db.query(
+            QTS.document_id,
+            models.Document.filename,
+            QTS.topic,
+            QTS.question_type,
+            QTS.attempts,
+            QTS.correct
+        )
+        .outerjoin(models.Document, QTS.document_id == models.Document.id)
+        .filter(QTS.user_id == current_user.id, QTS.attempts >= max(min_attempts, 1))
+    )
+    if document_id is not None:
+        query = query.filter(QTS.document_id == document_id)
+
+    stats = [
+        schemas.QuizTopicStat(
+            document_id=row.document_id or None,
+            document_filename=row.filename,
+            topic=row.topic or None,
+            question_type=row.question_type,
+            attempts=row.attempts,
+            correct=row.correct,
+            accuracy=round(row.correct / row.attempts, 4)
+        )
+        for row in query.all()
+    ]
+    stats.sort(key=lambda s: (s.accuracy, -s.attempts))
+    return stats
 
 @app.get("/quiz/session/{session_id}", response_model=schemas.QuizSessionPublic)
 def get_quiz_session(
@@ -1266,10 +1541,8 @@ def submit_quiz(
     and returns the final results.
     """
     
-    # 1. Find the quiz session and its questions
-    db_session = db.query(models.QuizSession).options(
-        joinedload(models.QuizSession.questions)
-    ).filter(
+    # 1. Find the quiz session
+    db_session = db.query(models.QuizSession).filter(
         models.QuizSession.id == submission.session_id,
         models.QuizSession.user_id == current_user.id
     ).first()
@@ -1279,42 +1552,58 @@ def submit_quiz(
     if db_session.status == models.QuizStatus.COMPLETED:
         raise HTTPException(status_code=400, detail="This quiz has already been completed")
 
-    # 2. Grade the answers
-    questions_map = {q.id: q for q in db_session.questions}
+    # 2. Grade the answers against only the columns grading needs
+    questions = (
+        db.query(
+            models.Question.id,
+            models.Question.question_text,
+            models.Question.correct_answer,
+            models.Question.question_type,
+            models.Question.topic
+        )
+        .filter(models.Question.session_id == db_session.id)
+        .order_by(models.Question.id)
+        .all()
+    )
     user_answers_map = {a.question_id: a.selected_answer for a in submission.answers}
     
-    total_questions = len(db_session.questions)
+    total_questions = len(questions)
     correct_count = 0
     question_results = [] # To build the schemas.QuestionResult list
+    graded_rows = [] # Per-question results, written in one bulk UPDATE
+    topic_results = [] # (topic, question_type, is_correct) for the analytics aggregates
 
-    for q_id, question in questions_map.items():
-        user_answer = user_answers_map.get(q_id, "") # Get user's answer, default to ""
+    for question in questions:
+        user_answer = user_answers_map.get(question.id, "") # Get user's answer, default to ""
         is_correct = (user_answer.lower().strip() == question.correct_answer.lower().strip())
         
         if is_correct:
             correct_count += 1
             
-        # Add to the results list
         question_results.append(schemas.QuestionResult(
             question_text=question.question_text,
             your_answer=user_answer,
             correct_answer=question.correct_answer,
             is_correct=is_correct
         ))
+        graded_rows.append({"id": question.id, "user_answer": user_answer, "is_correct": is_correct})
+        topic_results.append((question.topic, question.question_type, is_correct))
 
-    # 3. Calculate score and update session in DB
+    # 3. Store the answers, the score and the per-topic aggregates
+    if graded_rows:
+        db.execute(update(models.Question), graded_rows)
+    quiz.record_topic_stats(db, current_user.id, db_session.document_id, topic_results)
     final_score = round((correct_count / total_questions) * 100, 2) if total_questions > 0 else 0
     db_session.score = final_score
     db_session.status = models.QuizStatus.COMPLETED
-    db_session.results_data = [res.model_dump() for res in question_results]
     
-    db.commit()
-    db.refresh(db_session)
+    with metrics.span("db_commit", site="quiz"):
+        db.commit()
 
     # 4. Return the full results
     return schemas.QuizResult(
-        id=db_session.id,
-        score=db_session.score,
+        id=submission.session_id,
+        score=final_score,
         results=question_results
     )
 
@@ -1327,7 +1616,12 @@ def get_quiz_results(
     """
     Retrieves the full, saved results for a completed quiz.
     """
-    db_session = db.query(models.QuizSession).filter(
+    db_session = db.query(
+        models.QuizSession.id,
+        models.QuizSession.status,
+        models.QuizSession.score,
+        models.QuizSession.results_data
+    ).filter(
         models.QuizSession.id == session_id,
         models.QuizSession.user_id == current_user.id
     ).first()
@@ -1335,16 +1629,41 @@ def get_quiz_results(
     if not db_session:
         raise HTTPException(status_code=404, detail="Quiz session not found")
         
-    if db_session.status != models.QuizStatus.COMPLETED or not db_session.results_data:
+    if db_session.status != models.QuizStatus.COMPLETED:
         raise HTTPException(status_code=400, 
                             detail="This quiz is not yet completed or results are unavailable.")
 
-    # Pydantic automatically validates the raw JSON from `results_data`
-    # against the `List[QuestionResult]` schema in `QuizResult`.
+    if db_session.results_data:
+        # Sessions graded before per-question results existed
+        return schemas.QuizResult(
+            id=db_session.id,
+            score=db_session.score,
+            results=db_session.results_data
+        )
+
+    rows = (
+        db.query(
+            models.Question.question_text,
+            models.Question.user_answer,
+            models.Question.correct_answer,
+            models.Question.is_correct
+        )
+        .filter(models.Question.session_id == session_id)
+        .order_by(models.Question.id)
+        .all()
+    )
     return schemas.QuizResult(
         id=db_session.id,
         score=db_session.score,
-        results=db_session.results_data
+        results=[
+            schemas.QuestionResult(
+                question_text=row.question_text,
+                your_answer=row.user_answer or "",
+                correct_answer=row.correct_answer,
+                is_correct=bool(row.is_correct)
+            )
+            for row in rows
+        ]
     )
 
 @app.delete("/quiz/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
@@ -1469,62 +1788,49 @@ async def download_document(
     )
 
 
-REDIS_HOST = os.environ.get("REDIS_HOST", "redis")
-REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
-
-redis_client = aioredis.from_url(
-    f"redis://{REDIS_HOST}:{REDIS_PORT}",
-    decode_responses=True, # Decode responses from bytes to strings
-    health_check_interval=30
-)
-
-async def get_redis_client():
-    """
-    Dependency to provide the Redis client.
-    Handles connection errors gracefully.
-    """
-    try:
-        # The client pool handles the connection. We just return the client.
-        # A quick ping to check if the connection is alive.
-        await redis_client.ping()
-        return redis_client
-    except Exception as e:
-        # This will be caught by FastAPI
-        print(f"Could not connect to Redis at {REDIS_HOST}:{REDIS_PORT}: {e}")
-        raise HTTPException(
-            status_code=503, # 503 Service Unavailable
-            detail=f"Could not connect to Redis cache: {e}"
-        )
 @app.post("/study-assistant/summarize", response_model=schemas.SummarizeResponse)
-async def summarize_text(
+def summarize_text(
     request: schemas.SummarizeRequest,
     current_user: models.User = Depends(get_current_active_user),
-    redis_client: aioredis.Redis = Depends(get_redis_client)
 ):
     """
     Summarizes the provided text using the LLM.
+    Repeated requests are served from the shared LLM cache (app.utils.llm_cache).
+    The cache and Gemini calls block, so this is a sync handler: FastAPI runs it
+    in its threadpool instead of on the event loop.
     """
     if not request.text.strip():
         raise HTTPException(status_code=400, detail="Text to summarize cannot be empty.")
-    key_material = f"{request.text.strip()}:{request.length}"
-    cache_key = f"summary:{hashlib.sha256(key_material.encode('utf-8')).hexdigest()}"
-    try:
-        cached_summary = await redis_client.get(cache_key)
-        if cached_summary:
-            return schemas.SummarizeResponse(summary=cached_summary)
-    except Exception as e:
-        # Log the error but don't fail the request.
-        # If cache fails, we can still serve from the API.
-        print(f"Redis GET failed: {e}")
     summary = summarize.summary_gen(request.text, length=request.length)
-    try:
-        # Set with a 1-hour expiration (3600 seconds)
-        await redis_client.set(cache_key, summary, ex=3600)
-    except Exception as e:
-        # Log the error, but we can still return the summary
-        print(f"Redis SET failed: {e}")
     return schemas.SummarizeResponse(summary=summary)
 
+
+@app.get("/admin/profiles")
+async def get_request_profiles(
+    limit: int = 50,
+    current_user: models.User = Depends(get_current_active_user),
+    redis_client: aioredis.Redis = Depends(get_redis_client)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admins only")
+
+    return await profiling.list_profiles(redis_client, limit)
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_request_profile(
+    profile_id: str,
+    current_user: models.User = Depends(get_current_active_user),
+    redis_client: aioredis.Redis = Depends(get_redis_client)
+):
+    if not current_user.is_admin:
+        raise HTTPException(status_code=403, detail="Admins only")
+
+    profile = await profiling.get_profile(redis_client, profile_id)
+    if not profile:
+        raise HTTPException(status_code=404, detail="Profile not found or expired")
+    return profile
+
 #--------------------------------- Atttendace Tracker Endpoints ---------------------------------#
 @app.post("/api/subjects", response_model=schemas.Subject, tags=["Subjects"])
 def create_subject(
@@ -1558,6 +1864,16 @@ def create_subject(
         
         db.add(db_subject)
         db.commit() # ONE clean, transactional commit
+
+        # Create today's classes right away; the nightly materializer only
+        # runs once a day. Never future ones: unmarked classes count as held.
+        today = attendance.local_today(current_user.timezone)
+        try:
+            attendance.materialize_class_instances(db, today, today, subject_id=db_subject.id)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"WARNING: could not create classes for new subject {db_subject.id}: {e}")
         db.refresh(db_subject)
         return db_subject
         
@@ -1573,13 +1889,15 @@ def create_subject(
 
 @app.get("/api/subjects", response_model=List[schemas.Subject], tags=["Subjects"])
 def get_subjects_for_user(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_active_user)
 ):
-    subjects = db.query(models.Subject).filter(
-        models.Subject.user_id == current_user.id
-    ).all()
-    return subjects
+    # Oldest first, in the order they were added; reads ix_subjects_user_id_id
+    query = db.query(models.Subject).filter(models.Subject.user_id == current_user.id)
+    return paginate(query, (models.Subject.id,), cursor, limit, response, descending=False)
 
 @app.get("/api/subjects/{subject_id}", response_model=schemas.Subject, tags=["Subjects"])
 def get_subject(
@@ -1600,6 +1918,10 @@ def get_subject(
 
 # main.py
 
+CLASS_RANGE_MAX_DAYS = 62
+CLASS_MATERIALIZE_MAX_DAYS = 93
+
+
 @app.get("/api/class-instances", response_model=List[schemas.ClassInstance], tags=["Classes"])
 def get_class_instances_for_date(
     target_date: date,
@@ -1608,73 +1930,75 @@ def get_class_instances_for_date(
 ):
     """
     Gets all class instances for the current user on a specific date.
-    
-    *** NEW LOGIC ***
-    This endpoint now auto-creates class instances from schedules
-    if they don't already exist for the target_date.
+
+    Read only: classes are created from the schedules by the nightly
+    materializer and by POST /api/class-instances/materialize, up to the
+    user's local today.
     """
-    
-    # 1. Get the day of the week string (e.g., "monday")
-    day_of_week_str = target_date.strftime("%A").lower()
+    return (
+        attendance.class_instances_query(db, current_user.id)
+        .filter(models.ClassInstance.date == target_date)
+        .order_by(models.ClassInstance.time)
+        .all()
+    )
 
-    # 2. Find all schedules for that day of the week for this user
-    schedules_for_day = (
-        db.query(models.Schedule)
-        .join(models.Subject)
-        .filter(
-            models.Subject.user_id == current_user.id,
-            models.Schedule.day == day_of_week_str
-        )
-    ).all()
 
-    # 3. Find all instances that *already exist* for this user on this date
-    existing_instances = (
-        db.query(models.ClassInstance)
-        .join(models.Subject)
-        .filter(
-            models.Subject.user_id == current_user.id,
-            models.ClassInstance.date == target_date
+@app.get("/api/class-instances/range", response_model=List[schemas.ClassInstance], tags=["Classes"])
+def get_class_instances_for_range(
+    start_date: date,
+    end_date: date,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    Gets the current user's class instances from start_date to end_date
+    (inclusive, at most CLASS_RANGE_MAX_DAYS days), ordered by date and time.
+    """
+    if end_date < start_date or (end_date - start_date).days >= CLASS_RANGE_MAX_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"end_date must be on or after start_date and within {CLASS_RANGE_MAX_DAYS} days of it"
         )
-    ).all()
-
-    # 4. Create a lookup set of (subject_id, time) for fast checking
-    # (This prevents us from creating duplicates)
-    existing_instance_set = {
-        (inst.subject_id, inst.time) for inst in existing_instances
-    }
-
-    # 5. Loop through schedules and find what's missing
-    instances_to_add = []
-    for schedule in schedules_for_day:
-        # If this schedule's (subject, time) is NOT in the set, create it
-        if (schedule.subject_id, schedule.time) not in existing_instance_set:
-            new_instance = models.ClassInstance(
-                subject_id=schedule.subject_id,
-                date=target_date,
-                time=schedule.time
-            )
-            instances_to_add.append(new_instance)
+    return (
+        attendance.class_instances_query(db, current_user.id)
+        .filter(models.ClassInstance.date >= start_date, models.ClassInstance.date <= end_date)
+        .order_by(models.ClassInstance.date, models.ClassInstance.time)
+        .all()
+    )
 
-    # 6. If we have new instances to add, commit them to the DB
-    if instances_to_add:
-        db.add_all(instances_to_add)
-        db.commit()
 
-    # 7. Finally, query AGAIN to get all instances (existing + newly created)
-    # This is the same query you had originally, but now it will find the
-    # instances we just created.
-    all_instances = (
-        db.query(models.ClassInstance)
-        .join(models.Subject)
-        .filter(
-            models.Subject.user_id == current_user.id,
-            models.ClassInstance.date == target_date
+@app.post("/api/class-instances/materialize", response_model=schemas.MaterializeClassesResponse, tags=["Classes"])
+def materialize_class_instances(
+    range_in: schemas.ClassInstanceRange,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_active_user)
+):
+    """
+    Creates the current user's scheduled classes for a whole range (e.g. the
+    week or month the calendar shows) in one INSERT ... SELECT. Classes that
+    already exist are left as they are, so calling it again is cheap. The
+    range is cut off at the user's local today: an unmarked class counts as
+    held, so future classes are not created.
+    """
+    if range_in.end_date < range_in.start_date or \
+            (range_in.end_date - range_in.start_date).days >= CLASS_MATERIALIZE_MAX_DAYS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"end_date must be on or after start_date and within {CLASS_MATERIALIZE_MAX_DAYS} days of it"
         )
-        .order_by(models.ClassInstance.time)
-        .all()
-    )
-    
-    return all_instances
+    end_date = min(range_in.end_date, attendance.local_today(current_user.timezone))
+    if end_date < range_in.start_date:
+        return schemas.MaterializeClassesResponse(created=0)
+    try:
+        created = attendance.materialize_class_instances(
+            db, range_in.start_date, end_date, user_ids=[current_user.id]
+        )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        print(f"ERROR materializing classes for user {current_user.id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to create the scheduled classes")
+    return schemas.MaterializeClassesResponse(created=created)
 
 
 @app.post("/api/class-instances", response_model=schemas.CreateClassInstanceResponse, status_code=status.HTTP_201_CREATED, tags=["Classes"])
@@ -1698,7 +2022,18 @@ def create_class_instance(
             status_code=404, 
             detail="Subject not found or you do not have permission to access it."
         )
-    
+    # An unmarked class counts as held, so a future one would be counted early
+    if class_in.date > attendance.local_today(current_user.timezone):
+        raise HTTPException(status_code=400, detail="Classes can only be added for today or earlier.")
+    
+    slot_taken = db.query(models.ClassInstance.id).filter(
+        models.ClassInstance.subject_id == class_in.subject_id,
+        models.ClassInstance.date == class_in.date,
+        models.ClassInstance.time == class_in.time
+    ).first()
+    if slot_taken:
+        raise HTTPException(status_code=409, detail="This subject already has a class at that date and time.")
+
     db_class = models.ClassInstance(
         subject_id=class_in.subject_id,
         date=class_in.date,
@@ -1706,15 +2041,29 @@ def create_class_instance(
     )
     db.add(db_class)
     
-    db_job = models.SubjectStatJob(
-        user_id=current_user.id,
-        status=models.JobStatusEnum.PENDING
-    )
-    db.add(db_job)
-    db.commit()
+    # A new, unmarked class counts as held
+    held, attended = attendance.stat_weights(None)
+    try:
+        db_job, dispatch = attendance.queue_stat_delta(db, current_user.id, subject.id, held, attended)
+        attendance.record_rollup_delta(
+            db, current_user.id, class_in.date, attendance.rollup_delta(None, None, created=True)
+        )
+        db.commit()
+    except IntegrityError:
+        # Same slot created concurrently (e.g. by the materializer)
+        db.rollback()
+        raise HTTPException(status_code=409, detail="This subject already has a class at that date and time.")
     
     # --- Trigger Celery Task ---
-    celery_app.send_task("update_subject_stats", args=[subject.id, db_job.id])
+    # Delayed, so marks made right after this one are folded into the same job
+    if dispatch:
+        try:
+            celery_app.send_task(
+                "update_subject_stats", args=[subject.id, db_job.id], countdown=attendance.STAT_JOB_DEBOUNCE_SECONDS
+            )
+        except Exception as e:
+            # The job is committed; the stale-job sweep applies it later
+            print(f"Could not queue stat job {db_job.id} for subject {subject.id}: {e}")
     
     db.refresh(db_class)
     db.refresh(db_job) # Refresh to get job ID
@@ -1738,7 +2087,8 @@ def mark_attendance(
     Returns a job_id for polling.
     """
     
-    # Security Check: Verify this instance belongs to this user
+    # Security Check: Verify this instance belongs to this user. The row lock
+    # keeps concurrent marks of the same class from computing the same delta.
     instance = (
         db.query(models.ClassInstance)
         .join(models.Subject)
@@ -1746,6 +2096,7 @@ def mark_attendance(
             models.ClassInstance.id == instance_id,
             models.Subject.user_id == current_user.id
         )
+        .with_for_update(of=models.ClassInstance)
     ).first()
 
     if not instance:
@@ -1759,6 +2110,7 @@ def mark_attendance(
         models.AttendanceRecord.class_instance_id == instance_id
     ).first()
     
+    old_status = record.status if record else None
     if record:
         record.status = record_in.status
         
@@ -1769,18 +2121,29 @@ def mark_attendance(
         )
         db.add(record)
         
-    # --- Create the Job Entry ---
-    db_job = models.SubjectStatJob(
-        user_id=current_user.id,
-        status=models.JobStatusEnum.PENDING
+    # --- Add the change to the subject's pending job ---
+    held_delta, attended_delta = attendance.transition_delta(old_status, record_in.status)
+    db_job, dispatch = attendance.queue_stat_delta(
+        db, current_user.id, instance.subject_id, held_delta, attended_delta
+    )
+    attendance.record_rollup_delta(
+        db, current_user.id, instance.date, attendance.rollup_delta(old_status, record_in.status)
     )
-    db.add(db_job)
     
     # Commit both the record and the job
     db.commit()
     
     # --- Trigger Celery Task ---
-    celery_app.send_task("update_subject_stats", args=[instance.subject_id, db_job.id])
+    # Delayed, so further marks for this subject are folded into the same job
+    if dispatch:
+        try:
+            celery_app.send_task(
+                "update_subject_stats", args=[instance.subject_id, db_job.id],
+                countdown=attendance.STAT_JOB_DEBOUNCE_SECONDS
+            )
+        except Exception as e:
+            # The job is committed; the stale-job sweep applies it later
+            print(f"Could not queue stat job {db_job.id} for subject {instance.subject_id}: {e}")
     
     db.refresh(record)
     db.refresh(db_job) # Refresh to get job ID
@@ -1824,50 +2187,29 @@ def get_calendar_view(
 ):
     """
     Gets the "summary" attendance status for each day of a given month
-    for the current user.
+    for the current user, from the daily rollup (one row per day).
     
     Prioritizes statuses: absent > present > cancelled
     """
-    
-    # 1. Get all instances for the user in that month
-    instances = (
-        db.query(models.ClassInstance)
-        .join(models.Subject)
-        .filter(
-            models.Subject.user_id == current_user.id,
-            extract('year', models.ClassInstance.date) == year,
-            extract('month', models.ClassInstance.date) == month
-        )
-        .options(joinedload(models.ClassInstance.attendance_record)) # Eager load record
-        .all()
-    )
-    
-    # 2. Process in Python to get one status per day
-    # Key: date_obj, Value: {"present": 0, "absent": 0, "cancelled": 0}
-    day_statuses = {}
-    for inst in instances:
-        date_obj = inst.date
-        status = inst.attendance_record.status if inst.attendance_record else None
-        
-        if date_obj not in day_statuses:
-            day_statuses[date_obj] = {"present": 0, "absent": 0, "cancelled": 0}
-        
-        if status:
-            day_statuses[date_obj][status.value] += 1
-    
-    # 3. Determine final summary status for each day
+    if not 1 <= month <= 12:
+        raise HTTPException(status_code=400, detail="month must be between 1 and 12")
+    month_start = date(year, month, 1)
+    next_month = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+
+    days = attendance.calendar_days_query(db, current_user.id, month_start, next_month).all()
+
     response_data = []
-    for date_obj, counts in day_statuses.items():
-        if counts["absent"] > 0:
+    for day in days:
+        if day.absent > 0:
             final_status = models.AttendanceStatus.absent
-        elif counts["present"] > 0:
+        elif day.present > 0:
             final_status = models.AttendanceStatus.present
-        elif counts["cancelled"] > 0:
+        elif day.cancelled > 0:
             final_status = models.AttendanceStatus.cancelled
         else:
             continue # Skip if no *marked* classes for this day
         
-        response_data.append(schemas.CalendarDay(date=date_obj, status=final_status))
+        response_data.append(schemas.CalendarDay(date=day.date, status=final_status))
     
     return response_data
 
@@ -1879,43 +2221,12 @@ def get_analytics_insights(
     current_user: models.User = Depends(get_current_active_user)
 ):
     """
-    Calculates and returns advanced analytics:
+    Calculates and returns advanced analytics from the attendance rollups:
     - Attendance percentage by day of the week.
     - Weekly attendance trend for the last 12 weeks.
     """
-    
-    # --- Define the consistent case logic ---
-    AR = aliased(models.AttendanceRecord)
-    
-    # Count 1 if status is 'present', 0 otherwise
-    attended_case = case(
-        (AR.status == models.AttendanceStatus.present, 1),
-        else_=0
-    )
-    
-    # Count 1 if status is NOT 'cancelled' (including NULL/unmarked), 0 otherwise
-    held_case = case(
-        (AR.status == models.AttendanceStatus.cancelled, 0),
-        else_=1
-    )
-    
     # --- 1. Attendance by Day of Week ---
-    
-    # Use isodow (1=Mon, 7=Sun)
-    dow_query = extract('isodow', models.ClassInstance.date).label("dow")
-    
-    day_stats = (
-        db.query(
-            dow_query,
-            func.sum(held_case).label("total_held"),
-            func.sum(attended_case).label("total_attended")
-        )
-        .select_from(models.ClassInstance)
-        .join(models.Subject)
-        .outerjoin(AR, models.ClassInstance.attendance_record)
-        .filter(models.Subject.user_id == current_user.id)
-        .group_by(dow_query)
-    ).all()
+    day_stats = attendance.day_of_week_query(db, current_user.id).all()
 
     day_map = { 1: "Mon", 2: "Tue", 3: "Wed", 4: "Thu", 5: "Fri", 6: "Sat", 7: "Sun" }
     attendance_by_day_data = []
@@ -1927,35 +2238,18 @@ def get_analytics_insights(
             })
     
     # --- 2. Weekly Trend (Last 12 Weeks) ---
-    twelve_weeks_ago = datetime.now(timezone.utc).date() - timedelta(weeks=12)
-    
-    # Truncate date to the start of the week
-    week_trunc = func.date_trunc('week', models.ClassInstance.date).label("week_start")
+    # Whole weeks: the week containing the date 12 weeks ago is included
+    twelve_weeks_ago = attendance.week_start(datetime.now(timezone.utc).date() - timedelta(weeks=12))
 
-    week_stats = (
-        db.query(
-            week_trunc,
-            func.sum(held_case).label("total_held"),
-            func.sum(attended_case).label("total_attended")
-        )
-        .select_from(models.ClassInstance)
-        .join(models.Subject)
-        .outerjoin(AR, models.ClassInstance.attendance_record)
-        .filter(
-            models.Subject.user_id == current_user.id,
-            models.ClassInstance.date >= twelve_weeks_ago
-        )
-        .group_by(week_trunc)
-        .order_by(week_trunc)
-    ).all()
+    week_stats = attendance.weekly_trend_query(db, current_user.id, twelve_weeks_ago).all()
     
     weekly_trend_data = []
     for row in week_stats:
-        if row.total_held > 0:
+        if row.held > 0:
             weekly_trend_data.append({
                 "week_start_date": row.week_start,
                 "week_label": row.week_start.strftime("%m-%d"),
-                "percentage": (row.total_attended / row.total_held) * 100
+                "percentage": (row.attended / row.held) * 100
             })
 
     return schemas.AnalyticsInsights(
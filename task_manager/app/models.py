@@ -1,4 +1,4 @@
-from sqlalchemy import Integer, Column, String, DateTime, ForeignKey, Boolean, Enum, Text, Float, Time, Date, UniqueConstraint
+from sqlalchemy import Integer, Column, String, DateTime, ForeignKey, Boolean, Enum, Text, Float, Time, Date, UniqueConstraint, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from app.database import Base
@@ -115,6 +115,9 @@ class Task(Base):
     # Step 2: Add this "table arguments" block at the *end* of your Task class
     __table_args__ = (
         UniqueConstraint('user_id', 'task_url', name='_user_task_url_uc'),
+        # The task board reads each status group newest first, by owner or by team
+        Index("ix_tasks_user_status_created", "user_id", "status", "created_at", "id"),
+        Index("ix_tasks_team_status_created", "team_id", "status", "created_at", "id"),
     )
 class MoodleAccount(Base):
     __tablename__ = "moodle_accounts"
@@ -125,6 +128,8 @@ class MoodleAccount(Base):
     batch = Column(String, nullable=False)
     auto_sync = Column(Boolean, default=True)
     last_synced_at = Column(DateTime, nullable=True)
+    # Page/course fingerprints and last seen task statuses, for incremental syncs
+    sync_state = Column(JSONB, nullable=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, unique=True)
     user = relationship("User", back_populates="moodle_account")
    
@@ -132,6 +137,10 @@ class MoodleAccount(Base):
 
 class Document(Base):
     __tablename__ = "documents"
+    # (user_id, created_at, id): keyset pagination of the document list
+    __table_args__ = (
+        Index("ix_documents_user_created", "user_id", "created_at", "id"),
+    )
     id = Column(String, primary_key=True, index=True) # This will be our doc_id (UUID)
     filename = Column(String, index=True)
     tag = Column(String, index=True) # subject 
@@ -140,22 +149,34 @@ class Document(Base):
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     user_id = Column(Integer, ForeignKey("users.id"))
     chroma_ids = Column(JSONB, nullable=True)   # PostgreSQL JSONB is perfect for lists
+    topic_index = Column(JSONB, nullable=True)  # {topic: [chroma chunk ids]} representative chunks, built at ingestion
     owner = relationship("User", back_populates="documents")
     content_type = Column(String, nullable=True)
 
     quiz_sessions = relationship("QuizSession", back_populates="source_document", cascade="all, delete-orphan")
+    question_bank = relationship("QuestionBankItem", back_populates="document", cascade="all, delete-orphan")
 class Conversation(Base):
     __tablename__ = "conversations"
+    __table_args__ = (
+        Index("ix_conversations_user_created", "user_id", "created_at", "id"),
+    )
     id = Column(String, primary_key=True, index=True) # A UUID for the conversation
     title = Column(String, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    # Rolling summary of the messages up to summary_message_id (app/utils/memory.py)
+    summary = Column(Text, nullable=True)
+    summary_message_id = Column(Integer, nullable=True)
 
     owner = relationship("User", back_populates="conversations")
     messages = relationship("Message", back_populates="conversation", cascade="all, delete-orphan")
 
 class Message(Base):
     __tablename__ = "messages"
+    # History windows read a conversation's messages newest first
+    __table_args__ = (
+        Index("ix_messages_conversation_created", "conversation_id", "created_at", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     conversation_id = Column(String, ForeignKey("conversations.id"), nullable=False)
     role = Column(String, nullable=False) # Will be 'user' or 'assistant'
@@ -166,6 +187,9 @@ class Message(Base):
 
 class LostAndFoundItem(Base):
     __tablename__ = "lost_and_found_items"
+    __table_args__ = (
+        Index("ix_lost_and_found_items_reported", "reported_at", "id"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, nullable=False)
     description = Column(String, nullable=False)
@@ -181,6 +205,9 @@ class LostAndFoundItem(Base):
 
 class QuizSession(Base):
     __tablename__ = "quiz_sessions"
+    __table_args__ = (
+        Index("ix_quiz_sessions_user_created", "user_id", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True)
     created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
@@ -191,6 +218,9 @@ class QuizSession(Base):
     raw_content = Column(Text, nullable=True)
     quiz_settings = Column(JSONB, nullable=False) #Stores the user's choices from the "Customize Quiz" 
     results_data = Column(JSONB, nullable=True)
+    # Lifecycle of the background generation job (generate_quiz_task)
+    generation_status = Column(Enum(GenerationStatus), nullable=False, default=GenerationStatus.COMPLETED, server_default=GenerationStatus.COMPLETED.value)
+    error_message = Column(Text, nullable=True)
     owner = relationship("User", back_populates="quiz_sessions")
     source_document = relationship("Document", back_populates="quiz_sessions")
     questions = relationship("Question", back_populates="session", cascade="all, delete-orphan")
@@ -202,10 +232,53 @@ class Question(Base):
     question_type = Column(String, nullable=False)
     options = Column(JSONB, nullable=True) # Stores the possible answers (e.g.{"A": "Paris", "B": "London"}). 
     correct_answer = Column(String, nullable=False)
+    topic = Column(String, nullable=True) # Section of the source the question was drawn from
+    # Filled by /quiz/submit (replaces the per-session results_data blob)
+    user_answer = Column(String, nullable=True)
+    is_correct = Column(Boolean, nullable=True)
 
-    session_id = Column(Integer, ForeignKey("quiz_sessions.id"), nullable=False)
+    session_id = Column(Integer, ForeignKey("quiz_sessions.id"), nullable=False, index=True)
     session = relationship("QuizSession", back_populates="questions")
 
+class QuestionBankItem(Base):
+    """Pre-generated, validated question for a document, sampled by /generate_quiz."""
+    __tablename__ = "question_bank_items"
+    __table_args__ = (
+        Index("ix_question_bank_lookup", "document_id", "language", "hard_mode", "question_type"),
+    )
+    id = Column(Integer, primary_key=True)
+    document_id = Column(String, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
+    topic = Column(String, nullable=True)
+    question_type = Column(String, nullable=False)
+    language = Column(String, nullable=False, default="English")
+    hard_mode = Column(Boolean, nullable=False, default=False)
+    question_text = Column(Text, nullable=False)
+    options = Column(JSONB, nullable=True)
+    correct_answer = Column(String, nullable=False)
+    times_served = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+    document = relationship("Document", back_populates="question_bank")
+
+class QuizTopicStat(Base):
+    """
+    Running attempts/correct counts per user, document, topic and question type,
+    updated by /quiz/submit. Pasted-text quizzes use document_id "" and
+    questions without a topic use topic "".
+    """
+    __tablename__ = "quiz_topic_stats"
+    __table_args__ = (
+        UniqueConstraint("user_id", "document_id", "topic", "question_type", name="uq_quiz_topic_stats_key"),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    document_id = Column(String, nullable=False, default="")
+    topic = Column(String, nullable=False, default="")
+    question_type = Column(String, nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    correct = Column(Integer, nullable=False, default=0)
+    last_attempt_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
 class GeneratedDocument(Base):
     __tablename__ = "generated_documents"
     id = Column(String, primary_key=True, index=True)
@@ -221,13 +294,18 @@ class GeneratedDocument(Base):
 
 class Subject(Base):
     __tablename__ = "subjects"
+    # (user_id, id): the attendance queries join from the user's subjects to
+    # their classes without touching the table
+    __table_args__ = (
+        Index("ix_subjects_user_id_id", "user_id", "id"),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
     code = Column(String, nullable=True)
     color = Column(String, default="#3B82F6")
     
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     
     # --- Calculated Stats ---
     total_classes_held = Column(Integer, default=0)
@@ -242,9 +320,13 @@ class Subject(Base):
 
 class Schedule(Base):
     __tablename__ = "schedules"
+    # Covers the schedule lookups of the class materializer
+    __table_args__ = (
+        Index("ix_schedules_subject_day", "subject_id", "day", postgresql_include=["time"]),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
-    subject_id = Column(Integer, ForeignKey("subjects.id"), nullable=False, index=True)
+    subject_id = Column(Integer, ForeignKey("subjects.id"), nullable=False)
     day = Column(Enum(DayOfWeek), nullable=False)
     time = Column(Time, nullable=False)
     # Timestamps
@@ -258,8 +340,14 @@ class ClassInstance(Base):
     Represents a SINGLE, SPECIFIC class session that occurs or will occur.
     e.g., "Data Structures on 2024-10-28 at 9:00 AM".
     This is the "source of truth" for what classes actually exist.
+    Scheduled classes are created in bulk (app/utils/attendance.py); the
+    unique slot keeps that idempotent and is also the (subject_id, date) index
+    every attendance query uses.
     """
     __tablename__ = "class_instances"
+    __table_args__ = (
+        UniqueConstraint("subject_id", "date", "time", name="uq_class_instances_slot"),
+    )
 
     id = Column(Integer, primary_key=True)
     date = Column(Date, nullable=False, index=True)
@@ -272,6 +360,10 @@ class ClassInstance(Base):
 
 class AttendanceRecord(Base):
     __tablename__ = "attendance_records"
+    # Lets the recounts/rollup rebuilds read the mark from the index alone
+    __table_args__ = (
+        Index("ix_attendance_records_instance_status", "class_instance_id", postgresql_include=["status"]),
+    )
     
     id = Column(Integer, primary_key=True, index=True)
     class_instance_id = Column(Integer, ForeignKey("class_instances.id"), nullable=False, unique=True, index=True)
@@ -284,12 +376,55 @@ class SubjectStatJob(Base):
     """
     This table stores the status of your background "stat recalculation" jobs,
     allowing your React app to poll for results.
+    Changes to the same subject made while its job is PENDING are added to
+    that job's deltas (see app/utils/attendance.py).
     """
     __tablename__ = "subject_stat_jobs" 
+    __table_args__ = (
+        Index("ix_subject_stat_jobs_pending", "subject_id", postgresql_where=text("status = 'PENDING'")),
+    )
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     user = relationship("User", back_populates="stat_jobs")
+    # NULL for jobs queued before deltas existed; those recount the subject
+    subject_id = Column(Integer, ForeignKey("subjects.id", ondelete="CASCADE"), nullable=True)
+    held_delta = Column(Integer, nullable=False, default=0)
+    attended_delta = Column(Integer, nullable=False, default=0)
     
     status = Column(Enum(JobStatusEnum), nullable=False, default=JobStatusEnum.PENDING)
     error_message = Column(Text, nullable=True) # Stores the error if it fails  
-    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
\ No newline at end of file
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+class AttendanceDailyStat(Base):
+    """
+    Per-user attendance counters for one day, across all subjects. Kept up to
+    date by the attendance endpoints (app/utils/attendance.py) so the calendar
+    and analytics views read a few rows instead of every class. held/attended
+    follow the subject totals: unmarked classes count as held.
+    """
+    __tablename__ = "attendance_daily_stats"
+    __table_args__ = (
+        UniqueConstraint("user_id", "date", name="uq_attendance_daily_stats_key"),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    date = Column(Date, nullable=False)
+    held = Column(Integer, nullable=False, default=0)
+    attended = Column(Integer, nullable=False, default=0)
+    present = Column(Integer, nullable=False, default=0)
+    absent = Column(Integer, nullable=False, default=0)
+    cancelled = Column(Integer, nullable=False, default=0)
+
+
+class AttendanceWeeklyStat(Base):
+    """held/attended of AttendanceDailyStat summed per ISO week (week_start is the Monday)."""
+    __tablename__ = "attendance_weekly_stats"
+    __table_args__ = (
+        UniqueConstraint("user_id", "week_start", name="uq_attendance_weekly_stats_key"),
+    )
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    week_start = Column(Date, nullable=False)
+    held = Column(Integer, nullable=False, default=0)
+    attended = Column(Integer, nullable=False, default=0)
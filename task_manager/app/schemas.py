@@ -242,11 +242,19 @@ class QuestionPublic(BaseModel):
 class QuizSessionPublic(BaseModel):
     id: int
     status: str
-    questions: List[QuestionPublic] # A list of questions without answers
+    generation_status: GenerationStatus = GenerationStatus.COMPLETED
+    questions: List[QuestionPublic] # A list of questions without answers (empty until generation completes)
 
     class Config:
         orm_mode = True
 
+# Polled by the frontend while the quiz is generated in the background
+class QuizGenerationStatus(BaseModel):
+    session_id: int
+    status: GenerationStatus
+    error: Optional[str] = None
+    question_count: int = 0
+
 # --- Schemas for Quiz History ---
 
 class QuizSessionHistoryItem(BaseModel):
@@ -295,6 +303,16 @@ class QuizResult(BaseModel):
     score: float
     results: List[QuestionResult]
 
+class QuizTopicStat(BaseModel):
+    """Aggregated quiz performance for one document, topic and question type."""
+    document_id: Optional[str] = None
+    document_filename: Optional[str] = None
+    topic: Optional[str] = None
+    question_type: str
+    attempts: int
+    correct: int
+    accuracy: float
+
 class BasicDetails(BaseModel):
     Name: str
     UID: str
@@ -373,6 +391,13 @@ class ClassInstanceCreate(BaseModel):
     date: date
     time: time
 
+class ClassInstanceRange(BaseModel):
+    start_date: date
+    end_date: date
+
+class MaterializeClassesResponse(BaseModel):
+    created: int
+
 class SubjectSimple(BaseModel):
     id: int
     name: str
@@ -0,0 +1,528 @@
+"""
+Subject attendance totals (Subject.total_classes_held / total_classes_attended).
+
+Endpoints that add a class or change an attendance mark do not recount the
+subject. They record the change as a delta on the subject's PENDING
+SubjectStatJob, creating one (and queueing update_subject_stats with a
+STAT_JOB_DEBOUNCE_SECONDS countdown) only when none is pending. Every mark
+made inside that window lands on the same job, so ten marks in a row cost
+one job and one small UPDATE.
+
+A class counts as held unless it is cancelled (unmarked classes count), and as
+attended when it is marked present. reconcile_subject_stats() recounts from
+ClassInstance/AttendanceRecord as a periodic consistency check; subjects with
+a pending job are left for the next run, since their delta is not applied yet.
+
+The same writes also update the per-user daily and weekly rollups
+(AttendanceDailyStat / AttendanceWeeklyStat) synchronously, with one upsert
+each, in the endpoint's transaction. The calendar and analytics endpoints
+read only those. refresh_attendance_rollups() rebuilds them from the classes.
+
+Scheduled classes are materialized into ClassInstance rows by
+materialize_class_instances(), one INSERT ... SELECT over a date range (the
+(subject_id, date, time) unique constraint makes it idempotent), from the
+/api/class-instances/materialize endpoint and a nightly Celery task. The
+read endpoints never create classes. Since an unmarked class counts as held,
+classes are only materialized up to the user's local today, never ahead:
+future classes would lower the attendance percentage until their day came.
+"""
+import os
+from datetime import date, datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from sqlalchemy import Date, bindparam, cast, delete, exists, extract, func, insert, or_, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session, contains_eager, joinedload
+
+import app.models as models
+
+STAT_JOB_DEBOUNCE_SECONDS = int(os.getenv("STAT_JOB_DEBOUNCE_SECONDS", 5))
+RECONCILE_BATCH_SIZE = int(os.getenv("STAT_RECONCILE_BATCH_SIZE", 500))
+# A job still PENDING this long after it was created lost its task (the send
+# failed or the message was dropped); it is re-dispatched or applied directly.
+STAT_JOB_STALE_SECONDS = int(os.getenv("STAT_JOB_STALE_SECONDS", 300))
+ROLLUP_COUNTERS = ("held", "attended", "present", "absent", "cancelled")
+# The nightly materializer also covers this many days before each user's
+# local today, so a late or missed run leaves no gap.
+CLASS_MATERIALIZE_DAYS_BACK = int(os.getenv("CLASS_MATERIALIZE_DAYS_BACK", 1))
+
+
+def stat_weights(status: models.AttendanceStatus | None) -> tuple[int, int]:
+    """(held, attended) contribution of one class with this mark (None = unmarked)."""
+    held = 0 if status == models.AttendanceStatus.cancelled else 1
+    attended = 1 if status == models.AttendanceStatus.present else 0
+    return held, attended
+
+
+def transition_delta(old: models.AttendanceStatus | None, new: models.AttendanceStatus | None) -> tuple[int, int]:
+    old_held, old_attended = stat_weights(old)
+    new_held, new_attended = stat_weights(new)
+    return new_held - old_held, new_attended - old_attended
+
+
+def queue_stat_delta(
+    db: Session, user_id: int, subject_id: int, held_delta: int, attended_delta: int
+) -> tuple[models.SubjectStatJob, bool]:
+    """
+    Adds the delta to the subject's pending job, or creates one. Runs in the
+    caller's transaction; the caller commits and, when the second value is
+    True, queues update_subject_stats for the job (after the commit).
+    A change that does not move the totals gets an already finished job.
+    A pending job older than STAT_JOB_STALE_SECONDS is dispatched again,
+    since its task was evidently lost (applying a job twice is a no-op).
+    """
+    Job = models.SubjectStatJob
+    # Locking the pending job serializes this with update_subject_stats: once
+    # the task has applied it, the row no longer matches and a new job is made.
+    job = pending_job_query(db, subject_id).first()
+    if job is not None:
+        job.held_delta += held_delta
+        job.attended_delta += attended_delta
+        return job, job.created_at is not None and job.created_at < _stale_before()
+
+    unchanged = held_delta == 0 and attended_delta == 0
+    job = Job(
+        user_id=user_id,
+        subject_id=subject_id,
+        held_delta=held_delta,
+        attended_delta=attended_delta,
+        status=models.JobStatusEnum.SUCCESS if unchanged else models.JobStatusEnum.PENDING,
+    )
+    db.add(job)
+    db.flush()
+    return job, not unchanged
+
+
+def pending_job_query(db: Session, subject_id: int):
+    Job = models.SubjectStatJob
+    return (
+        db.query(Job)
+        .filter(Job.subject_id == subject_id, Job.status == models.JobStatusEnum.PENDING)
+        .order_by(Job.id)
+        .with_for_update()
+    )
+
+
+def apply_stat_job(db: Session, job_id: int, subject_id: int) -> models.SubjectStatJob | None:
+    """
+    Applies a pending job's delta to its subject and marks it SUCCESS, in the
+    caller's transaction. Jobs that were already applied are left alone, so a
+    redelivered task is harmless. Jobs created before deltas existed (no
+    subject_id) fall back to a recount of `subject_id`.
+    """
+    Job = models.SubjectStatJob
+    job = db.query(Job).filter(Job.id == job_id).with_for_update().first()
+    if job is None or job.status != models.JobStatusEnum.PENDING:
+        return job
+
+    if job.subject_id is None:
+        recount_subject_stats(db, [subject_id])
+    elif job.held_delta or job.attended_delta:
+        db.execute(
+            update(models.Subject)
+            .where(models.Subject.id == job.subject_id)
+            .values(
+                total_classes_held=func.coalesce(models.Subject.total_classes_held, 0) + job.held_delta,
+                total_classes_attended=func.coalesce(models.Subject.total_classes_attended, 0) + job.attended_delta,
+            )
+            .execution_options(synchronize_session=False)
+        )
+    job.status = models.JobStatusEnum.SUCCESS
+    return job
+
+
+def subject_counts_query(db: Session, subject_ids: list[int]):
+    """held/attended recounted from the classes, per subject."""
+    S, CI, AR = models.Subject, models.ClassInstance, models.AttendanceRecord
+    return (
+        db.query(
+            S.id.label("subject_id"),
+            func.count(CI.id).filter(
+                or_(AR.status.is_(None), AR.status != models.AttendanceStatus.cancelled)
+            ).label("held"),
+            func.count(AR.id).filter(AR.status == models.AttendanceStatus.present).label("attended"),
+        )
+        .select_from(S)
+        .outerjoin(CI, CI.subject_id == S.id)
+        .outerjoin(AR, AR.class_instance_id == CI.id)
+        .filter(S.id.in_(subject_ids))
+        .group_by(S.id)
+    )
+
+
+def recount_subject_stats(db: Session, subject_ids: list[int]) -> list[int]:
+    """
+    Recounts the totals of `subject_ids` in one statement and returns the ids
+    whose stored totals were wrong. Subjects with a pending job are skipped.
+    """
+    S, Job = models.Subject, models.SubjectStatJob
+    counts = subject_counts_query(db, subject_ids).subquery()
+    pending = exists().where(Job.subject_id == S.id, Job.status == models.JobStatusEnum.PENDING)
+    fixed = db.execute(
+        update(S)
+        .where(
+            S.id == counts.c.subject_id,
+            ~pending,
+            or_(
+                S.total_classes_held.is_distinct_from(counts.c.held),
+                S.total_classes_attended.is_distinct_from(counts.c.attended),
+            ),
+        )
+        .values(total_classes_held=counts.c.held, total_classes_attended=counts.c.attended)
+        .returning(S.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    return list(fixed)
+
+
+def _stale_before() -> datetime:
+    # created_at is stored as naive UTC
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=STAT_JOB_STALE_SECONDS)
+
+
+def apply_stale_stat_jobs(db: Session) -> int:
+    """
+    Applies the PENDING jobs older than STAT_JOB_STALE_SECONDS whose
+    update_subject_stats task never ran, committing per batch. Without this a
+    lost task leaves the job pending forever: later marks keep adding to it
+    without dispatching, and the recount skips its subject. Returns the
+    number of jobs applied.
+    """
+    Job = models.SubjectStatJob
+    applied = 0
+    last_id = 0
+    stale_before = _stale_before()
+    while True:
+        jobs = (
+            db.query(Job.id, Job.subject_id)
+            .filter(
+                Job.status == models.JobStatusEnum.PENDING,
+                Job.subject_id.isnot(None),
+                Job.created_at < stale_before,
+                Job.id > last_id,
+            )
+            .order_by(Job.id)
+            .limit(RECONCILE_BATCH_SIZE)
+            .all()
+        )
+        if not jobs:
+            break
+        last_id = jobs[-1].id
+        for job_id, subject_id in jobs:
+            # Locks and re-checks the job, so one applied meanwhile by its task is skipped
+            apply_stat_job(db, job_id, subject_id)
+        db.commit()
+        applied += len(jobs)
+    return applied
+
+
+def reconcile_subject_stats(db: Session) -> tuple[int, int]:
+    """
+    Applies stale pending jobs, then recounts every subject in id-ordered
+    batches, committing per batch. Returns (subjects checked, subjects corrected).
+    """
+    stale = apply_stale_stat_jobs(db)
+    if stale:
+        print(f"ATTENDANCE: applied {stale} stale pending stat jobs")
+    checked = corrected = 0
+    last_id = 0
+    while True:
+        ids = [
+            row.id for row in db.query(models.Subject.id)
+            .filter(models.Subject.id > last_id)
+            .order_by(models.Subject.id)
+            .limit(RECONCILE_BATCH_SIZE)
+            .all()
+        ]
+        if not ids:
+            break
+        last_id = ids[-1]
+        fixed = recount_subject_stats(db, ids)
+        db.commit()
+        checked += len(ids)
+        corrected += len(fixed)
+        if fixed:
+            print(f"ATTENDANCE: corrected stale totals for {len(fixed)} subjects (ids {fixed[0]}..{fixed[-1]})")
+    return checked, corrected
+
+
+# --- Daily / weekly rollups ---
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def rollup_delta(
+    old: models.AttendanceStatus | None, new: models.AttendanceStatus | None, created: bool = False
+) -> dict[str, int]:
+    """
+    Change to a day's counters when a class goes from mark `old` to `new`
+    (None = unmarked). With created=True the class did not exist before.
+    """
+    delta = dict.fromkeys(ROLLUP_COUNTERS, 0)
+
+    def add(status, sign):
+        held, attended = stat_weights(status)
+        delta["held"] += sign * held
+        delta["attended"] += sign * attended
+        if status is not None:
+            delta[status.value] += sign
+
+    if not created:
+        add(old, -1)
+    add(new, 1)
+    return delta
+
+
+def record_rollup_delta(db: Session, user_id: int, day: date, delta: dict[str, int]):
+    """Adds `delta` to the user's daily and weekly rollup rows (no commit)."""
+    record_rollup_deltas(db, {(user_id, day): delta})
+
+
+def record_rollup_deltas(db: Session, deltas: dict[tuple[int, date], dict[str, int]]):
+    """
+    Adds each (user_id, day) -> delta to the rollups with one multi-row upsert
+    per table (no commit).
+    """
+    Daily, Weekly = models.AttendanceDailyStat, models.AttendanceWeeklyStat
+    daily_rows, weekly = [], {}
+    for (user_id, day), delta in deltas.items():
+        counters = {name: delta.get(name, 0) for name in ROLLUP_COUNTERS}
+        if not any(counters.values()):
+            continue
+        daily_rows.append({"user_id": user_id, "date": day, **counters})
+        if counters["held"] or counters["attended"]:
+            row = weekly.setdefault((user_id, week_start(day)), [0, 0])
+            row[0] += counters["held"]
+            row[1] += counters["attended"]
+    if not daily_rows:
+        return
+
+    stmt = pg_insert(Daily).values(daily_rows)
+    db.execute(stmt.on_conflict_do_update(
+        constraint="uq_attendance_daily_stats_key",
+        set_={name: getattr(Daily, name) + getattr(stmt.excluded, name) for name in ROLLUP_COUNTERS},
+    ))
+    if weekly:
+        stmt = pg_insert(Weekly).values([
+            {"user_id": user_id, "week_start": start, "held": held, "attended": attended}
+            for (user_id, start), (held, attended) in weekly.items()
+        ])
+        db.execute(stmt.on_conflict_do_update(
+            constraint="uq_attendance_weekly_stats_key",
+            set_={"held": Weekly.held + stmt.excluded.held, "attended": Weekly.attended + stmt.excluded.attended},
+        ))
+
+
+def refresh_attendance_rollups(db: Session, user_ids: list[int]):
+    """Rebuilds the rollups of `user_ids` from their classes (no commit)."""
+    S, CI, AR = models.Subject, models.ClassInstance, models.AttendanceRecord
+    Daily, Weekly = models.AttendanceDailyStat, models.AttendanceWeeklyStat
+    held = func.count(CI.id).filter(or_(AR.status.is_(None), AR.status != models.AttendanceStatus.cancelled))
+
+    def marked(status):
+        return func.count(AR.id).filter(AR.status == status)
+
+    daily = (
+        select(
+            S.user_id, CI.date, held,
+            marked(models.AttendanceStatus.present),
+            marked(models.AttendanceStatus.present),
+            marked(models.AttendanceStatus.absent),
+            marked(models.AttendanceStatus.cancelled),
+        )
+        .select_from(CI)
+        .join(S, S.id == CI.subject_id)
+        .outerjoin(AR, AR.class_instance_id == CI.id)
+        .where(S.user_id.in_(user_ids))
+        .group_by(S.user_id, CI.date)
+    )
+    week = cast(func.date_trunc("week", CI.date), Date)
+    weekly = (
+        select(S.user_id, week, held, marked(models.AttendanceStatus.present))
+        .select_from(CI)
+        .join(S, S.id == CI.subject_id)
+        .outerjoin(AR, AR.class_instance_id == CI.id)
+        .where(S.user_id.in_(user_ids))
+        .group_by(S.user_id, week)
+    )
+    db.execute(delete(Daily).where(Daily.user_id.in_(user_ids)))
+    db.execute(insert(Daily).from_select(["user_id", "date", *ROLLUP_COUNTERS], daily))
+    db.execute(delete(Weekly).where(Weekly.user_id.in_(user_ids)))
+    db.execute(insert(Weekly).from_select(["user_id", "week_start", "held", "attended"], weekly))
+
+
+def refresh_all_attendance_rollups(db: Session) -> int:
+    """Rebuilds every user's rollups in id-ordered batches, committing per batch."""
+    refreshed = 0
+    last_id = 0
+    while True:
+        ids = [
+            row.user_id for row in db.query(models.Subject.user_id)
+            .filter(models.Subject.user_id > last_id)
+            .distinct()
+            .order_by(models.Subject.user_id)
+            .limit(RECONCILE_BATCH_SIZE)
+            .all()
+        ]
+        if not ids:
+            break
+        last_id = ids[-1]
+        refresh_attendance_rollups(db, ids)
+        db.commit()
+        refreshed += len(ids)
+    return refreshed
+
+
+# --- Read queries ---
+# Used by the attendance endpoints and checked by benchmarks/bench_attendance_plans.py.
+# Every filter is a plain range or equality on an indexed column (no
+# extract()/date_trunc() in WHERE), so the planner can use the indexes.
+
+def class_instances_query(db: Session, user_id: int):
+    """The user's classes with their subject and mark loaded in the same query."""
+    return (
+        db.query(models.ClassInstance)
+        .join(models.Subject)
+        .filter(models.Subject.user_id == user_id)
+        .options(
+            contains_eager(models.ClassInstance.subject),
+            joinedload(models.ClassInstance.attendance_record)
+        )
+    )
+
+
+def calendar_days_query(db: Session, user_id: int, start: date, end: date):
+    """Daily rollup rows in [start, end)."""
+    Daily = models.AttendanceDailyStat
+    return (
+        db.query(Daily.date, Daily.present, Daily.absent, Daily.cancelled)
+        .filter(Daily.user_id == user_id, Daily.date >= start, Daily.date < end)
+        .order_by(Daily.date)
+    )
+
+
+def day_of_week_query(db: Session, user_id: int):
+    """held/attended per ISO weekday (1=Mon ... 7=Sun) over all the user's days."""
+    Daily = models.AttendanceDailyStat
+    dow = extract("isodow", Daily.date).label("dow")
+    return (
+        db.query(
+            dow,
+            func.sum(Daily.held).label("total_held"),
+            func.sum(Daily.attended).label("total_attended"),
+        )
+        .filter(Daily.user_id == user_id)
+        .group_by(dow)
+    )
+
+
+def weekly_trend_query(db: Session, user_id: int, since: date):
+    Weekly = models.AttendanceWeeklyStat
+    return (
+        db.query(Weekly.week_start, Weekly.held, Weekly.attended)
+        .filter(Weekly.user_id == user_id, Weekly.week_start >= since)
+        .order_by(Weekly.week_start)
+    )
+
+
+# --- Class materialization ---
+
+_MATERIALIZE_SQL = """
+    WITH inserted AS (
+        INSERT INTO class_instances (subject_id, date, time, created_at)
+        SELECT sc.subject_id, d::date, sc.time, timezone('utc', now())
+        FROM generate_series(CAST(:start_date AS date), CAST(:end_date AS date), interval '1 day') AS d
+        JOIN schedules sc ON sc.day::text = to_char(d, 'FMday')
+        JOIN subjects su ON su.id = sc.subject_id
+        WHERE {scope}
+        ON CONFLICT ON CONSTRAINT uq_class_instances_slot DO NOTHING
+        RETURNING subject_id, date
+    )
+    SELECT su.user_id, i.subject_id, i.date, COUNT(*) AS added
+    FROM inserted i
+    JOIN subjects su ON su.id = i.subject_id
+    GROUP BY su.user_id, i.subject_id, i.date
+"""
+
+
+def materialize_class_instances(
+    db: Session, start_date: date, end_date: date,
+    user_ids: list[int] | None = None, subject_id: int | None = None,
+) -> int:
+    """
+    Creates the missing ClassInstance rows from the schedules of `user_ids`
+    (or of one subject) for every day in [start_date, end_date], in one
+    statement, and adds the new (unmarked, so held) classes to the subject
+    totals and the rollups. Returns the number of classes created. No commit.
+    """
+    if subject_id is not None:
+        scope, params = "su.id = :subject_id", {"subject_id": subject_id}
+    elif user_ids:
+        scope, params = "su.user_id = ANY(:user_ids)", {"user_ids": list(user_ids)}
+    else:
+        raise ValueError("materialize_class_instances needs user_ids or subject_id")
+
+    created = db.execute(
+        text(_MATERIALIZE_SQL.format(scope=scope)),
+        {"start_date": start_date, "end_date": end_date, **params},
+    ).all()
+    if not created:
+        return 0
+
+    # Relative increments commute with pending SubjectStatJob deltas, so new
+    # classes are added straight to the totals instead of queueing jobs.
+    added_per_subject = {}
+    added_per_day = {}
+    for row in created:
+        added_per_subject[row.subject_id] = added_per_subject.get(row.subject_id, 0) + row.added
+        day = added_per_day.setdefault((row.user_id, row.date), {"held": 0})
+        day["held"] += row.added
+    subjects = models.Subject.__table__
+    db.execute(
+        update(subjects)
+        .where(subjects.c.id == bindparam("b_subject_id"))
+        .values(total_classes_held=func.coalesce(subjects.c.total_classes_held, 0) + bindparam("b_added")),
+        [{"b_subject_id": sid, "b_added": added} for sid, added in added_per_subject.items()],
+    )
+    record_rollup_deltas(db, added_per_day)
+    return sum(added_per_subject.values())
+
+
+def local_today(tz_name: str | None, now: datetime | None = None) -> date:
+    """Today's date in the user's timezone (UTC if it is unset or unknown)."""
+    try:
+        zone = ZoneInfo(tz_name or "UTC")
+    except (ZoneInfoNotFoundError, ValueError):
+        zone = timezone.utc
+    return (now or datetime.now(timezone.utc)).astimezone(zone).date()
+
+
+def materialize_upcoming_classes(db: Session, now: datetime) -> int:
+    """
+    Nightly: materializes the last CLASS_MATERIALIZE_DAYS_BACK days through
+    each user's local today for every user with subjects, in id-ordered
+    batches committed one by one. Users of a batch that share a local date
+    share one statement.
+    """
+    created = 0
+    last_id = 0
+    while True:
+        users = (
+            db.query(models.User.id, models.User.timezone)
+            .filter(models.User.id > last_id, exists().where(models.Subject.user_id == models.User.id))
+            .order_by(models.User.id)
+            .limit(RECONCILE_BATCH_SIZE)
+            .all()
+        )
+        if not users:
+            break
+        last_id = users[-1].id
+        by_today = {}
+        for user in users:
+            by_today.setdefault(local_today(user.timezone, now), []).append(user.id)
+        for today, ids in by_today.items():
+            start_date = today - timedelta(days=CLASS_MATERIALIZE_DAYS_BACK)
+            created += materialize_class_instances(db, start_date, today, user_ids=ids)
+        db.commit()
+    return created
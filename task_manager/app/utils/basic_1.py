@@ -9,6 +9,8 @@ import google.generativeai as genai
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.enum.table import WD_ALIGN_VERTICAL
 from dotenv import load_dotenv
+from app.utils import metrics
+from app.utils import llm_cache
 load_dotenv()
 
 
@@ -36,14 +38,23 @@ def summarize_experiment(query: str, num_statements_preference: str) -> dict:
     Input query: "{query}"
     """
 
-    try:
+    response = None
+
+    def generate():
+        nonlocal response
         model = genai.GenerativeModel("gemini-2.0-flash")
-        response = model.generate_content(prompt)
+        with metrics.span("llm_call", site="experiment"):
+            response = model.generate_content(prompt)
         # Clean the response text to remove potential markdown formatting
         cleaned_text = response.text.strip().replace('```json', '').replace('```', '')
         data = json.loads(cleaned_text)
         print("[INFO] Successfully received and parsed data from Gemini.")
         return data
+
+    try:
+        return llm_cache.cached_call(
+            "experiment", (prompt,), generate, semantic_text=query, scope=(num_statements_preference,)
+        )
     except json.JSONDecodeError:
         raise ValueError("Gemini did not return valid JSON. Response was:\n" + response.text)
     except Exception as e:
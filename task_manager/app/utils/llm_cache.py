@@ -0,0 +1,194 @@
+"""
+Redis-backed response cache shared by every Gemini call site.
+
+Each call site ("ask", "quiz", "summarize", "experiment", "ocr_correction")
+has its own TTL, entry limit and optional semantic threshold (see SITES; every
+value can be overridden with LLM_CACHE_<SITE>_TTL / _MAX_ENTRIES /
+_SEMANTIC_THRESHOLD, and LLM_CACHE_ENABLED=false turns the cache off).
+
+Lookup order:
+1. exact key: sha256 of everything that went into the prompt.
+2. semantic: when the site has a threshold, the embedding of `semantic_text`
+   (e.g. the user's question) is compared to previously cached ones that share
+   the same `scope` (e.g. the same retrieved context). The best match above the
+   threshold is served.
+
+Redis layout per site:
+- llmcache:<site>:e:<sha>       cached value (JSON), expires after the site TTL
+- llmcache:<site>:lru           ZSET "<scope>:<sha>" -> last access time; the
+                                oldest entries are evicted past max_entries
+- llmcache:<site>:v:<scope>     HASH sha -> embedding, for semantic lookups
+
+Only successful results are cached: compute() raising propagates to the
+caller and nothing is stored. If Redis is unreachable the cache is bypassed
+for a short cool-down instead of failing the LLM call. A failed embedding
+only skips the semantic lookup.
+"""
+import hashlib
+import json
+import math
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+from app.utils import metrics
+from app.utils.redis_store import get_redis
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+KEY_PREFIX = "llmcache"
+REDIS_RETRY_SECONDS = 30
+CACHE_REQUESTS = "llm_cache_requests_total"
+
+metrics.describe(CACHE_REQUESTS, "LLM cache lookups by call site and result (hit, semantic_hit, miss, error).")
+
+
+@dataclass
+class CacheSite:
+    ttl: int
+    max_entries: int
+    semantic_threshold: float | None = None
+
+
+def _site_from_env(name: str, default: CacheSite) -> CacheSite:
+    prefix = f"LLM_CACHE_{name.upper()}_"
+    threshold = os.getenv(prefix + "SEMANTIC_THRESHOLD")
+    if threshold is None:
+        semantic_threshold = default.semantic_threshold
+    elif threshold.lower() in ("", "none", "off"):
+        semantic_threshold = None
+    else:
+        semantic_threshold = float(threshold)
+    return CacheSite(
+        ttl=int(os.getenv(prefix + "TTL", default.ttl)),
+        max_entries=int(os.getenv(prefix + "MAX_ENTRIES", default.max_entries)),
+        semantic_threshold=semantic_threshold,
+    )
+
+
+# Semantic matching is off where the embedded text would be long (the model
+# only reads the first ~256 tokens) or where small wording changes matter.
+SITES = {
+    name: _site_from_env(name, default)
+    for name, default in {
+        "ask": CacheSite(ttl=6 * 3600, max_entries=5000, semantic_threshold=0.95),
+        "quiz": CacheSite(ttl=24 * 3600, max_entries=1000),
+        "summarize": CacheSite(ttl=3600, max_entries=2000),
+        "experiment": CacheSite(ttl=7 * 24 * 3600, max_entries=2000, semantic_threshold=0.95),
+        "ocr_correction": CacheSite(ttl=7 * 24 * 3600, max_entries=5000),
+    }.items()
+}
+
+_redis_down_until = 0.0
+
+
+def _hash(*parts) -> str:
+    material = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _embed(text: str) -> list[float]:
+    # Imported lazily: only sites with semantic matching need the model
+    from app.utils.populate_database import get_embedding_function
+    vector = get_embedding_function().embed_query(text)
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+def _best_semantic_match(vectors: dict, query_vector: list[float], threshold: float) -> str | None:
+    best_sha, best_score = None, threshold
+    for sha, raw in vectors.items():
+        candidate = json.loads(raw)
+        score = sum(a * b for a, b in zip(query_vector, candidate))
+        if score >= best_score:
+            best_sha, best_score = sha, score
+    return best_sha
+
+
+def _evict(client, site_name: str, site: CacheSite):
+    lru_key = f"{KEY_PREFIX}:{site_name}:lru"
+    overflow = client.zcard(lru_key) - site.max_entries
+    if overflow <= 0:
+        return
+    pipe = client.pipeline()
+    for member, _ in client.zpopmin(lru_key, overflow):
+        scope, sha = member.rsplit(":", 1)
+        pipe.delete(f"{KEY_PREFIX}:{site_name}:e:{sha}")
+        pipe.hdel(f"{KEY_PREFIX}:{site_name}:v:{scope}", sha)
+    pipe.execute()
+
+
+def cached_call(
+    site_name: str,
+    key_parts: tuple,
+    compute: Callable[[], Any],
+    semantic_text: str | None = None,
+    scope: tuple = (),
+):
+    """
+    Returns the cached result for `key_parts` on `site_name`, or calls
+    compute(), caches its (JSON-serializable) result and returns it.
+    """
+    global _redis_down_until
+    site = SITES[site_name]
+    if not LLM_CACHE_ENABLED or site.max_entries <= 0 or time.time() < _redis_down_until:
+        return compute()
+
+    sha = _hash(site_name, *key_parts)
+    scope_hash = _hash(*scope)[:16]
+    entry_key = f"{KEY_PREFIX}:{site_name}:e:{sha}"
+    lru_key = f"{KEY_PREFIX}:{site_name}:lru"
+    vectors_key = f"{KEY_PREFIX}:{site_name}:v:{scope_hash}"
+    use_semantic = site.semantic_threshold is not None and bool(semantic_text)
+    query_vector = None
+
+    try:
+        client = get_redis()
+        cached = client.get(entry_key)
+        if cached is not None:
+            client.zadd(lru_key, {f"{scope_hash}:{sha}": time.time()})
+            metrics.inc(CACHE_REQUESTS, site=site_name, result="hit")
+            return json.loads(cached)
+
+        if use_semantic:
+            try:
+                query_vector = _embed(semantic_text)
+            except Exception as e:
+                # An embedding failure (quota, timeout) only skips the semantic lookup
+                print(f"LLM CACHE: could not embed the {site_name} query, skipping semantic lookup: {e}")
+        if query_vector is not None:
+            match_sha = _best_semantic_match(client.hgetall(vectors_key), query_vector, site.semantic_threshold)
+            if match_sha:
+                cached = client.get(f"{KEY_PREFIX}:{site_name}:e:{match_sha}")
+                if cached is not None:
+                    client.zadd(lru_key, {f"{scope_hash}:{match_sha}": time.time()})
+                    metrics.inc(CACHE_REQUESTS, site=site_name, result="semantic_hit")
+                    return json.loads(cached)
+                client.hdel(vectors_key, match_sha)  # Value expired, drop its vector too
+    except Exception as e:
+        print(f"LLM CACHE: lookup failed for {site_name}, bypassing cache: {e}")
+        if isinstance(e, (RedisConnectionError, RedisTimeoutError)):
+            # Redis is unreachable: skip the cache everywhere for a while
+            _redis_down_until = time.time() + REDIS_RETRY_SECONDS
+        metrics.inc(CACHE_REQUESTS, site=site_name, result="error")
+        return compute()
+
+    metrics.inc(CACHE_REQUESTS, site=site_name, result="miss")
+    result = compute()
+    if not result:
+        return result  # Nothing worth caching
+
+    try:
+        pipe = client.pipeline()
+        pipe.set(entry_key, json.dumps(result), ex=site.ttl)
+        pipe.zadd(lru_key, {f"{scope_hash}:{sha}": time.time()})
+        if query_vector is not None:
+            pipe.hset(vectors_key, sha, json.dumps(query_vector))
+            pipe.expire(vectors_key, site.ttl)
+        pipe.execute()
+        _evict(client, site_name, site)
+    except Exception as e:
+        print(f"LLM CACHE: could not store result for {site_name}: {e}")
+    return result
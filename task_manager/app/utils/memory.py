@@ -0,0 +1,180 @@
+"""
+Conversation memory: the windows of a conversation's messages that the chat
+UI and the prompts read.
+
+A conversation and its newest messages come back from one query. The
+conversation row is LEFT JOINed to a LATERAL subquery that reads the
+messages newest first on the (conversation_id, created_at, id) index and stops
+after the window. Ownership is part of the same WHERE clause, so a missing
+conversation and someone else's look the same (None). Older messages are
+paged with the (created_at, id) keyset cursors of app/utils/pagination.py.
+
+Prompts don't carry the raw history. Each conversation keeps a rolling
+summary (Conversation.summary) of every message up to
+summary_message_id. After each reply, update_conversation_summary (Celery,
+llm queue) folds the messages that have dropped out of the last
+PROMPT_RECENT_MESSAGES into it, oldest first and SUMMARY_BATCH_MESSAGES at a
+time, so a long history is never sent in one prompt. A question is then
+answered from the summary plus the messages after it: normally the last two
+turns, or up to PROMPT_HISTORY_MESSAGES while the summary job is catching up.
+The summary is written with a compare-and-set on summary_message_id, so
+concurrent or redelivered jobs can't fold a message twice, and no transaction
+stays open during the LLM call.
+"""
+import os
+
+from sqlalchemy import select, true, update
+from sqlalchemy.orm import Session, aliased
+
+import app.models as models
+from app.utils import metrics
+from app.utils.pagination import clamp_limit, finish_page, keyset_condition, order_by_key
+
+HISTORY_PAGE_SIZE = 50
+MAX_HISTORY_PAGE_SIZE = 200
+# Raw messages sent to the LLM with each question: the last two turns, or at
+# most PROMPT_HISTORY_MESSAGES when some of them are not summarized yet
+PROMPT_RECENT_MESSAGES = 4
+PROMPT_HISTORY_MESSAGES = 6
+# Don't call the LLM to fold in less than one turn
+SUMMARY_MIN_NEW_MESSAGES = 2
+SUMMARY_MAX_CHARS = int(os.getenv("CONVERSATION_SUMMARY_MAX_CHARS", 1500))
+# Messages folded per LLM call; a long backlog is folded over several runs
+SUMMARY_BATCH_MESSAGES = int(os.getenv("CONVERSATION_SUMMARY_BATCH_MESSAGES", 40))
+MESSAGE_KEY = (models.Message.created_at, models.Message.id)
+
+
+def load_conversation_window(
+    db: Session, conversation_id: str, user_id: int, count: int, cursor: str | None = None
+) -> tuple[models.Conversation | None, list[models.Message]]:
+    """
+    The user's conversation and up to `count` of its messages older than
+    `cursor` (the newest ones without it), newest first, in one query.
+    Returns (None, []) if the user has no such conversation.
+    """
+    window = select(models.Message).where(models.Message.conversation_id == models.Conversation.id)
+    condition = keyset_condition(MESSAGE_KEY, cursor)
+    if condition is not None:
+        window = window.where(condition)
+    window = window.order_by(*order_by_key(MESSAGE_KEY)).limit(count).lateral("message_window")
+    message = aliased(models.Message, window)
+
+    rows = (
+        db.query(models.Conversation, message)
+        .outerjoin(message, true())
+        .filter(models.Conversation.id == conversation_id, models.Conversation.user_id == user_id)
+        .all()
+    )
+    if not rows:
+        return None, []
+    messages = sorted((m for _, m in rows if m is not None), key=lambda m: (m.created_at, m.id), reverse=True)
+    return rows[0][0], messages
+
+
+def history_page(
+    db: Session, conversation_id: str, user_id: int, cursor: str | None, limit: int, response=None
+) -> tuple[models.Conversation | None, list[models.Message]]:
+    """
+    A page of messages, oldest first, for display. X-Next-Cursor on `response`
+    points at the messages before the page (scroll-back).
+    """
+    limit = clamp_limit(limit, MAX_HISTORY_PAGE_SIZE)
+    conversation, messages = load_conversation_window(db, conversation_id, user_id, limit + 1, cursor)
+    page = finish_page(messages, MESSAGE_KEY, limit, response)
+    return conversation, page[::-1]
+
+
+def _is_summarized(conversation: models.Conversation, message: models.Message) -> bool:
+    return conversation.summary_message_id is not None and message.id <= conversation.summary_message_id
+
+
+def prompt_history(db: Session, conversation_id: str, user_id: int) -> tuple[models.Conversation | None, list[models.Message]]:
+    """
+    The conversation (with its summary) and the raw messages the prompt needs
+    next to that summary, in chronological order: the last
+    PROMPT_RECENT_MESSAGES, plus any older ones of the last
+    PROMPT_HISTORY_MESSAGES that the summary doesn't cover yet.
+    """
+    conversation, messages = load_conversation_window(db, conversation_id, user_id, PROMPT_HISTORY_MESSAGES)
+    if conversation is None:
+        return None, []
+    recent = [
+        message for i, message in enumerate(messages)
+        if i < PROMPT_RECENT_MESSAGES or not _is_summarized(conversation, message)
+    ]
+    return conversation, recent[::-1]
+
+
+def messages_to_summarize(db: Session, conversation: models.Conversation) -> tuple[list[models.Message], bool]:
+    """
+    The oldest SUMMARY_BATCH_MESSAGES messages not in the summary yet, oldest
+    first, leaving out the last PROMPT_RECENT_MESSAGES (those are sent
+    verbatim anyway), and whether more are waiting after them.
+    """
+    query = db.query(models.Message).filter(models.Message.conversation_id == conversation.id)
+    if conversation.summary_message_id is not None:
+        query = query.filter(models.Message.id > conversation.summary_message_id)
+    # Past a full batch and the recent window, one extra row means another batch is waiting
+    window = SUMMARY_BATCH_MESSAGES + PROMPT_RECENT_MESSAGES
+    oldest = query.order_by(*order_by_key(MESSAGE_KEY, descending=False)).limit(window + 1).all()
+    if len(oldest) > window:
+        return oldest[:SUMMARY_BATCH_MESSAGES], True
+    return oldest[:max(0, len(oldest) - PROMPT_RECENT_MESSAGES)], False
+
+
+def summarize_messages(previous_summary: str | None, messages: list[models.Message]) -> str:
+    """Folds `messages` into `previous_summary` with one Gemini call."""
+    import google.generativeai as genai
+
+    transcript = "\n".join(f"{message.role}: {message.content}" for message in messages)
+    prompt = f"""You maintain the running summary of a conversation between a student and a study assistant.
+Update the summary with the new messages. Keep the topics, documents, facts and answers the student may refer back to,
+and any preferences they stated. Drop greetings and repetition. Write plain prose, at most {SUMMARY_MAX_CHARS} characters.
+
+CURRENT SUMMARY:
+{previous_summary or "(none yet)"}
+
+NEW MESSAGES:
+{transcript}
+
+UPDATED SUMMARY:"""
+
+    model = genai.GenerativeModel("gemini-2.0-flash")
+    with metrics.span("llm_call", site="memory"):
+        response = model.generate_content(
+            prompt,
+            generation_config=genai.types.GenerationConfig(temperature=0.0, max_output_tokens=600),
+        )
+    return (response.text or "").strip()[:SUMMARY_MAX_CHARS]
+
+
+def update_conversation_summary(db: Session, conversation_id: str) -> tuple[int, bool]:
+    """
+    Folds the oldest batch of messages that left the recent window into the
+    conversation's summary. Returns how many were folded (0 if there was
+    nothing to do or another job got there first) and whether another batch
+    is waiting.
+    """
+    conversation = db.query(models.Conversation).filter(models.Conversation.id == conversation_id).first()
+    if conversation is None:
+        return 0, False
+    previous_summary, previous_message_id = conversation.summary, conversation.summary_message_id
+    messages, more = messages_to_summarize(db, conversation)
+    # Release the connection before the slow LLM call; the loaded messages stay usable
+    db.close()
+    if len(messages) < SUMMARY_MIN_NEW_MESSAGES:
+        return 0, False
+
+    summary = summarize_messages(previous_summary, messages)
+    if not summary:
+        return 0, False
+    updated = db.execute(
+        update(models.Conversation)
+        .where(
+            models.Conversation.id == conversation_id,
+            models.Conversation.summary_message_id.is_not_distinct_from(previous_message_id),
+        )
+        .values(summary=summary, summary_message_id=messages[-1].id)
+    ).rowcount
+    db.commit()
+    return (len(messages), more) if updated else (0, False)
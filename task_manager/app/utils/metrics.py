@@ -0,0 +1,213 @@
+"""
+Lightweight in-process tracing and metrics.
+
+Use `span("ocr")` as a context manager or `@timed("rerank")` as a decorator
+around a hot-path stage. Every finished span is observed into the
+`automateu_stage_duration_seconds` histogram (labelled by stage) and kept in a
+small ring buffer of recent spans. Counters are available through `inc()`.
+
+`render_prometheus()` returns everything in the Prometheus text exposition
+format; the API serves it on /metrics and Celery workers can serve it with
+`start_metrics_server()`.
+
+Set METRICS_ENABLED=false for a no-op mode: `span()` hands back a shared
+do-nothing context manager, `timed()` returns the function unchanged and
+`inc()` returns immediately.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+METRICS_NAMESPACE = "automateu"
+SPAN_BUFFER_SIZE = int(os.getenv("METRICS_SPAN_BUFFER_SIZE", 512))
+
+STAGE_HISTOGRAM = "stage_duration_seconds"
+STAGE_ERRORS = "stage_errors_total"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+_lock = threading.Lock()
+_histograms = {}  # name -> {label_tuple: [bucket_counts..., sum, count]}
+_counters = {}    # name -> {label_tuple: value}
+_help = {
+    STAGE_HISTOGRAM: "Wall time spent in an instrumented pipeline stage.",
+    STAGE_ERRORS: "Number of instrumented stage executions that raised.",
+    "celery_tasks_total": "Celery tasks finished, by task name and final state.",
+}
+_recent_spans = deque(maxlen=SPAN_BUFFER_SIZE)
+_current_span = ContextVar("current_span", default=None)
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def observe(name: str, value: float, **labels):
+    """Records one observation into the histogram `name`."""
+    if not METRICS_ENABLED:
+        return
+    key = _label_key(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {})
+        row = series.get(key)
+        if row is None:
+            row = series[key] = [0] * len(DEFAULT_BUCKETS) + [0.0, 0]
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                row[i] += 1
+        row[-2] += value
+        row[-1] += 1
+
+
+def inc(name: str, value: float = 1, **labels):
+    """Increments the counter `name`."""
+    if not METRICS_ENABLED:
+        return
+    key = _label_key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + value
+
+
+def describe(name: str, help_text: str):
+    """Registers the HELP line shown for a metric in the exposition output."""
+    _help[name] = help_text
+
+
+class _Span:
+    __slots__ = ("stage", "labels", "start", "parent", "token")
+
+    def __init__(self, stage: str, labels: dict):
+        self.stage = stage
+        self.labels = labels
+
+    def __enter__(self):
+        self.parent = _current_span.get()
+        self.token = _current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        duration = time.perf_counter() - self.start
+        _current_span.reset(self.token)
+        observe(STAGE_HISTOGRAM, duration, stage=self.stage, **self.labels)
+        if exc_type is not None:
+            inc(STAGE_ERRORS, stage=self.stage, **self.labels)
+        _recent_spans.append({
+            "stage": self.stage,
+            "parent": self.parent.stage if self.parent else None,
+            "labels": self.labels,
+            "started_at": time.time() - duration,
+            "duration_ms": round(duration * 1000, 3),
+            "error": exc_type.__name__ if exc_type else None,
+        })
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(stage: str, **labels):
+    """Context manager timing one execution of `stage`."""
+    if not METRICS_ENABLED:
+        return _NOOP_SPAN
+    return _Span(stage, labels)
+
+
+def timed(stage: str, **labels):
+    """Decorator form of `span()`. In no-op mode the function is returned as is."""
+    def decorator(fn):
+        if not METRICS_ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _Span(stage, labels):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def recent_spans(limit: int = 100) -> list[dict]:
+    """Most recent finished spans, newest first."""
+    return list(_recent_spans)[::-1][:limit]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key: tuple, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    body = ",".join(f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + body + "}"
+
+
+def render_prometheus() -> str:
+    """Renders all metrics in the Prometheus text exposition format (v0.0.4)."""
+    lines = []
+    with _lock:
+        for name, series in sorted(_histograms.items()):
+            full = f"{METRICS_NAMESPACE}_{name}"
+            lines.append(f"# HELP {full} {_help.get(name, name)}")
+            lines.append(f"# TYPE {full} histogram")
+            for key, row in series.items():
+                for i, bound in enumerate(DEFAULT_BUCKETS):
+                    lines.append(f"{full}_bucket{_format_labels(key, (('le', repr(bound)),))} {row[i]}")
+                lines.append(f"{full}_bucket{_format_labels(key, (('le', '+Inf'),))} {row[-1]}")
+                lines.append(f"{full}_sum{_format_labels(key)} {row[-2]}")
+                lines.append(f"{full}_count{_format_labels(key)} {row[-1]}")
+        for name, series in sorted(_counters.items()):
+            full = f"{METRICS_NAMESPACE}_{name}"
+            lines.append(f"# HELP {full} {_help.get(name, name)}")
+            lines.append(f"# TYPE {full} counter")
+            for key, value in series.items():
+                lines.append(f"{full}{_format_labels(key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep scrapes out of the worker logs
+
+
+def start_metrics_server(port: int):
+    """
+    Serves render_prometheus() on a background thread. Used by processes that
+    have no HTTP server of their own (Celery workers).
+    """
+    if not METRICS_ENABLED:
+        return None
+    try:
+        server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    except OSError as e:
+        print(f"METRICS: could not bind metrics server on port {port}: {e}")
+        return None
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True)
+    thread.start()
+    print(f"METRICS: serving Prometheus metrics on port {port}")
+    return server
@@ -0,0 +1,109 @@
+"""
+Keyset (cursor) pagination for the list endpoints.
+
+A page is ordered by a fixed tuple of columns that ends with a unique one,
+e.g. (created_at, id), and the next page starts strictly after the last row
+of the previous one: WHERE (created_at, id) < (:last_created_at, :last_id).
+Unlike OFFSET, the cost of a page does not grow with how far the client has
+scrolled, and rows inserted meanwhile do not shift pages. Each endpoint has a
+matching composite index, so a page is an index range scan of `limit` rows.
+
+The cursor is opaque to clients: the last row's key, JSON encoded and
+base64url'd. Endpoints return the page as the JSON body (unchanged response
+models) and the cursor of the next page in the X-Next-Cursor header, which
+is absent on the last page. `limit` is clamped to the endpoint's maximum.
+"""
+import base64
+import json
+from datetime import date, datetime
+
+from fastapi import HTTPException, Response
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 100
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def _to_json(value):
+    return value.isoformat() if isinstance(value, (date, datetime)) else value
+
+
+def _from_json(column, value):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    return python_type(value)
+
+
+def encode_cursor(values: tuple) -> str:
+    raw = json.dumps([_to_json(v) for v in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: tuple) -> list:
+    """The key encoded in `cursor`, typed like `columns`. Raises HTTP 400 if it is not one of ours."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError("wrong key length")
+        return [_from_json(column, value) for column, value in zip(columns, values)]
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+
+
+def keyset_condition(columns: tuple, cursor: str | None, descending: bool = True):
+    """WHERE clause selecting the rows after `cursor` in `columns` order, or None for the first page."""
+    if not cursor:
+        return None
+    key, after = tuple_(*columns), tuple_(*decode_cursor(cursor, columns))
+    return key < after if descending else key > after
+
+
+def order_by_key(columns: tuple, descending: bool = True) -> list:
+    return [column.desc() if descending else column.asc() for column in columns]
+
+
+def finish_page(rows: list, columns: tuple, limit: int, response: Response | None = None) -> list:
+    """
+    Trims `rows` (fetched with `limit` + 1) to one page, and sets
+    X-Next-Cursor on `response` from the last row if there was an extra one.
+    """
+    if len(rows) > limit:
+        rows = rows[:limit]
+        if response is not None:
+            last = rows[-1]
+            response.headers[NEXT_CURSOR_HEADER] = encode_cursor(tuple(getattr(last, c.key) for c in columns))
+    return rows
+
+
+def clamp_limit(limit: int, max_limit: int = MAX_PAGE_SIZE) -> int:
+    return max(1, min(limit, max_limit))
+
+
+def paginate(
+    query,
+    columns: tuple,
+    cursor: str | None,
+    limit: int,
+    response: Response | None = None,
+    max_limit: int = MAX_PAGE_SIZE,
+    descending: bool = True,
+) -> list:
+    """
+    Runs one page of `query` ordered by `columns` (the last one must be
+    unique). The query's entities/columns must expose every column of the
+    key under the same name. Sets X-Next-Cursor on `response` when there are
+    more rows. `descending` = newest first for (created_at, id) keys.
+    """
+    limit = clamp_limit(limit, max_limit)
+    condition = keyset_condition(columns, cursor, descending)
+    if condition is not None:
+        query = query.filter(condition)
+    rows = query.order_by(*order_by_key(columns, descending)).limit(limit + 1).all()
+    return finish_page(rows, columns, limit, response)
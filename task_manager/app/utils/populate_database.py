@@ -7,6 +7,7 @@ import os
 import re
 import math
 import fitz
+import numpy as np
 from google.cloud import vision
 from collections import Counter
 from dotenv import load_dotenv
@@ -16,6 +17,8 @@ from rapidfuzz import process
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 import app.models as models
+from app.utils import metrics
+from app.utils import llm_cache
 
 load_dotenv()
 
@@ -49,6 +52,7 @@ os.makedirs(DATA_DIR, exist_ok=True)
 CHROMA_PATH = os.path.join(DATA_DIR, "chroma")
 USE_CENTRAL_DB = True
 CENTRAL_TAG = "central"
+TOPIC_INDEX_CHUNKS_PER_TOPIC = 3
 
 engine = create_engine(os.getenv("DATABASE_URL"))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -112,6 +116,7 @@ def correct_word(word: str, threshold: int = 85) -> str:
     return word
 
 
+@metrics.timed("correction")
 def correct_text(text: str) -> str:
     corrected = []
     for token in re.findall(r"\b\w+\b|\W", text):
@@ -173,6 +178,7 @@ def _build_page_topic_map(toc: list, total_pages: int) -> list:
     return page_map
 
 
+@metrics.timed("ocr")
 def ocr_page(page: fitz.Page) -> str:
     try:
         pix = page.get_pixmap(dpi=300)
@@ -230,6 +236,7 @@ def process_document(file_content: bytes, file_name: str, doc_id: str, user_id:
         return []
 
 
+@metrics.timed("splitting")
 def split_documents(documents: list[Document]) -> list[Document]:
     text_splitter = RecursiveCharacterTextSplitter(
         chunk_size=800,
@@ -240,7 +247,12 @@ def split_documents(documents: list[Document]) -> list[Document]:
     return text_splitter.split_documents(documents)
 
 
-def add_to_chroma(tag: str, chunks: list[Document], doc_id: str | None = None):
+def embed_and_store(tag: str, chunks: list[Document], doc_id: str | None = None):
+    """
+    Embeds the chunks once and writes them to the tag collection (and the
+    central one). Returns (chunk ids, vectors) so callers can reuse the
+    embeddings, e.g. for build_topic_index.
+    """
     doc_id = doc_id or "shared"
     db_tag = get_chroma_db(tag, doc_id)
 
@@ -257,16 +269,58 @@ def add_to_chroma(tag: str, chunks: list[Document], doc_id: str | None = None):
         texts.append(chunk.page_content)
 
     embedding_fn = get_embedding_function()
-    vectors = embedding_fn.embed_documents(texts)
-    db_tag.add_texts(texts, ids=ids, metadatas=metadatas, embeddings=vectors)
+    with metrics.span("embedding"):
+        vectors = embedding_fn.embed_documents(texts)
+    with metrics.span("chroma_write", collection="tag"):
+        db_tag.add_texts(texts, ids=ids, metadatas=metadatas, embeddings=vectors)
 
     if USE_CENTRAL_DB and tag != CENTRAL_TAG:
         db_central = get_chroma_db(CENTRAL_TAG, doc_id)
-        db_central.add_texts(texts, ids=ids, metadatas=metadatas, embeddings=vectors)
+        with metrics.span("chroma_write", collection="central"):
+            db_central.add_texts(texts, ids=ids, metadatas=metadatas, embeddings=vectors)
+
+    return ids, vectors
+
 
+def add_to_chroma(tag: str, chunks: list[Document], doc_id: str | None = None):
+    ids, _ = embed_and_store(tag, chunks, doc_id)
     return ids
 
 
+def build_topic_index(
+    ids: list[str], metadatas: list[dict], vectors, per_topic: int = TOPIC_INDEX_CHUNKS_PER_TOPIC
+) -> dict[str, list[str]]:
+    """
+    Maps each topic to the ids of the `per_topic` chunks closest to the topic's
+    embedding centroid, i.e. the chunks that best represent it. Stored on the
+    Document so quiz content selection is a single lookup by id.
+    """
+    by_topic = {}
+    for index, metadata in enumerate(metadatas):
+        by_topic.setdefault((metadata or {}).get("topic", "Introduction"), []).append(index)
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix = matrix / np.where(norms == 0, 1, norms)
+
+    topic_index = {}
+    for topic, indexes in by_topic.items():
+        topic_vectors = matrix[indexes]
+        centroid = topic_vectors.mean(axis=0)
+        closest = np.argsort(-(topic_vectors @ centroid))[:per_topic]
+        # Keep document order inside a topic so the quiz content reads naturally
+        topic_index[topic] = [ids[indexes[i]] for i in sorted(closest)]
+    return topic_index
+
+
+def build_topic_index_from_collection(tag: str, doc_id: str) -> dict[str, list[str]]:
+    """Builds the topic index from the embeddings already stored in Chroma (documents ingested earlier)."""
+    rows = get_chroma_db(tag, doc_id).get(where={"doc_id": doc_id}, include=["metadatas", "embeddings"])
+    if rows is None or len(rows.get("ids", [])) == 0:
+        return {}
+    return build_topic_index(rows["ids"], rows["metadatas"], rows["embeddings"])
+
+
 def run_ingestion_pipeline(db_url: str, doc_id: str, file_path: str, tag: str, user_id: str):
     db = get_standalone_session()
     try:
@@ -279,12 +333,14 @@ def run_ingestion_pipeline(db_url: str, doc_id: str, file_path: str, tag: str, u
             raise ValueError("Document processing failed, no content extracted.")
 
         chunks = split_documents(documents)
-        chroma_ids = add_to_chroma(tag, chunks, doc_id)
+        chroma_ids, vectors = embed_and_store(tag, chunks, doc_id)
+        topic_index = build_topic_index(chroma_ids, [chunk.metadata for chunk in chunks], vectors)
 
         db.query(models.Document).filter(models.Document.id == doc_id).update(
-            {"status": models.DocumentStatus.COMPLETED, "chroma_ids": chroma_ids}
+            {"status": models.DocumentStatus.COMPLETED, "chroma_ids": chroma_ids, "topic_index": topic_index}
         )
-        db.commit()
+        with metrics.span("db_commit", site="ingestion"):
+            db.commit()
     except Exception as e:
         print(f"BACKGROUND TASK FAILED for doc_id {doc_id}: {e}")
         db.query(models.Document).filter(models.Document.id == doc_id).update({"status": models.DocumentStatus.FAILED})
@@ -304,18 +360,24 @@ def correct_with_llm(text: str) -> str:
             Original Text:
             {original_text}
             """
-    try:
+
+    def generate():
         model = genai.GenerativeModel("gemini-2.0-flash")
-        response = model.generate_content(
-            prompt.format(original_text=text),
-            generation_config=genai.types.GenerationConfig(temperature=0.0, max_output_tokens=1200),
-        )
+        with metrics.span("llm_call", site="ocr_correction"):
+            response = model.generate_content(
+                prompt.format(original_text=text),
+                generation_config=genai.types.GenerationConfig(temperature=0.0, max_output_tokens=1200),
+            )
         return (response.text or "").strip()
+
+    try:
+        return llm_cache.cached_call("ocr_correction", (text,), generate)
     except Exception as e:
         print(f"Error querying Gemini: {e}")
         return "Sorry, I encountered an error while generating a response."
 
 
+@metrics.timed("rerank")
 def rerank_documents(query: str, retrieved_docs: list[Document]) -> list[Document]:
     if not retrieved_docs:
         return []
@@ -331,7 +393,7 @@ def format_chat_history(messages: list[models.Message]) -> list[dict]:
     return [{"role": msg.role, "content": msg.content} for msg in messages]
 
 
-def query_llm(question: str, context_text: str, chat_history: list[dict]):
+def query_llm(question: str, context_text: str, chat_history: list[dict], summary: str | None = None):
     system_prompt = """You are a helpful study assistant. Based ONLY on retrieved context, answer the latest question.
 If context is insufficient, say: I couldn't find information on that topic in the provided documents.
 Do not hallucinate.
@@ -340,15 +402,26 @@ CONTEXT:
 """.strip()
 
     history_text = "\n".join([f"{m.get('role', 'user')}: {m.get('content', '')}" for m in chat_history])
+    # Older turns arrive as the conversation's rolling summary (app/utils/memory.py)
+    if summary:
+        history_text = f"(Summary of the earlier conversation: {summary})\n{history_text}"
     prompt = f"{system_prompt.format(context=context_text)}\n\nCHAT HISTORY:\n{history_text}\n\nUSER QUESTION:\n{question}"
 
-    try:
+    def generate():
         model = genai.GenerativeModel("gemini-2.0-flash")
-        response = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(temperature=0.2, max_output_tokens=1200),
-        )
+        with metrics.span("llm_call", site="ask"):
+            response = model.generate_content(
+                prompt,
+                generation_config=genai.types.GenerationConfig(temperature=0.2, max_output_tokens=1200),
+            )
         return (response.text or "").strip()
+
+    # Near-duplicate questions may share an answer only when they were asked
+    # against the same retrieved context and chat history.
+    try:
+        return llm_cache.cached_call(
+            "ask", (prompt,), generate, semantic_text=question, scope=(context_text, history_text)
+        )
     except Exception as e:
         print(f"Error querying Gemini: {e}")
         return "Sorry, I encountered an error while generating a response."
@@ -423,6 +496,7 @@ def _lexical_score(query: str, content: str, metadata: dict) -> float:
     return score
 
 
+@metrics.timed("retrieval")
 def retrieve_tree_based_context(query: str, tag: str, top_k: int = 3) -> list[Document]:
     candidates: list[tuple[float, Document]] = []
 
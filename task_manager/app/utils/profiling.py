@@ -0,0 +1,187 @@
+"""
+Opt-in request profiling for the FastAPI app.
+
+A request is profiled when it carries `X-Profile: <PROFILING_TOKEN>` or when
+it is picked by PROFILING_SAMPLE_RATE (0.0 - 1.0, default 0). The header is
+ignored unless PROFILING_TOKEN is set, so clients cannot turn it on by
+themselves.
+
+For a profiled request we record:
+- a call profile: pyinstrument when it is installed (async aware), otherwise
+  cProfile on the event loop thread (top functions by cumulative time).
+  Sync endpoints run in the threadpool and only show up in pyinstrument.
+- every SQL statement executed while handling the request, via SQLAlchemy
+  cursor events, with its duration.
+
+Profiles are stored in Redis under `profile:<id>` with a TTL, and their ids
+are kept in a capped list, so storage stays bounded. The response carries an
+`X-Profile-Id` header that admins can look up with /admin/profiles/<id>.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", 0))
+PROFILING_MAX_STORED = int(os.getenv("PROFILING_MAX_STORED", 200))
+PROFILING_TTL_SECONDS = int(os.getenv("PROFILING_TTL_SECONDS", 7 * 24 * 3600))
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+PROFILE_INDEX_KEY = "profiles:index"
+TOP_FUNCTIONS = 50
+MAX_SQL_STATEMENTS = 100
+
+_sql_collector = ContextVar("sql_collector", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _sql_collector.get() is not None:
+        conn.info.setdefault("_profiling_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    collector = _sql_collector.get()
+    if collector is None:
+        return
+    starts = conn.info.get("_profiling_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    collector.append((statement, elapsed))
+
+
+def should_profile(request) -> bool:
+    if PROFILING_TOKEN and request.headers.get(PROFILE_HEADER) == PROFILING_TOKEN:
+        return True
+    return PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE
+
+
+class _Profiler:
+    """Wraps pyinstrument if available, cProfile otherwise."""
+
+    def __init__(self):
+        try:
+            from pyinstrument import Profiler
+            self.kind = "pyinstrument"
+            self._profiler = Profiler(async_mode="enabled")
+        except ImportError:
+            self.kind = "cprofile"
+            self._profiler = cProfile.Profile()
+
+    def start(self):
+        if self.kind == "pyinstrument":
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self):
+        if self.kind == "pyinstrument":
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def report(self) -> str:
+        if self.kind == "pyinstrument":
+            return self._profiler.output_text(unicode=False, color=False)
+        out = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=out)
+        stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+        return out.getvalue()
+
+
+def _summarize_sql(statements: list[tuple[str, float]]) -> dict:
+    slowest = sorted(statements, key=lambda s: s[1], reverse=True)[:MAX_SQL_STATEMENTS]
+    return {
+        "count": len(statements),
+        "total_ms": round(sum(elapsed for _, elapsed in statements) * 1000, 3),
+        "slowest": [
+            {"statement": " ".join(statement.split())[:500], "duration_ms": round(elapsed * 1000, 3)}
+            for statement, elapsed in slowest
+        ],
+    }
+
+
+async def profile_request(request, call_next, redis_client):
+    """Runs the request under the profiler and stores the result in Redis."""
+    profiler = _Profiler()
+    try:
+        profiler.start()
+    except (RuntimeError, ValueError) as e:
+        # Only one profiler can be active per thread; concurrent requests on the
+        # event loop are served unprofiled while another one is being profiled.
+        print(f"PROFILING: skipped {request.url.path}: {e}")
+        return await call_next(request)
+
+    profile_id = uuid.uuid4().hex
+    statements = []
+    token = _sql_collector.set(statements)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+        _sql_collector.reset(token)
+    duration = time.perf_counter() - started
+
+    profile = {
+        "id": profile_id,
+        "method": request.method,
+        "path": request.url.path,
+        "status_code": response.status_code,
+        "duration_ms": round(duration * 1000, 3),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "profiler": profiler.kind,
+        "sql": _summarize_sql(statements),
+        "report": profiler.report(),
+    }
+    try:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.set(f"profile:{profile_id}", json.dumps(profile), ex=PROFILING_TTL_SECONDS)
+            pipe.lpush(PROFILE_INDEX_KEY, profile_id)
+            _, stored = await pipe.execute()
+        if stored > PROFILING_MAX_STORED:
+            # Drop the oldest profiles themselves, not just their ids, so memory
+            # stays bounded by PROFILING_MAX_STORED rather than the TTL. RPOP
+            # hands each evicted id to exactly one request.
+            evicted = await redis_client.rpop(PROFILE_INDEX_KEY, stored - PROFILING_MAX_STORED) or []
+            if evicted:
+                await redis_client.delete(*[f"profile:{old_id}" for old_id in evicted])
+        response.headers[PROFILE_ID_HEADER] = profile_id
+    except Exception as e:
+        # Never fail the request because the profile could not be stored
+        print(f"PROFILING: could not store profile {profile_id}: {e}")
+    return response
+
+
+async def list_profiles(redis_client, limit: int = 50) -> list[dict]:
+    """Newest stored profiles, without the (large) report text."""
+    ids = await redis_client.lrange(PROFILE_INDEX_KEY, 0, max(limit, 1) - 1)
+    if not ids:
+        return []
+    raw_profiles = await redis_client.mget([f"profile:{profile_id}" for profile_id in ids])
+    summaries = []
+    for raw in raw_profiles:
+        if not raw:
+            continue  # Expired; its id is popped from the index once it falls past the limit
+        profile = json.loads(raw)
+        profile.pop("report", None)
+        profile["sql"] = {"count": profile["sql"]["count"], "total_ms": profile["sql"]["total_ms"]}
+        summaries.append(profile)
+    return summaries
+
+
+async def get_profile(redis_client, profile_id: str) -> dict | None:
+    raw = await redis_client.get(f"profile:{profile_id}")
+    return json.loads(raw) if raw else None
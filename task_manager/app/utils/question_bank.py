@@ -0,0 +1,152 @@
+"""
+Per-document pool of pre-generated quiz questions.
+
+build_question_bank() runs in a Celery worker after a quiz document is
+ingested. It generates questions for every topic of the document's topic
+index, validates them, and stores them as QuestionBankItem rows keyed by
+(language, hard_mode). /generate_quiz then samples a quiz from the bank
+without calling the LLM. When the pool of never-served questions runs low, the
+endpoint queues a top-up build for the topics with the fewest questions.
+"""
+import os
+import random
+
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+import app.models as models
+from app.utils import populate_database as populate_db
+from app.utils import quiz
+
+BANK_QUESTIONS_PER_TOPIC = int(os.getenv("QUESTION_BANK_PER_TOPIC", 6))
+BANK_MAX_TOPICS_PER_BUILD = int(os.getenv("QUESTION_BANK_MAX_TOPICS_PER_BUILD", 30))
+# Top up once fewer unserved questions than this many quizzes' worth are left
+BANK_LOW_WATERMARK_QUIZZES = 2
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def _bank_filter(query, document_id: str, language: str, hard_mode: bool):
+    return query.filter(
+        models.QuestionBankItem.document_id == document_id,
+        models.QuestionBankItem.language == language,
+        models.QuestionBankItem.hard_mode == hard_mode,
+    )
+
+
+def sample_questions(db: Session, document_id: str, settings: dict) -> tuple[list[models.QuestionBankItem], bool]:
+    """
+    Picks `max_questions` bank questions of the requested types, least served
+    first and spread across topics. Returns ([], True) when the bank cannot
+    fill the quiz. The second value tells the caller to queue a top-up.
+    """
+    wanted = settings["max_questions"]
+    QBI = models.QuestionBankItem
+    candidates = _bank_filter(
+        db.query(QBI.id, QBI.topic, QBI.times_served), document_id, settings["language"], settings["hard_mode"]
+    ).filter(QBI.question_type.in_(settings["question_types"])).all()
+
+    if len(candidates) < wanted:
+        return [], True
+
+    random.shuffle(candidates)
+    candidates.sort(key=lambda c: c.times_served)  # Stable: random order within each served count
+    by_topic = {}
+    for candidate in candidates:
+        by_topic.setdefault(candidate.topic, []).append(candidate)
+
+    picked = []
+    while len(picked) < wanted:
+        for topic_candidates in by_topic.values():
+            if topic_candidates and len(picked) < wanted:
+                picked.append(topic_candidates.pop(0))
+
+    picked_ids = [c.id for c in picked]
+    items = {item.id: item for item in db.query(QBI).filter(QBI.id.in_(picked_ids)).all()}
+    db.query(QBI).filter(QBI.id.in_(picked_ids)).update(
+        {QBI.times_served: QBI.times_served + 1}, synchronize_session=False
+    )
+
+    unserved_left = sum(1 for c in candidates if c.times_served == 0) - sum(1 for c in picked if c.times_served == 0)
+    needs_top_up = unserved_left < wanted * BANK_LOW_WATERMARK_QUIZZES
+    return [items[item_id] for item_id in picked_ids], needs_top_up
+
+
+def build_question_bank(db: Session, document_id: str, tag: str, language: str = "English", hard_mode: bool = False) -> int:
+    """
+    Generates and stores validated questions for the document's least covered
+    topics. Commits after each topic so a partial build is still usable.
+    Returns the number of questions added.
+    """
+    document = db.query(models.Document).filter(models.Document.id == document_id).first()
+    if not document:
+        raise ValueError(f"Document {document_id} not found.")
+    if not document.topic_index:
+        document.topic_index = populate_db.build_topic_index_from_collection(tag, document_id)
+        db.commit()
+    if not document.topic_index:
+        print(f"QUESTION BANK: no topics found for doc_id {document_id}")
+        return 0
+
+    QBI = models.QuestionBankItem
+    counts = dict(
+        _bank_filter(db.query(QBI.topic, func.count(QBI.id)), document_id, language, hard_mode)
+        .group_by(QBI.topic)
+        .all()
+    )
+    topics = sorted(document.topic_index, key=lambda t: counts.get(t, 0))[:BANK_MAX_TOPICS_PER_BUILD]
+
+    chunk_ids = [chunk_id for topic in topics for chunk_id in document.topic_index[topic]]
+    rows = populate_db.get_chroma_db(tag, document_id).get(ids=chunk_ids, include=["documents"])
+    text_by_id = dict(zip(rows["ids"], rows["documents"]))
+
+    existing = {}
+    for topic, text in _bank_filter(db.query(QBI.topic, QBI.question_text), document_id, language, hard_mode).all():
+        existing.setdefault(topic, []).append(text)
+    seen = {_normalize(text) for texts in existing.values() for text in texts}
+
+    settings = {
+        "max_questions": BANK_QUESTIONS_PER_TOPIC,
+        "question_types": list(quiz.SUPPORTED_QUESTION_TYPES),
+        "language": language,
+        "hard_mode": hard_mode,
+    }
+    added = 0
+    for topic in topics:
+        content = "\n\n".join(text_by_id[c] for c in document.topic_index[topic] if c in text_by_id)
+        if not content:
+            continue
+        try:
+            generated = quiz.quiz_generation(f"Topic: {topic}\n\n{content}", settings, existing.get(topic))
+        except (ValueError, RuntimeError) as e:
+            print(f"QUESTION BANK: generation failed for topic '{topic}' of doc_id {document_id}: {e}")
+            continue
+
+        rows = []
+        for q_data in generated.get("questions", []):
+            if not quiz.validate_question(q_data, quiz.SUPPORTED_QUESTION_TYPES):
+                continue
+            key = _normalize(q_data["question_text"])
+            if key in seen:
+                continue
+            seen.add(key)
+            rows.append({
+                "document_id": document_id,
+                "topic": topic,
+                "question_type": q_data["question_type"],
+                "language": language,
+                "hard_mode": hard_mode,
+                "question_text": q_data["question_text"].strip(),
+                "options": q_data.get("options"),
+                "correct_answer": q_data["correct_answer"].strip(),
+                "times_served": 0,
+            })
+        if rows:
+            db.execute(insert(QBI), rows)
+            db.commit()
+            added += len(rows)
+
+    print(f"QUESTION BANK: added {added} questions for doc_id {document_id} ({language}, hard_mode={hard_mode})")
+    return added
@@ -1,7 +1,17 @@
 from app.utils.populate_database import *
 import json
+import math
+import re
 import textwrap
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 import google.generativeai as genai
+from app.utils import llm_cache, metrics
+from app.utils.redis_store import get_redis
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -116,17 +126,18 @@ def run_quiz_ingestion_pipeline(db_url: str, doc_id: str, file_path: str, tag: s
         chunks = split_documents(documents)
         print(f"BACKGROUND TASK: Split into {len(chunks)} chunks.")
 
-        # 4. Add to ChromaDB
-        chroma_ids = add_to_chroma(tag, chunks)
-        if USE_CENTRAL_DB:
-             add_to_chroma(CENTRAL_TAG, chunks)
+        # 4. Add to ChromaDB (embed_and_store also writes the central copy)
+        chroma_ids, vectors = embed_and_store(tag, chunks, doc_id)
+        topic_index = build_topic_index(chroma_ids, [chunk.metadata for chunk in chunks], vectors)
 
         # 5. If successful, update status to 'completed'
         db.query(models.Document).filter(models.Document.id == doc_id).update({
         "status": models.DocumentStatus.COMPLETED,
-        "chroma_ids": chroma_ids
+        "chroma_ids": chroma_ids,
+        "topic_index": topic_index
         })
-        db.commit()
+        with metrics.span("db_commit", site="quiz_ingestion"):
+            db.commit()
         print(f"BACKGROUND TASK: Successfully completed ingestion for doc_id: {doc_id}")
 
     except Exception as e:
@@ -146,7 +157,7 @@ def run_quiz_ingestion_pipeline(db_url: str, doc_id: str, file_path: str, tag: s
 # Assume 'genai' is already configured with your API key
 # genai.configure(api_key="YOUR_API_KEY")
 
-def build_prompt(content: str, settings: dict) -> str:
+def build_prompt(content: str, settings: dict, avoid_questions: list[str] | None = None) -> str:
     """
     Builds the token-efficient prompt for the LLM.
     Removes leading whitespace for token efficiency.
@@ -154,11 +165,12 @@ def build_prompt(content: str, settings: dict) -> str:
     prompt_template = f"""
         Generate a quiz in JSON format based on the following settings and content. Your entire response must be ONLY the raw JSON object, starting with {{ and ending with }}.
         If you think the content is not accurate enough you can make changes in the content as per your requirement but ensure that the questions are relevant to the content provided and accurate to the best of your knowledge.
-        JSON Schema: The root must be a "questions" array. Each object in the array must contain these keys:
+        JSON Schema: The root must be an object with a "questions" array. Each object in the array must contain these keys:
         - "question_text": (string) The question.
         - "question_type": (string) Must be one of {settings['question_types']}.
         - "options": (object or null) For "Multiple choice", use  {{"A": "...", "B": "...", ...}}. For "True or false", use {{"A": "True", "B": "False"}}. For other types, this must be null.
         - "correct_answer": (string) The key of the correct option (e.g., "A") for multiple choice, the string "True" or "False" for true/false, or the direct answer for other types.
+        - "topic": (string or null) The "Topic:" heading of the content section the question is based on, or null if the content has no such headings.
 
         ---
         Settings:
@@ -172,46 +184,321 @@ def build_prompt(content: str, settings: dict) -> str:
     """
     
     dedented_template = textwrap.dedent(prompt_template)
+    if avoid_questions:
+        already_asked = "\n".join(f"- {q}" for q in avoid_questions)
+        dedented_template += f"\n---\nDo not repeat or rephrase these existing questions:\n{already_asked}\n"
 
     return dedented_template
 
-def quiz_generation(content: str, settings: dict) -> dict:
+SUPPORTED_QUESTION_TYPES = ("Multiple choice", "True or false", "Short response", "Fill in the blank")
+
+
+def validate_question(q_data: dict, allowed_types) -> bool:
+    """Checks a generated question has the shape the quiz pages and grading expect."""
+    if not isinstance(q_data, dict):
+        return False
+    text = q_data.get("question_text")
+    q_type = q_data.get("question_type")
+    answer = q_data.get("correct_answer")
+    options = q_data.get("options")
+    if not isinstance(text, str) or not text.strip() or q_type not in allowed_types:
+        return False
+    if not isinstance(answer, str) or not answer.strip():
+        return False
+    if q_type == "Multiple choice":
+        return isinstance(options, dict) and len(options) >= 2 and bool(options.get(answer.strip()))
+    if q_type == "True or false":
+        return answer.strip().lower() in ("true", "false")
+    # The response schema makes the model send {} where the prompt asks for null
+    return not options
+
+
+# Gemini response schema (OpenAPI subset). Options use fixed A-D keys because
+# the schema cannot describe free-form objects.
+QUIZ_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "questions": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "question_text": {"type": "string"},
+                    "question_type": {"type": "string"},
+                    "options": {
+                        "type": "object",
+                        "nullable": True,
+                        "properties": {key: {"type": "string"} for key in ("A", "B", "C", "D")},
+                    },
+                    "correct_answer": {"type": "string"},
+                    "topic": {"type": "string", "nullable": True},
+                },
+                "required": ["question_text", "question_type", "correct_answer"],
+            },
+        },
+    },
+    "required": ["questions"],
+}
+
+QUIZ_MAX_ATTEMPTS = 3
+QUIZ_RETRY_BACKOFF_SECONDS = 1.0
+QUIZ_TOKENS_PER_QUESTION = 180
+QUIZ_MAX_OUTPUT_TOKENS = 8192
+QUIZ_BATCH_SIZE = int(os.getenv("QUIZ_BATCH_SIZE", 10))
+QUIZ_MAX_PARALLEL_BATCHES = int(os.getenv("QUIZ_MAX_PARALLEL_BATCHES", 4))
+
+
+class _QuestionStreamParser:
+    """
+    Pulls complete question objects out of a partially received
+    {"questions": [...]} document, so each can be used as soon as its closing
+    brace arrives.
     """
-    Generates a quiz by calling the Gemini API and parses the JSON response.
+
+    def __init__(self):
+        self.buffer = ""
+        self.pos = 0
+        self.depth = 0  # Nesting depth relative to the questions array (1 = directly inside it)
+        self.in_array = False
+        self.done = False
+        self.in_string = False
+        self.escape = False
+        self.object_start = None
+
+    def feed(self, text: str) -> list[dict]:
+        self.buffer += text
+        found = []
+        if not self.in_array:
+            match = re.search(r'"questions"\s*:\s*\[', self.buffer)
+            if not match:
+                return found
+            self.in_array = True
+            self.pos = match.end()
+            self.depth = 1
+
+        while self.pos < len(self.buffer) and not self.done:
+            ch = self.buffer[self.pos]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "{[":
+                if ch == "{" and self.depth == 1:
+                    self.object_start = self.pos
+                self.depth += 1
+            elif ch in "}]":
+                self.depth -= 1
+                if ch == "}" and self.depth == 1 and self.object_start is not None:
+                    try:
+                        found.append(json.loads(self.buffer[self.object_start:self.pos + 1]))
+                    except json.JSONDecodeError:
+                        pass  # Malformed object; the rest of the stream is still usable
+                    self.object_start = None
+                elif self.depth == 0:
+                    self.done = True
+            self.pos += 1
+        return found
+
+    def fallback_parse(self) -> list[dict]:
+        """Whole-document parse for responses that ignored the schema (e.g. fenced JSON)."""
+        cleaned = self.buffer.strip().replace('```json', '').replace('```', '')
+        try:
+            data = json.loads(cleaned)
+        except json.JSONDecodeError:
+            return []
+        return data.get("questions", []) if isinstance(data, dict) else data if isinstance(data, list) else []
+
+
+def _stream_questions(prompt: str, max_questions: int, allowed_types, on_question) -> int:
+    """
+    Runs one streamed generation, passing each valid question to on_question.
+    on_question returns False for a question it dropped (e.g. a duplicate);
+    those don't count. Returns how many were kept.
     """
     model = genai.GenerativeModel("gemini-2.0-flash")
-    
     config = genai.types.GenerationConfig(
-        # response_mime_type="application/json", # Use this to enforce JSON output!
+        response_mime_type="application/json",
+        response_schema=QUIZ_RESPONSE_SCHEMA,
         temperature=0.2,
-        max_output_tokens=1500
+        max_output_tokens=min(QUIZ_MAX_OUTPUT_TOKENS, 400 + QUIZ_TOKENS_PER_QUESTION * max_questions)
     )
-
-    prompt = build_prompt(content, settings)
-    
-    try:
-        response = model.generate_content(
-            prompt,
-            generation_config=config
-        )
-        
-        cleaned_text = response.text.strip().replace('```json', '').replace('```', '')
-        data = json.loads(cleaned_text)
-        print("[INFO] Successfully received and parsed data from Gemini.")
-    except json.JSONDecodeError:
-        # Handle cases where the model response is not valid JSON
-        raise ValueError("Failed to decode JSON from the model's response.")
-    except Exception as e:
-        # Handle other potential API errors (e.g., network, authentication)
-        raise RuntimeError(f"An error occurred during API call: {e}")
-
+    parser = _QuestionStreamParser()
+    emitted = 0
+
+    def emit(candidates):
+        nonlocal emitted
+        for q_data in candidates:
+            if emitted >= max_questions or not isinstance(q_data, dict):
+                continue
+            # The schema's fixed A-D keys come back empty when unused; validate what is left
+            options = q_data.get("options")
+            if isinstance(options, dict):
+                q_data["options"] = {k: v for k, v in options.items() if v} or None
+            if validate_question(q_data, allowed_types) and on_question(q_data) is not False:
+                emitted += 1
+
+    with metrics.span("llm_call", site="quiz"):
+        for chunk in model.generate_content(prompt, generation_config=config, stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                continue  # Chunks without text parts (e.g. the final finish_reason chunk)
+            emit(parser.feed(text))
+    if not parser.in_array:
+        emit(parser.fallback_parse())
+    return emitted
+
+
+def quiz_generation(content: str, settings: dict, avoid_questions: list[str] | None = None, on_question=None) -> dict:
+    """
+    Generates a quiz with schema-constrained JSON output and parses it while it
+    streams. Every valid question is passed to `on_question` as soon as it is
+    complete, so callers can persist it immediately; `on_question` returns
+    False to drop one. Failed or short attempts are retried with backoff for
+    the missing questions only.
+    """
+    prompt = build_prompt(content, settings, avoid_questions)
+    allowed_types = settings['question_types']
+    generated_now = False
+
+    def generate():
+        nonlocal generated_now
+        generated_now = True
+        questions, dropped = [], []
+
+        def collect(q_data):
+            if on_question and on_question(q_data) is False:
+                dropped.append(q_data['question_text'])
+                return False
+            questions.append(q_data)
+
+        last_error = None
+        for attempt in range(QUIZ_MAX_ATTEMPTS):
+            remaining = settings['max_questions'] - len(questions)
+            if remaining <= 0:
+                break
+            if attempt:
+                time.sleep(QUIZ_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1))
+            attempt_prompt = prompt if not questions else build_prompt(
+                content,
+                {**settings, 'max_questions': remaining},
+                (avoid_questions or []) + dropped + [q['question_text'] for q in questions]
+            )
+            try:
+                _stream_questions(attempt_prompt, remaining, allowed_types, collect)
+            except Exception as e:
+                last_error = e
+                print(f"[WARN] Quiz generation attempt {attempt + 1} failed: {e}")
+
+        if not questions:
+            if last_error:
+                raise RuntimeError(f"An error occurred during API call: {last_error}")
+            raise ValueError("Failed to decode JSON from the model's response.")
+        print(f"[INFO] Received {len(questions)} valid questions from Gemini.")
+        return {"questions": questions}
+
+    data = llm_cache.cached_call("quiz", (prompt,), generate)
+    if on_question and not generated_now:
+        # Served from the cache: replay so the caller still sees every question
+        for q_data in data.get("questions", []):
+            on_question(q_data)
     return data
 
 
-def get_representative_chunks_for_quiz(tag: str, source_doc_id: str) -> str:
+def _split_content(content: str, parts: int) -> list[str]:
+    """Splits pasted text on paragraph boundaries into roughly equal parts."""
+    paragraphs = [p for p in content.split("\n\n") if p.strip()]
+    if parts <= 1 or len(paragraphs) < parts:
+        return [content]
+    target = sum(len(p) for p in paragraphs) / parts
+    groups, current, size = [], [], 0
+    for paragraph in paragraphs:
+        current.append(paragraph)
+        size += len(paragraph)
+        if size >= target and len(groups) < parts - 1:
+            groups.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        groups.append("\n\n".join(current))
+    return groups
+
+
+def generate_quiz_batched(contents: list[str], settings: dict, on_question=None) -> list[dict]:
+    """
+    Generates `max_questions` questions from a list of content blocks (one per
+    topic, or a single pasted text). Large quizzes are split into batches of
+    about QUIZ_BATCH_SIZE questions over disjoint groups of topics, generated
+    in parallel. Duplicates across batches are dropped and don't count toward
+    a batch's share; if the batches still come up short (failed batches,
+    cached replies with duplicates), one more call over all the content asks
+    for the rest. `on_question` may be called from several threads at once.
     """
-    Connects to ChromaDB, finds all unique topics for a document,
-    and returns a string of 2 representative chunks from each topic.
+    total = settings['max_questions']
+    batches = max(1, math.ceil(total / QUIZ_BATCH_SIZE))
+    if len(contents) == 1:
+        contents = _split_content(contents[0], batches)
+    batches = max(1, min(batches, len(contents)))
+
+    groups = [contents[i * len(contents) // batches:(i + 1) * len(contents) // batches] for i in range(batches)]
+    counts = [total // batches + (1 if i < total % batches else 0) for i in range(batches)]
+
+    lock = threading.Lock()
+    accepted, seen = [], set()
+
+    def accept(q_data):
+        key = " ".join(q_data['question_text'].lower().split())
+        with lock:
+            if key in seen or len(accepted) >= total:
+                return False
+            seen.add(key)
+            accepted.append(q_data)
+            if on_question:
+                on_question(q_data)
+            return True
+
+    def run_batch(group, count, avoid_questions=None):
+        return quiz_generation(
+            "\n\n".join(group), {**settings, 'max_questions': count}, avoid_questions, on_question=accept
+        )
+
+    if batches == 1:
+        run_batch(groups[0], counts[0])
+        return accepted
+
+    errors = []
+    with ThreadPoolExecutor(max_workers=min(batches, QUIZ_MAX_PARALLEL_BATCHES)) as executor:
+        futures = [executor.submit(run_batch, group, count) for group, count in zip(groups, counts)]
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except (ValueError, RuntimeError) as e:
+                print(f"[WARN] Quiz batch failed: {e}")
+                errors.append(e)
+
+    missing = total - len(accepted)
+    if missing > 0:
+        print(f"[INFO] Quiz batches returned {len(accepted)} of {total} questions; asking for the rest.")
+        try:
+            run_batch(contents, missing, [q['question_text'] for q in accepted])
+        except (ValueError, RuntimeError) as e:
+            print(f"[WARN] Quiz top-up batch failed: {e}")
+            errors.append(e)
+    if not accepted and errors:
+        raise errors[0]
+    return accepted
+
+
+def get_representative_chunks_by_topic(tag: str, source_doc_id: str, topic_index: dict | None = None) -> list[str]:
+    """
+    Returns the representative chunks of a document, one text block per topic,
+    read with a single Chroma lookup by id from the document's topic index
+    ({topic: [chunk ids]}, built at ingestion). Pass the stored index; without
+    one it is rebuilt from the embeddings already in Chroma.
     """
     
     # 1. Get the collection
@@ -219,56 +506,114 @@ def get_representative_chunks_for_quiz(tag: str, source_doc_id: str) -> str:
         chroma_db = get_chroma_db(tag, source_doc_id)
     except Exception as e:
         print(f"Error connecting to ChromaDB for tag {tag}: {e}")
-        return "" # Return empty string on error
+        return [] # Return no content on error
+
+    # 2. Documents ingested before the topic index existed
+    if not topic_index:
+        try:
+            topic_index = build_topic_index_from_collection(tag, source_doc_id)
+        except Exception as e:
+            print(f"Error building topic index for doc_id {source_doc_id}: {e}")
+            topic_index = {}
+
+    # 3. One lookup for every representative chunk
+    chunk_ids = [chunk_id for ids in topic_index.values() for chunk_id in ids]
+    topic_blocks = []
+    if chunk_ids:
+        print(f"Using {len(chunk_ids)} representative chunks from {len(topic_index)} topics")
+        try:
+            rows = chroma_db.get(ids=chunk_ids, include=["documents"])
+            text_by_id = dict(zip(rows["ids"], rows["documents"]))
+            for topic, ids in topic_index.items():
+                texts = [text_by_id[chunk_id] for chunk_id in ids if chunk_id in text_by_id]
+                if texts:
+                    topic_blocks.append(f"Topic: {topic}\n" + "\n\n".join(texts))
+        except Exception as e:
+            print(f"Error reading representative chunks for doc_id {source_doc_id}: {e}")
+
+    # 4. Fallback: just get the first 10 chunks
+    if not topic_blocks:
+        print("No chunks found from the topic index. Using fallback.")
+        all_chunks = chroma_db.get(where={"doc_id": source_doc_id}, limit=10, include=["documents"])
+        return ["\n\n".join(all_chunks['documents'])] if all_chunks['documents'] else []
 
-    # 2. First, get all metadata to find the unique topics
-    # We use .get() for this, as we only need the metadata, not the text.
-    try:
-        metadata_results = chroma_db.get(
-            where={"doc_id": source_doc_id},
-            include=["metadatas"] # Only fetch metadata, this is very fast
-        )
-    except Exception as e:
-        print(f"Error getting metadata for doc_id {source_doc_id}: {e}")
-        return ""
+    return topic_blocks
 
-    if not metadata_results['metadatas']:
-        print(f"No metadata found for doc_id {source_doc_id}")
-        return "" # No chunks found for this document
 
-    # Use a set to find all unique topic names
-    unique_topics = set(meta['topic'] for meta in metadata_results['metadatas'])
-    
-    print(f"Found {len(unique_topics)} unique topics: {unique_topics}")
+def get_representative_chunks_for_quiz(tag: str, source_doc_id: str, topic_index: dict | None = None) -> str:
+    """All representative chunks of a document as one text block."""
+    return "\n\n".join(get_representative_chunks_by_topic(tag, source_doc_id, topic_index))
 
-    # 3. Now, loop through each topic and query for 2 relevant chunks
-    final_chunks = []
-    for topic in unique_topics:
-        
-        # We use .similarity_search() here to find chunks *about* the topic.
-        # We use the topic name itself as the search query!
-        topic_chunks = chroma_db.similarity_search(
-            query=topic,  # Use the topic string (e.g., "Chapter 1: Quantum Physics") as the search query
-            k=3,          # Get the top 2 chunks for this topic
-            filter={      # IMPORTANT: Filter to *only* search within our document AND topic
-                "$and": [
-                    {"doc_id": source_doc_id},
-                    {"topic": topic}
-                ]   
-            } 
-        )
-        
-        for chunk in topic_chunks:
-            final_chunks.append(chunk.page_content) # chunk.page_content is the text
 
-    # 4. Combine and return
-    if not final_chunks:
-        print("No chunks found after topic search. Using fallback.")
-        # Fallback: just get the first 10 chunks if topic search fails
-        all_chunks = chroma_db.get(where={"doc_id": source_doc_id}, limit=10, include=["documents"])
-        return "\n\n".join(all_chunks['documents'])
+def bulk_insert_questions(db, session_id: int, questions: list[dict]):
+    """Writes the questions of a session with a single multi-row INSERT (no commit)."""
+    if not questions:
+        return
+    db.execute(insert(models.Question), [
+        {
+            "session_id": session_id,
+            "question_text": q_data["question_text"],
+            "question_type": q_data["question_type"],
+            "options": q_data.get("options"),
+            "correct_answer": q_data["correct_answer"],
+            "topic": (q_data.get("topic") or "").strip()[:200] or None,
+        }
+        for q_data in questions
+    ])
+
+
+def record_topic_stats(db, user_id: int, document_id: str | None, graded: list[tuple]):
+    """
+    Adds one graded quiz to the user's QuizTopicStat rows with a single upsert
+    (no commit). `graded` holds (topic, question_type, is_correct) per question.
+    """
+    totals = {}
+    for topic, question_type, is_correct in graded:
+        row = totals.setdefault((topic or "", question_type), [0, 0])
+        row[0] += 1
+        row[1] += 1 if is_correct else 0
+    if not totals:
+        return
+
+    QTS = models.QuizTopicStat
+    now = datetime.now(timezone.utc)
+    stmt = pg_insert(QTS).values([
+        {
+            "user_id": user_id,
+            "document_id": document_id or "",
+            "topic": topic,
+            "question_type": question_type,
+            "attempts": attempts,
+            "correct": correct,
+            "last_attempt_at": now,
+        }
+        for (topic, question_type), (attempts, correct) in totals.items()
+    ])
+    db.execute(stmt.on_conflict_do_update(
+        constraint="uq_quiz_topic_stats_key",
+        set_={
+            "attempts": QTS.attempts + stmt.excluded.attempts,
+            "correct": QTS.correct + stmt.excluded.correct,
+            "last_attempt_at": stmt.excluded.last_attempt_at,
+        }
+    ))
+
+
+def quiz_status_channel(session_id: int) -> str:
+    """Redis pub/sub channel announcing generation status changes of a quiz session."""
+    return f"quiz_session:{session_id}:status"
+
+
+def publish_quiz_status(session_id: int, status: str, error: str | None = None):
+    """Notifies subscribers (the /quiz/session/{id}/events stream). Best effort only."""
+    try:
+        get_redis().publish(
+            quiz_status_channel(session_id),
+            json.dumps({"session_id": session_id, "status": status, "error": error}),
+        )
+    except Exception as e:
+        print(f"Could not publish status for quiz session {session_id}: {e}")
 
-    return "\n\n".join(final_chunks)
 
 # --- How you would call this in your main.py ---
 # content_for_llm = get_representative_chunks_for_quiz(
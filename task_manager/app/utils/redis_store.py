@@ -0,0 +1,29 @@
+"""
+Shared synchronous Redis client for code that runs outside the async request
+handlers (utils called from Celery tasks and from sync helpers). Uses the same
+REDIS_URL as the Celery broker.
+"""
+import os
+
+import redis
+from dotenv import load_dotenv
+
+load_dotenv()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+_client = None
+
+
+def get_redis() -> redis.Redis:
+    """Lazily created client; the connection pool is shared by all callers in the process."""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(
+            REDIS_URL,
+            decode_responses=True,
+            socket_connect_timeout=1,
+            socket_timeout=2,
+            health_check_interval=30,
+        )
+    return _client
@@ -1,6 +1,8 @@
 import google.generativeai as genai
 import json
 import textwrap
+from app.utils import metrics
+from app.utils import llm_cache
 
 def summary_gen(text: str, length: str = 'medium') -> dict:
     """
@@ -16,13 +18,16 @@ def summary_gen(text: str, length: str = 'medium') -> dict:
 
     prompt = build_prompt(text, length)
     
+    def generate():
+        with metrics.span("llm_call", site="summarize"):
+            response = model.generate_content(
+                prompt,
+                generation_config=config
+            )
+        return response.text.strip()
+
     try:
-        response = model.generate_content(
-            prompt,
-            generation_config=config
-        )
-        
-        data = response.text.strip()
+        data = llm_cache.cached_call("summarize", (text.strip(), length), generate)
     except Exception as e:
         # Handle other potential API errors (e.g., network, authentication)
         raise RuntimeError(f"An error occurred during API call: {e}")
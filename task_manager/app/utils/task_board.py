@@ -0,0 +1,88 @@
+"""
+The /tasks board: the open (todo / in progress) tasks a user can see, one
+keyset page at a time, plus the most recent done tasks on the first page.
+
+Both groups come from a single UNION ALL statement, and team membership is a
+subquery on user_teams, so a board is one round trip. Each branch is
+`user_id = :me OR team_id IN (...)` with a status filter, ordered by
+(created_at, id) with a LIMIT. The (user_id, status, created_at, id) and
+(team_id, status, created_at, id) indexes serve it as a BitmapOr, or as two
+index scans, instead of reading every task of the user and their teams.
+
+The response carries an ETag over the serialized board. A client
+revalidating with If-None-Match gets a 304 with no body when nothing changed.
+"""
+import hashlib
+import json
+
+from sqlalchemy import or_, select, union_all
+from sqlalchemy.orm import Session
+
+import app.models as models
+import app.schemas as schemas
+from app.utils.pagination import finish_page, keyset_condition, order_by_key
+
+RECENT_DONE_LIMIT = 5
+OPEN_STATUSES = (models.TaskStatus.TODO, models.TaskStatus.IN_PROGRESS)
+BOARD_KEY = (models.Task.created_at, models.Task.id)
+
+
+def visible_tasks_filter(user_id: int):
+    """The user's own tasks and their teams' tasks."""
+    team_ids = select(models.UserTeam.team_id).where(models.UserTeam.user_id == user_id)
+    return or_(models.Task.user_id == user_id, models.Task.team_id.in_(team_ids))
+
+
+def task_board_statement(user_id: int, cursor: str | None, limit: int):
+    """
+    One statement for a board page: `limit` + 1 open tasks after `cursor`,
+    and on the first page (no cursor) the RECENT_DONE_LIMIT newest done tasks.
+    """
+    visible = visible_tasks_filter(user_id)
+    open_tasks = select(models.Task).where(visible, models.Task.status.in_(OPEN_STATUSES))
+    condition = keyset_condition(BOARD_KEY, cursor)
+    if condition is not None:
+        open_tasks = open_tasks.where(condition)
+    open_tasks = open_tasks.order_by(*order_by_key(BOARD_KEY)).limit(limit + 1)
+    if cursor:
+        return open_tasks
+
+    done_tasks = (
+        select(models.Task)
+        .where(visible, models.Task.status == models.TaskStatus.DONE)
+        .order_by(*order_by_key(BOARD_KEY))
+        .limit(RECENT_DONE_LIMIT)
+    )
+    return union_all(open_tasks, done_tasks)
+
+
+def load_task_board(db: Session, user_id: int, cursor: str | None, limit: int, response=None) -> list:
+    """
+    The board page as Task objects: open tasks newest first, then the done
+    ones. Sets X-Next-Cursor on `response` when more open tasks exist.
+    """
+    statement = task_board_statement(user_id, cursor, limit)
+    tasks = db.scalars(select(models.Task).from_statement(statement)).all()
+
+    # UNION ALL does not promise to keep the branches' order
+    newest_first = lambda task: (task.created_at, task.id)
+    open_tasks = sorted((t for t in tasks if t.status != models.TaskStatus.DONE), key=newest_first, reverse=True)
+    done_tasks = sorted((t for t in tasks if t.status == models.TaskStatus.DONE), key=newest_first, reverse=True)
+    return finish_page(open_tasks, BOARD_KEY, limit, response) + done_tasks
+
+
+def serialize_board(tasks: list) -> list[dict]:
+    return [schemas.Task.model_validate(task).model_dump(mode="json") for task in tasks]
+
+
+def board_etag(payload: list[dict], next_cursor: str | None) -> str:
+    raw = json.dumps([payload, next_cursor], sort_keys=True, separators=(",", ":"), default=str)
+    return '"' + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    # Proxies may weaken the tag (W/"..."); If-None-Match uses weak comparison
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
@@ -1,14 +1,23 @@
 import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
 import json
 import csv
 from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
 import time
 import re
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+import hashlib
+import copy
 import app.models as models 
 from typing import List
 import app.auth as auth
+from app.utils import metrics
+from app.utils.redis_store import get_redis
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 import os
@@ -21,15 +30,208 @@ def get_standalone_session():
     return SessionLocal()
 
 
+# Scraper concurrency. MOODLE_MAX_CONCURRENCY=1 gives the old serial behaviour.
+MOODLE_MAX_CONCURRENCY = int(os.getenv("MOODLE_MAX_CONCURRENCY", 4))      # In-flight requests per host
+MOODLE_REQUEST_DELAY = float(os.getenv("MOODLE_REQUEST_DELAY", 0.1))      # Min seconds between request starts per host
+MOODLE_REQUEST_TIMEOUT = float(os.getenv("MOODLE_REQUEST_TIMEOUT", 30))
+
+AJAX_HEADERS = {
+    'Content-Type': 'application/json',
+    'X-Requested-With': 'XMLHttpRequest',
+    'Accept': 'application/json, text/javascript, */*; q=0.01'
+}
+# Moodle error codes meaning the stored session or sesskey is no longer valid
+AUTH_ERROR_CODES = ("invalidsesskey", "servicerequireslogin", "requireloginerror")
+MOODLE_SESSION_TTL = int(os.getenv("MOODLE_SESSION_TTL", 4 * 3600))
+# Parts of a Moodle page that change on every request without the content changing
+_VOLATILE_PAGE_PARTS = re.compile(rb'sesskey(["\']?\s*[:=]\s*["\']?)[\w-]+|yui_[\d_]+|id="[\w-]*\d{6,}[\w-]*"')
+
+
+def _page_fingerprint(content: bytes) -> str:
+    return hashlib.sha256(_VOLATILE_PAGE_PARTS.sub(b'', content)).hexdigest()
+
+
+def _fingerprint(value) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+TASK_MODULES = ("assign", "quiz")
+RESOURCE_MODULES = ("resource", "url", "page", "book")
+COMPLETION_DONE_STATES = (1, 2)  # COMPLETION_COMPLETE, COMPLETION_COMPLETE_PASS
+# Zone Moodle renders dates in; web-service timestamps are converted to it so
+# due dates match the ones scraped from the assignment pages
+MOODLE_TIMEZONE = os.getenv("MOODLE_TIMEZONE", "Asia/Kolkata")
+
+
+class _HostLimiter:
+    """Caps concurrent requests to one host and spaces out their start times."""
+
+    def __init__(self, max_concurrency, delay):
+        self.semaphore = threading.BoundedSemaphore(max(1, max_concurrency))
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.next_start = 0.0
+
+    def wait_turn(self):
+        with self.lock:
+            now = time.monotonic()
+            start_at = max(now, self.next_start)
+            self.next_start = start_at + self.delay
+        if start_at > now:
+            time.sleep(start_at - now)
+
+
 class CollegeTaskExtractor:
-    def __init__(self, base_url, username, password):
+    def __init__(self, base_url, username, password, max_concurrency=None, request_delay=None, sync_state=None):
         self.base_url = base_url
         self.username = username
         self.password = password
+        self.max_concurrency = max(1, max_concurrency or MOODLE_MAX_CONCURRENCY)
+        self.request_delay = MOODLE_REQUEST_DELAY if request_delay is None else request_delay
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         })
+        # The logged-in session is shared by the worker threads; give its
+        # connection pool room for all of them.
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+        self.sesskey = None  # Set once a logged-in page has been read; needed for AJAX calls
+        self.user_id = None
+        self.auth_failed = False  # Set when Moodle sends us back to the login page
+        # Fingerprints and parsed results from the previous sync (MoodleAccount.sync_state),
+        # updated in place: "pages" by URL for scraped pages, "courses" by id for the AJAX path.
+        self.sync_state = sync_state if sync_state is not None else {}
+        self.sync_state.setdefault("pages", {})
+        self.sync_state.setdefault("courses", {})
+        self.sync_stats = {"fetched": 0, "unchanged": 0}
+        self._touched = set()
+
+    def _request(self, method, url, **kwargs):
+        """All HTTP goes through here: per-host concurrency cap and politeness delay."""
+        host = urlparse(url).netloc
+        with self._limiters_lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = self._limiters[host] = _HostLimiter(self.max_concurrency, self.request_delay)
+        kwargs.setdefault('timeout', MOODLE_REQUEST_TIMEOUT)
+        with limiter.semaphore:
+            limiter.wait_turn()
+            response = self.session.request(method, url, **kwargs)
+        if '/login/' not in url and '/login/index.php' in response.url:
+            self.auth_failed = True
+        return response
+
+    def save_session(self, cache_key):
+        """Stores the logged-in cookie jar and sesskey, encrypted, in Redis for MOODLE_SESSION_TTL."""
+        if not self.sesskey:
+            return
+        state = {
+            "cookies": [
+                {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+                 "secure": c.secure, "expires": c.expires}
+                for c in self.session.cookies
+            ],
+            "sesskey": self.sesskey,
+            "user_id": self.user_id
+        }
+        try:
+            get_redis().set(cache_key, auth.encrypt_password(json.dumps(state)), ex=MOODLE_SESSION_TTL)
+        except Exception as e:
+            print(f"Could not store Moodle session: {e}")
+
+    def restore_session(self, cache_key):
+        """Loads a session stored by save_session. Returns False if there is none."""
+        try:
+            stored = get_redis().get(cache_key)
+            if not stored:
+                return False
+            state = json.loads(auth.decrypt_password(stored))
+        except Exception as e:
+            print(f"Could not load stored Moodle session: {e}")
+            return False
+        for cookie in state.get("cookies", []):
+            self.session.cookies.set(
+                cookie["name"], cookie["value"], domain=cookie.get("domain"), path=cookie.get("path", "/"),
+                secure=cookie.get("secure", False), expires=cookie.get("expires")
+            )
+        self.sesskey, self.user_id = state.get("sesskey"), state.get("user_id")
+        return bool(self.sesskey)
+
+    def forget_session(self, cache_key):
+        """Drops a stored session that Moodle no longer accepts."""
+        self.session.cookies.clear()
+        self.sesskey, self.user_id, self.auth_failed = None, None, False
+        try:
+            get_redis().delete(cache_key)
+        except Exception as e:
+            print(f"Could not delete stored Moodle session: {e}")
+
+    def _get(self, url, **kwargs):
+        return self._request('GET', url, **kwargs)
+
+    def _fetch_if_changed(self, url):
+        """
+        GETs a page with the validators saved by the last sync. Returns
+        (response, previous_parse); previous_parse is set when the page is
+        unchanged (304, or the same content once volatile parts are removed),
+        so the caller can skip parsing it again.
+        """
+        pages = self.sync_state["pages"]
+        entry = pages.get(url) or {}
+        has_parse = entry.get("parsed") is not None
+        headers = {}
+        # Without a saved parse (e.g. the last parse failed) a 304 would leave
+        # nothing to return, so the page is fetched in full
+        if has_parse and entry.get("etag"):
+            headers['If-None-Match'] = entry["etag"]
+        if has_parse and entry.get("last_modified"):
+            headers['If-Modified-Since'] = entry["last_modified"]
+        response = self._get(url, headers=headers)
+        self._touched.add(url)
+
+        if response.status_code == 304 and has_parse:
+            self.sync_stats["unchanged"] += 1
+            return response, copy.deepcopy(entry["parsed"])
+        if response.status_code != 200:
+            return response, None
+
+        fingerprint = _page_fingerprint(response.content)
+        if has_parse and entry.get("hash") == fingerprint:
+            self.sync_stats["unchanged"] += 1
+            return response, copy.deepcopy(entry["parsed"])
+        self.sync_stats["fetched"] += 1
+        pages[url] = {
+            "etag": response.headers.get('ETag'),
+            "last_modified": response.headers.get('Last-Modified'),
+            "hash": fingerprint,
+            "parsed": None
+        }
+        return response, None
+
+    def _remember_parsed(self, url, parsed):
+        entry = self.sync_state["pages"].get(url)
+        if entry is not None:
+            entry["parsed"] = copy.deepcopy(parsed)
+
+    def prune_sync_state(self):
+        """Drops fingerprints of pages and courses that were not part of this sync."""
+        for key in ("pages", "courses"):
+            self.sync_state[key] = {k: v for k, v in self.sync_state[key].items() if k in self._touched}
+
+    def _post(self, url, **kwargs):
+        return self._request('POST', url, **kwargs)
+
+    def _map(self, fn, items):
+        """Applies fn to items on a bounded thread pool, keeping the input order."""
+        items = list(items)
+        if self.max_concurrency == 1 or len(items) <= 1:
+            return [fn(item) for item in items]
+        with ThreadPoolExecutor(max_workers=min(self.max_concurrency, len(items))) as executor:
+            return list(executor.map(fn, items))
         
     def login(self, login_url=None, username_field='username', password_field='password'):
         """Login to the college website"""
@@ -37,7 +239,7 @@ class CollegeTaskExtractor:
             login_url = f"{self.base_url}/login/index.php"
             
         try:
-            login_page = self.session.get(login_url)
+            login_page = self._get(login_url)
             soup = BeautifulSoup(login_page.content, 'html.parser')
             
             login_form = soup.find('form')
@@ -63,11 +265,12 @@ class CollegeTaskExtractor:
                 if name:
                     login_data[name] = value
             
-            response = self.session.post(form_action, data=login_data)
+            response = self._post(form_action, data=login_data)
             
             if response.status_code == 200:
                 if 'dashboard' in response.text.lower() or 'logout' in response.text.lower():
                     print("Login successful!")
+                    self.auth_failed = False
                     return True
                 else:
                     print("Login might have failed - no dashboard/logout found")
@@ -84,10 +287,16 @@ class CollegeTaskExtractor:
         """Extract course information using AJAX API endpoints"""
         if not courses_url:
             courses_url = f"{self.base_url}/my/courses.php"
+
+        if self.sesskey:
+            # Restored session: no need to read the courses page for the sesskey
+            courses = self._fetch_courses_via_ajax(self.sesskey, self.user_id)
+            if courses or self.auth_failed:
+                return courses
         
         try:
             print("Getting courses page to extract session info...")
-            response = self.session.get(courses_url)
+            response = self._get(courses_url)
             
             if response.status_code != 200:
                 print(f"Failed to access courses page. Status: {response.status_code}")
@@ -102,6 +311,7 @@ class CollegeTaskExtractor:
             if not sesskey:
                 print("Could not find session key")
                 return []
+            self.sesskey, self.user_id = sesskey, user_id
                 
             print(f"Found sesskey: {sesskey}")
             print(f"Found user_id: {user_id}")
@@ -117,81 +327,89 @@ class CollegeTaskExtractor:
     
     def _fetch_courses_via_ajax(self, sesskey, user_id):
         """Fetch courses using the AJAX API"""
-        try:
-            ajax_url = f"{self.base_url}/lib/ajax/service.php"
-            
-            # Prepare the AJAX request payload
-            payload = [{
-                "index": 0,
-                "methodname": "core_course_get_enrolled_courses_by_timeline_classification",
-                "args": {
-                    "offset": 0,
-                    "limit": 0,
-                    "classification": "inprogress",  # or "all", "future", "past"
-                    "sort": "ul.timeaccess desc",
-                    "customfieldname": "",
-                    "customfieldvalue": ""
-                }
-            }]
-            
-            params = {
-                'sesskey': sesskey,
-                'info': 'core_course_get_enrolled_courses_by_timeline_classification'
-            }
-            
-            headers = {
-                'Content-Type': 'application/json',
-                'X-Requested-With': 'XMLHttpRequest',
-                'Accept': 'application/json, text/javascript, */*; q=0.01'
+        print("Making AJAX request for course data...")
+        data = self._ajax_call("core_course_get_enrolled_courses_by_timeline_classification", {
+            "offset": 0,
+            "limit": 0,
+            "classification": "inprogress",  # or "all", "future", "past"
+            "sort": "ul.timeaccess desc",
+            "customfieldname": "",
+            "customfieldvalue": ""
+        })
+        if data is None:
+            return []
+
+        courses = []
+        for course in data.get('courses', []):
+            course_info = {
+                'id': course.get('id'),
+                'fullname': course.get('fullname'),
+                'shortname': course.get('shortname'),
+                'href': f"{self.base_url}/course/view.php?id={course.get('id')}",
+                'categoryname': course.get('categoryname', ''),
+                'progress': course.get('progress', 0),
+                'startdate': course.get('startdate', 0),
+                'enddate': course.get('enddate', 0),
+                'lastaccess': course.get('lastaccess', 0)
             }
-            
-            print("Making AJAX request for course data...")
-            response = self.session.post(ajax_url, params=params, json=payload, headers=headers)
-            
-            if response.status_code == 200:
-                try:
-                    json_response = response.json()
-                    print("AJAX request successful!")
-                    
-                    # Extract course data from response
-                    courses = []
-                    if json_response and len(json_response) > 0:
-                        course_data = json_response[0].get('data', {})
-                        course_list = course_data.get('courses', [])
-                        
-                        for course in course_list:
-                            course_info = {
-                                'id': course.get('id'),
-                                'fullname': course.get('fullname'),
-                                'shortname': course.get('shortname'),
-                                'href': f"{self.base_url}/course/view.php?id={course.get('id')}",
-                                'categoryname': course.get('categoryname', ''),
-                                'progress': course.get('progress', 0),
-                                'startdate': course.get('startdate', 0),
-                                'enddate': course.get('enddate', 0),
-                                'lastaccess': course.get('lastaccess', 0)
-                            }
-                            courses.append(course_info)
-                        
-                        print(f"Found {len(courses)} courses via AJAX")
-                        return courses
-                    else:
-                        print("No course data found in AJAX response")
-                        return []
-                        
-                except json.JSONDecodeError:
-                    print("Failed to parse AJAX response as JSON")
-                    print("Response content:", response.text[:500])
-                    return []
-            else:
-                print(f"AJAX request failed with status: {response.status_code}")
-                print("Response:", response.text[:500])
-                return []
-                
-        except Exception as e:
-            print(f"Error in AJAX course fetch: {str(e)}")
+            courses.append(course_info)
+
+        print(f"Found {len(courses)} courses via AJAX")
+        return courses
+
+    def _ajax_call(self, methodname, args):
+        """
+        Calls one Moodle external function through /lib/ajax/service.php with the
+        logged-in session. Returns its data, or None if the call failed.
+        """
+        if not self.sesskey:
+            return None
+        try:
+            response = self._post(
+                f"{self.base_url}/lib/ajax/service.php",
+                params={'sesskey': self.sesskey, 'info': methodname},
+                json=[{"index": 0, "methodname": methodname, "args": args}],
+                headers=AJAX_HEADERS
+            )
+            if response.status_code != 200:
+                print(f"AJAX {methodname} failed with status: {response.status_code}")
+                return None
+            result = response.json()
+        except (requests.RequestException, ValueError) as e:
+            print(f"AJAX {methodname} failed: {e}")
+            return None
+
+        # Errors come back either as {"error": ...} or as [{"error": true, "exception": ...}]
+        if not isinstance(result, list) or not result or result[0].get('error'):
+            error = result[0] if isinstance(result, list) and result else result
+            if isinstance(error, dict):
+                exception = error.get('exception') or {}
+                if error.get('errorcode') in AUTH_ERROR_CODES or exception.get('errorcode') in AUTH_ERROR_CODES:
+                    self.auth_failed = True
+            print(f"AJAX {methodname} returned an error: {str(result)[:300]}")
+            return None
+        return result[0].get('data')
+
+    def _fetch_users_courses_via_ajax(self):
+        """Course list from core_enrol_get_users_courses, used when the timeline call fails."""
+        if not self.user_id:
             return []
-    
+        data = self._ajax_call("core_enrol_get_users_courses", {"userid": int(self.user_id)})
+        if not data:
+            return []
+        courses = [{
+            'id': course.get('id'),
+            'fullname': course.get('fullname'),
+            'shortname': course.get('shortname'),
+            'href': f"{self.base_url}/course/view.php?id={course.get('id')}",
+            'progress': course.get('progress') or 0,
+            'startdate': course.get('startdate', 0),
+            'enddate': course.get('enddate', 0),
+            'lastaccess': course.get('lastaccess') or 0
+        } for course in data]
+        print(f"Found {len(courses)} courses via core_enrol_get_users_courses")
+        return courses
+
     # def _try_alternative_ajax_method(self, sesskey, user_id):
     #     """Try alternative AJAX method to get courses"""
     #     try:
@@ -254,14 +472,158 @@ class CollegeTaskExtractor:
     
     def extract_tasks_from_course(self, course):
         """Extract tasks and resources from a specific course"""
+        tasks, resources = self._parse_course_page(course)
+        self._add_assignment_details(tasks)
+        return tasks, resources
+
+    def extract_tasks_from_courses(self, courses):
+        """
+        Extracts tasks and resources from many courses. Returns one
+        (tasks, resources) pair per course, in the input order.
+
+        Uses the web-service functions when a sesskey is known: one
+        mod_assign_get_assignments call for every course plus one
+        core_course_get_contents call per course. Otherwise (or if those calls
+        are refused) course pages are scraped concurrently first, then every
+        assignment page across all courses, so the pool stays busy instead of
+        waiting course by course.
+        """
+        per_course = self._extract_tasks_via_ajax(courses)
+        if per_course is not None:
+            return per_course
+
+        per_course = self._map(self._parse_course_page, courses)
+        self._add_assignment_details([task for tasks, _ in per_course for task in tasks])
+        return per_course
+
+    def _extract_tasks_via_ajax(self, courses):
+        """Web-service version of the course page scrape. Returns None when it cannot be used."""
+        course_ids = [int(course['id']) for course in courses if course.get('id')]
+        if not self.sesskey or not course_ids:
+            return None
+
+        assign_data = self._ajax_call("mod_assign_get_assignments", {"courseids": course_ids, "capabilities": []})
+        if assign_data is None:
+            return None
+        assignments = {
+            assignment['cmid']: assignment
+            for course in assign_data.get('courses', [])
+            for assignment in course.get('assignments', [])
+        }
+
+        contents = self._map(
+            lambda course: self._ajax_call("core_course_get_contents", {"courseid": int(course['id'])}),
+            courses
+        )
+        if any(sections is None for sections in contents):
+            return None
+
+        now = time.time()
+        per_course, unknown_status = [], []
+        for course, sections in zip(courses, contents):
+            course_key = f"course:{course['id']}"
+            course_assignments = [a for a in assignments.values() if str(a.get('course')) == str(course['id'])]
+            # Covers completion states, module lists, assignment timemodified and which due dates have passed
+            fingerprint = _fingerprint({
+                "sections": sections,
+                "assignments": course_assignments,
+                "overdue": sorted(a['cmid'] for a in course_assignments if a.get('duedate') and a['duedate'] < now)
+            })
+            self._touched.add(course_key)
+            entry = self.sync_state["courses"].get(course_key)
+            if entry and entry.get("hash") == fingerprint:
+                self.sync_stats["unchanged"] += 1
+                tasks, resources = copy.deepcopy(entry["tasks"]), copy.deepcopy(entry["resources"])
+                unknown_status.extend(task for task in tasks if task.get("status") == "Unknown")
+                per_course.append((tasks, resources))
+                continue
+            self.sync_stats["fetched"] += 1
+
+            tasks, resources = [], []
+            for section in sections:
+                for module in section.get('modules', []):
+                    modname = module.get('modname')
+                    if not module.get('url') or not module.get('uservisible', True):
+                        continue
+                    if modname not in TASK_MODULES + RESOURCE_MODULES:
+                        continue
+
+                    task_data = {
+                        "course_id": course.get('id'),
+                        "course_name": course.get('fullname'),
+                        "task_name": module.get('name', '').strip(),
+                        "task_url": module['url']
+                    }
+                    if modname == "assign":
+                        task_data.update(self._assignment_details_from_ajax(assignments.get(module.get('id')), module, now))
+                        if task_data["status"] == "Unknown":
+                            unknown_status.append(task_data)
+                        tasks.append(task_data)
+                    elif modname == "quiz":
+                        # Quiz status isn't known here; it is listed like an unsubmitted task
+                        task_data["description"] = ""
+                        task_data["due_date"] = None
+                        tasks.append(task_data)
+                    else:
+                        resources.append(task_data)
+            self.sync_state["courses"][course_key] = {
+                "hash": fingerprint, "tasks": copy.deepcopy(tasks), "resources": copy.deepcopy(resources)
+            }
+            per_course.append((tasks, resources))
+
+        # Completion doesn't tell whether these were submitted, so only their pages do
+        self._add_assignment_details(unknown_status)
+        return per_course
+
+    def _assignment_details_from_ajax(self, assignment, module, now):
+        """
+        Same fields as get_assignment_details, from mod_assign_get_assignments
+        and the course contents. The completion state is only read as the
+        submission status when the assignment's completion rule is "student
+        must submit" (completionsubmit); a view or manual completion says
+        nothing about a submission, so those are left "Unknown" for the page.
+        """
+        assignment = assignment or {}
+        due_ts = assignment.get('duedate') or 0
+        due_date = None
+        if due_ts:
+            # Moodle pages show local time to the minute, e.g. "2025-11-03 23:59:00"
+            local_due = datetime.fromtimestamp(due_ts, ZoneInfo(MOODLE_TIMEZONE))
+            due_date = str(local_due.replace(tzinfo=None, second=0, microsecond=0))
+
+        state = (module.get('completiondata') or {}).get('state')
+        if state is None or not assignment.get('completionsubmit'):
+            status = "Unknown"
+        elif state in COMPLETION_DONE_STATES:
+            status = "Submitted"
+        elif due_ts and due_ts < now:
+            status = "Overdue"
+        else:
+            status = "Not submitted"
+
+        intro = assignment.get('intro') or ''
+        description = BeautifulSoup(intro, 'html.parser').get_text(" ", strip=True) if intro else ""
+        return {"status": status, "due_date": due_date, "description": description}
+
+    def _add_assignment_details(self, tasks):
+        assignments = [task for task in tasks if "assign" in task["task_url"]]
+        details = self._map(self.get_assignment_details, [task["task_url"] for task in assignments])
+        for task, task_details in zip(assignments, details):
+            task.update(task_details)
+
+    def _parse_course_page(self, course):
+        """Lists the activities of a course. Assignment details are filled in separately."""
         try:
             course_url = course.get('href')
             if not course_url:
-                return [], [], []
+                return [], []
 
-            response = self.session.get(course_url)
+            response, cached = self._fetch_if_changed(course_url)
+            if cached is not None:
+                tasks, resources = cached
+                return tasks, resources
             if response.status_code != 200:
-                return [], [], []
+                return [], []
 
             soup = BeautifulSoup(response.content, 'html.parser')
 
@@ -286,8 +648,6 @@ class CollegeTaskExtractor:
                 }
 
                 if "assign" in task_href:
-                    details = self.get_assignment_details(task_href)
-                    task_data.update(details)
                     tasks.append(task_data)
 
                 elif "quiz" in task_href:
@@ -300,6 +660,7 @@ class CollegeTaskExtractor:
                 elif any(x in task_href for x in ["resource", "url", "page", "book"]):
                     resources.append(task_data)
 
+            self._remember_parsed(course_url, [tasks, resources])
             return tasks, resources
 
         except Exception as e:
@@ -310,7 +671,9 @@ class CollegeTaskExtractor:
     def get_assignment_details(self, task_url):
         """Check assignment completion, deadlines, and description"""
         try:
-            response = self.session.get(task_url)
+            response, cached = self._fetch_if_changed(task_url)
+            if cached is not None:
+                return cached
             if response.status_code != 200:
                 return {"status": "Unknown", "due_date": None, "description": ""}
 
@@ -353,11 +716,13 @@ class CollegeTaskExtractor:
             desc_block = soup.find("div", class_="activity-description")
             description = desc_block.get_text(" ", strip=True) if desc_block else ""
 
-            return {
+            details = {
                 "status": status,
                 "due_date": due_date,
                 "description": description
             }
+            self._remember_parsed(task_url, details)
+            return details
 
         except Exception as e:
             return {"status": f"Error: {str(e)}", "due_date": None, "description": ""}
@@ -367,6 +732,11 @@ class CollegeTaskExtractor:
         # Try AJAX method first
         courses = self.extract_course_info_via_ajax(courses_url)
         
+        if courses or self.auth_failed:
+            return courses
+
+        # Second web-service function; needs the sesskey found above
+        courses = self._fetch_users_courses_via_ajax()
         if courses:
             return courses
         
@@ -375,15 +745,16 @@ class CollegeTaskExtractor:
         return self._extract_from_html(courses_url)
     
     def _extract_from_html(self, courses_url=None):
-        """Fallback method to extract from HTML"""
+        """
+        Last-resort course list from the courses page HTML. The course overview
+        block is rendered client-side, so this only finds courses that the
+        server embedded in the page; waiting and re-fetching does not change that.
+        """
         if not courses_url:
             courses_url = f"{self.base_url}/my/courses.php"
         
         try:
-            print("Waiting for page to load completely...")
-            time.sleep(3)
-            
-            response = self.session.get(courses_url)
+            response = self._get(courses_url)
             soup = BeautifulSoup(response.content, 'html.parser')
             
             # Look for the course overview block specifically
@@ -392,13 +763,6 @@ class CollegeTaskExtractor:
                 print("Could not find course overview block")
                 return []
             
-            print("Found course overview block, waiting for content to load...")
-            time.sleep(5)  # Wait longer for dynamic content
-            
-            # Re-fetch the page after waiting
-            response = self.session.get(courses_url)
-            soup = BeautifulSoup(response.content, 'html.parser')
-            
             # Look for course data in various locations
             courses = []
             
@@ -653,8 +1017,8 @@ def main():
             # Going in each course to extract the tasks
             all_tasks = []
             all_course_resources = []
-            for course in filtered_courses:
-                tasks, resources = extractor.extract_tasks_from_course(course)  # don't overwrite all_tasks
+            per_course = extractor.extract_tasks_from_courses(filtered_courses)
+            for course, (tasks, resources) in zip(filtered_courses, per_course):
                 if tasks:
                     all_tasks.extend(tasks)  # accumulate tasks
                 else:
@@ -688,24 +1052,45 @@ def main():
 # ----------------------------
 # Your original function
 # ----------------------------
-def get_all_tasks(username: str, password: str, batch: str = "B1"):
+def moodle_session_key(base_url: str, username: str) -> str:
+    digest = hashlib.sha256(f"{base_url}|{username}".encode("utf-8")).hexdigest()[:32]
+    return f"moodle:session:{digest}"
+
+
+def get_all_tasks(username: str, password: str, batch: str = "B1", sync_state: dict | None = None):
+    """
+    Pass the account's previous sync_state to only re-parse what changed in
+    Moodle; it is updated in place with this sync's fingerprints.
+    """
     BASE_URL = "https://moodle.spit.ac.in"
-    extractor = CollegeTaskExtractor(BASE_URL, username, password)
+    extractor = CollegeTaskExtractor(BASE_URL, username, password, sync_state=sync_state)
 
-    if not extractor.login():
+    # Reuse the session of an earlier sync; log in only when there is none
+    # or Moodle no longer accepts it.
+    session_key = moodle_session_key(BASE_URL, username)
+    reused = extractor.restore_session(session_key)
+    if not reused and not extractor.login():
         raise Exception("Login failed")
 
     courses = extractor.extract_course_info()
+    if reused and extractor.auth_failed:
+        print("Stored Moodle session was rejected, logging in again")
+        extractor.forget_session(session_key)
+        if not extractor.login():
+            raise Exception("Login failed")
+        courses = extractor.extract_course_info()
+    extractor.save_session(session_key)  # Also refreshes the TTL and any rotated cookies
+
     if not courses:
         return {"completed": [], "incomplete": []}
 
     filtered_courses = extractor.filter_current_year_courses(courses)
 
     all_tasks = []
-    for course in filtered_courses:
-        tasks, _ = extractor.extract_tasks_from_course(course)
-        if tasks:
-            all_tasks.extend(tasks)
+    for tasks, _ in extractor.extract_tasks_from_courses(filtered_courses):
+        all_tasks.extend(tasks)
+    extractor.prune_sync_state()
+    print(f"Moodle sync: {extractor.sync_stats['fetched']} changed, {extractor.sync_stats['unchanged']} unchanged pages/courses")
 
     filtered_tasks = extractor.filter_tasks_by_batch(all_tasks, batch)
     completed, incomplete = extractor.separate_tasks(filtered_tasks)
@@ -730,78 +1115,115 @@ def fetch_and_store_moodle_tasks(user_id: int) -> List[models.Task]:
 
         moodle_account = user.moodle_account
         password = auth.decrypt_password(moodle_account.password)
+        sync_state = copy.deepcopy(moodle_account.sync_state or {})
 
         # Fetch all tasks from Moodle, which returns a dict like {"completed": [...], "incomplete": [...]}
         tasks_data = get_all_tasks(
             username=moodle_account.username,
             password=password,
             batch=moodle_account.batch,
+            sync_state=sync_state,
         )
 
-        # Fetch existing Moodle tasks from our DB, keyed by task_url for efficient O(1) lookups
-        existing_tasks = {
-            t.task_url: t
-            for t in db.query(models.Task)
-            .filter(models.Task.user_id == user.id, models.Task.is_moodle_task == True)
-            .all()
-            if t.task_url
-        }
-
-        tasks_to_create = []
-
-        # Iterate through both "completed" and "incomplete" tasks from Moodle
+        # Only tasks that are new, whose completion changed since the last
+        # sync, or whose row is missing (deleted by the user, or an insert
+        # that never committed) need to be looked at in the database.
+        previous_statuses = sync_state.get("tasks", {})
+        current_statuses = {}
+        for status, moodle_tasks in tasks_data.items():
+            for moodle_task in moodle_tasks:
+                task_url = moodle_task.get("task_url")
+                if task_url:  # Skip tasks without a URL, as it's our unique identifier
+                    current_statuses[task_url] = status
+        stored_urls = set()
+        if current_statuses:
+            stored_urls = {
+                row.task_url
+                for row in db.query(models.Task.task_url)
+                .filter(
+                    models.Task.user_id == user.id,
+                    models.Task.is_moodle_task == True,
+                    models.Task.task_url.in_(list(current_statuses))
+                )
+                .all()
+            }
+        changed = []
         for status, moodle_tasks in tasks_data.items():
-            moodle_is_complete = (status == "completed")
-
             for moodle_task in moodle_tasks:
                 task_url = moodle_task.get("task_url")
                 if not task_url:
-                    continue  # Skip tasks without a URL, as it's our unique identifier
+                    continue
+                if previous_statuses.get(task_url) != status or task_url not in stored_urls:
+                    changed.append((status, moodle_task))
+
+        # Fetch the matching Moodle tasks from our DB, keyed by task_url for efficient O(1) lookups
+        changed_urls = [moodle_task["task_url"] for _, moodle_task in changed]
+        existing_tasks = {}
+        if changed_urls:
+            existing_tasks = {
+                t.task_url: t
+                for t in db.query(models.Task)
+                .filter(
+                    models.Task.user_id == user.id,
+                    models.Task.is_moodle_task == True,
+                    models.Task.task_url.in_(changed_urls)
+                )
+                .all()
+            }
+
+        tasks_to_create = []
+
+        for status, moodle_task in changed:
+            moodle_is_complete = (status == "completed")
+            task_url = moodle_task["task_url"]
 
-                # --- KEY CHANGE: LOGIC TO HANDLE EXISTING TASKS ---
-                # Case 1: The task already exists in our database.
-                if task_url in existing_tasks:
-                    db_task = existing_tasks[task_url]
-                    new_status = models.TaskStatus.DONE if moodle_is_complete else models.TaskStatus.TODO
+            # --- KEY CHANGE: LOGIC TO HANDLE EXISTING TASKS ---
+            # Case 1: The task already exists in our database.
+            if task_url in existing_tasks:
+                db_task = existing_tasks[task_url]
+                new_status = models.TaskStatus.DONE if moodle_is_complete else models.TaskStatus.TODO
 
-                    # Only update the database if the status has actually changed
-                    if db_task.status != new_status:
-                        db_task.status = new_status
+                # Only update the database if the status has actually changed
+                if db_task.status != new_status:
+                    db_task.status = new_status
+            
+            # Case 2: The task is new and needs to be created.
+            else:
+                due_date = None
+                if moodle_task.get("due_date"):
+                    try:
+                        due_date = datetime.strptime(moodle_task["due_date"], "%Y-%m-%d %H:%M:%S")
+                    except ValueError:
+                        due_date = None
                 
-                # Case 2: The task is new and needs to be created.
-                else:
-                    due_date = None
-                    if moodle_task.get("due_date"):
-                        try:
-                            due_date = datetime.strptime(moodle_task["due_date"], "%Y-%m-%d %H:%M:%S")
-                        except ValueError:
-                            due_date = None
-                    
-                    new_task = models.Task(
-                        title=moodle_task.get('course_name', 'Unknown Course'),
-                        desc=moodle_task.get('description', ''),
-                        due_date=due_date,
-                        status=models.TaskStatus.DONE if moodle_is_complete else models.TaskStatus.TODO,
-                        priority=models.TaskPriority.MEDIUM,
-                        estimated_hours=2,
-                        user_id=user.id,
-                        is_moodle_task=True,
-                        tags=["moodle"],
-                        task_url=task_url
-                    )
-                    tasks_to_create.append(new_task)
-                    
-                    existing_tasks[task_url] = new_task
+                new_task = models.Task(
+                    title=moodle_task.get('course_name', 'Unknown Course'),
+                    desc=moodle_task.get('description', ''),
+                    due_date=due_date,
+                    status=models.TaskStatus.DONE if moodle_is_complete else models.TaskStatus.TODO,
+                    priority=models.TaskPriority.MEDIUM,
+                    estimated_hours=2,
+                    user_id=user.id,
+                    is_moodle_task=True,
+                    tags=["moodle"],
+                    task_url=task_url
+                )
+                tasks_to_create.append(new_task)
+                
+                existing_tasks[task_url] = new_task
 
         # Add all newly created tasks to the database session
         if tasks_to_create:
             db.add_all(tasks_to_create)
 
-        # Always update the last sync time
+        # Always update the last sync time and the change-detection state
+        sync_state["tasks"] = current_statuses
+        moodle_account.sync_state = sync_state
         moodle_account.last_synced_at = datetime.now(timezone.utc)
 
         # Commit all changes (new tasks AND status updates) in a single transaction
-        db.commit()
+        with metrics.span("db_commit", site="moodle_sync"):
+            db.commit()
 
         return tasks_to_create
 
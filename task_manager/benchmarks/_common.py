@@ -0,0 +1,148 @@
+"""
+Shared helpers for the benchmark scripts: timing, memory, environment setup
+and JSON report writing. Kept dependency-free (stdlib only) on purpose.
+"""
+import hashlib
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+
+def prepare_environment():
+    """
+    The app modules create SQLAlchemy engines at import time, so a DATABASE_URL
+    has to exist before they are imported. Benchmarks never touch the SQL
+    database, an in-memory sqlite URL is enough.
+    """
+    os.environ.setdefault("DATABASE_URL", "sqlite://")
+    sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is reported in KB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+class StageTimer:
+    """Accumulates wall time per stage name."""
+
+    def __init__(self):
+        self.totals = {}
+        self.calls = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.totals[name] = self.totals.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def wrap(self, name: str, fn):
+        """Returns fn wrapped so every call is accounted to `name`."""
+        def wrapper(*args, **kwargs):
+            with self.stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def as_dict(self) -> dict:
+        return {
+            name: {"seconds": round(total, 4), "calls": self.calls[name]}
+            for name, total in self.totals.items()
+        }
+
+
+class HashEmbeddings:
+    """
+    Deterministic, offline stand-in for HuggingFaceEmbeddings. Tokens are hashed
+    into a fixed number of buckets, so texts sharing words get similar vectors.
+    Used when the benchmark should measure our code rather than the model.
+    """
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def _embed(self, text: str) -> list[float]:
+        vec = [0.0] * self.dim
+        for token in text.lower().split():
+            bucket = int(hashlib.md5(token.encode("utf-8")).hexdigest(), 16) % self.dim
+            vec[bucket] += 1.0
+        norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+        return [v / norm for v in vec]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._embed(text)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = (len(ordered) - 1) * pct / 100.0
+    lower = int(k)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (k - lower)
+
+
+def write_report(name: str, results: dict, output: str | None = None) -> str:
+    report = {
+        "benchmark": name,
+        "commit": git_commit(),
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"{name}_{report['commit']}_{stamp}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {output}")
+    return output
+
+
+def compare_reports(baseline_path: str, current: dict, metric_paths: list[tuple[str, ...]]):
+    """Prints the relative change of selected metrics against a previous report."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nComparison against {baseline.get('commit', '?')} ({baseline_path}):")
+    for path in metric_paths:
+        old, new = baseline.get("results", {}), current
+        for key in path:
+            old = old.get(key, {}) if isinstance(old, dict) else {}
+            new = new.get(key, {}) if isinstance(new, dict) else {}
+        if not isinstance(old, (int, float)) or not isinstance(new, (int, float)):
+            continue
+        change = ((new - old) / old * 100) if old else 0.0
+        print(f"  {'.'.join(path)}: {old} -> {new} ({change:+.1f}%)")
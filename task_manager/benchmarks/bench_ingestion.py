@@ -0,0 +1,207 @@
+"""
+Ingestion throughput benchmark.
+
+Generates synthetic PDFs locally (text-only, mixed, image-only), runs the
+ingestion pipeline from app.utils.populate_database stage by stage and writes
+pages/sec, chunks/sec, peak RSS and per-stage wall time to a JSON report.
+
+OCR is always stubbed (no Google Vision calls). Embeddings default to the real
+HuggingFace model; pass --embeddings fake to measure our own code only.
+
+Usage (from task_manager/):
+    python -m benchmarks.bench_ingestion --pages 10 50 --repeat 3
+    python -m benchmarks.bench_ingestion --corpus text --compare benchmarks/results/<old>.json
+"""
+import argparse
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from benchmarks._common import (
+    HashEmbeddings,
+    StageTimer,
+    compare_reports,
+    peak_rss_mb,
+    prepare_environment,
+    write_report,
+)
+
+prepare_environment()
+
+import fitz  # noqa: E402
+from app.utils import populate_database as populate_db  # noqa: E402
+
+CORPUS_KINDS = ("text", "mixed", "image")
+
+# Plain English vocabulary with a few OCR-style misspellings mixed in, so that
+# correct_text has realistic work to do on every page.
+_WORDS = (
+    "network protocol packet router switch transport layer session encryption "
+    "algorithm complexity memory process thread schedule kernel file system cache "
+    "database index query transaction consistency replication latency throughput "
+    "the of and to in is that for with as on by this be are from at an which "
+    "netwrok protocl algorithim memmory proccess databse"
+).split()
+
+_OCR_STUB_TEXT = (
+    "Scanned page. The transport layer provides reliable delivery of packets "
+    "between processes. Congestion control adjusts the sending rate. "
+) * 6
+
+
+def _paragraph(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).capitalize() + "."
+
+
+def build_pdf(kind: str, pages: int, seed: int = 7) -> bytes:
+    """Builds a synthetic PDF with a TOC. Image pages carry no extractable text."""
+    rng = random.Random(seed)
+    pdf = fitz.open()
+    toc = []
+    for page_no in range(1, pages + 1):
+        page = pdf.new_page()
+        is_image = kind == "image" or (kind == "mixed" and page_no % 2 == 0)
+        if page_no % 5 == 1:
+            toc.append([1, f"Chapter {page_no // 5 + 1}", page_no])
+        if is_image:
+            pix = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 400, 500), False)
+            pix.clear_with(rng.randint(180, 240))
+            page.insert_image(fitz.Rect(72, 72, 472, 572), pixmap=pix)
+        else:
+            body = "\n\n".join(_paragraph(rng, 60) for _ in range(5))
+            page.insert_textbox(fitz.Rect(50, 50, 560, 780), f"Course Notes\n{body}\nPage No {page_no}", fontsize=9)
+    if toc:
+        pdf.set_toc(toc)
+    data = pdf.tobytes()
+    pdf.close()
+    return data
+
+
+_PATCHED = ("ocr_page", "correct_text", "clean_and_flatten", "format_text_for_chunking", "remove_repeating_headers_footers")
+_ORIGINALS = {name: getattr(populate_db, name) for name in _PATCHED}
+
+
+class _TimedEmbeddings:
+    """Proxy that accounts embed_documents calls of the wrapped model to a timer."""
+
+    def __init__(self, base, timer: StageTimer):
+        self.base = base
+        self.embed_documents = timer.wrap("embed", base.embed_documents)
+        self.embed_query = base.embed_query
+
+
+def _install_stubs(timer: StageTimer, embedding_base, ocr_latency: float):
+    """
+    Wraps the module-level pipeline functions so every call is accounted to a
+    stage. process_document looks these names up at call time, so wrapping the
+    module attributes is enough to time it from the outside.
+    """
+    def fake_ocr(page):
+        if ocr_latency:
+            time.sleep(ocr_latency)
+        return _OCR_STUB_TEXT
+
+    populate_db.ocr_page = timer.wrap("ocr", fake_ocr)
+    populate_db.correct_text = timer.wrap("correct_text", _ORIGINALS["correct_text"])
+    for name in ("clean_and_flatten", "format_text_for_chunking", "remove_repeating_headers_footers"):
+        setattr(populate_db, name, timer.wrap("clean", _ORIGINALS[name]))
+    populate_db._EMBEDDING_FN = _TimedEmbeddings(embedding_base, timer)
+
+
+def run_once(kind: str, pages: int, timer: StageTimer, tag: str = "bench") -> dict:
+    pdf_bytes = build_pdf(kind, pages)
+    doc_id = f"{kind}-{pages}-{time.time_ns()}"
+
+    with timer.stage("process_document"):
+        documents = populate_db.process_document(pdf_bytes, f"{kind}.pdf", doc_id, "bench")
+    with timer.stage("split"):
+        chunks = populate_db.split_documents(documents)
+    with timer.stage("add_to_chroma"):
+        populate_db.add_to_chroma(tag, chunks, doc_id)
+
+    stages = timer.as_dict()
+    inner = sum(stages.get(s, {}).get("seconds", 0.0) for s in ("ocr", "correct_text", "clean"))
+    stages["extract"] = {
+        "seconds": round(stages["process_document"]["seconds"] - inner, 4),
+        "calls": 1,
+    }
+    stages["chroma_write"] = {
+        "seconds": round(stages["add_to_chroma"]["seconds"] - stages.get("embed", {}).get("seconds", 0.0), 4),
+        "calls": 1,
+    }
+    total = stages["process_document"]["seconds"] + stages["split"]["seconds"] + stages["add_to_chroma"]["seconds"]
+    return {
+        "pages": len(documents),
+        "chunks": len(chunks),
+        "total_seconds": round(total, 4),
+        "pages_per_sec": round(len(documents) / total, 3) if total else 0.0,
+        "chunks_per_sec": round(len(chunks) / total, 3) if total else 0.0,
+        "stages": stages,
+    }
+
+
+def _median_run(runs: list[dict]) -> dict:
+    """Collapses repeated runs into one record of per-field medians."""
+    merged = {key: statistics.median(r[key] for r in runs) for key in ("pages", "chunks", "total_seconds", "pages_per_sec", "chunks_per_sec")}
+    stage_names = sorted({name for r in runs for name in r["stages"]})
+    merged["stages"] = {
+        name: round(statistics.median(r["stages"].get(name, {}).get("seconds", 0.0) for r in runs), 4)
+        for name in stage_names
+    }
+    merged["repeats"] = len(runs)
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the document ingestion pipeline.")
+    parser.add_argument("--corpus", choices=CORPUS_KINDS, nargs="+", default=list(CORPUS_KINDS))
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--embeddings", choices=["hf", "fake"], default="hf")
+    parser.add_argument("--ocr-latency", type=float, default=0.0, help="Seconds the OCR stub sleeps per page.")
+    parser.add_argument("--output", type=str, default=None, help="Report path (default: benchmarks/results/).")
+    parser.add_argument("--compare", type=str, default=None, help="Previous report to diff against.")
+    args = parser.parse_args()
+
+    chroma_dir = tempfile.mkdtemp(prefix="bench_chroma_")
+    populate_db.CHROMA_PATH = chroma_dir
+    results = {"config": vars(args).copy(), "runs": {}}
+    try:
+        start = time.perf_counter()
+        # Loads the NLTK vocabulary and the embedding model outside the measured runs
+        embedding_base = HashEmbeddings() if args.embeddings == "fake" else populate_db.get_embedding_function()
+        embedding_base.embed_documents(["warmup"])
+        _ORIGINALS["correct_text"]("warmup")
+        results["warmup_seconds"] = round(time.perf_counter() - start, 3)
+
+        for kind in args.corpus:
+            for pages in args.pages:
+                runs = []
+                for _ in range(args.repeat):
+                    timer = StageTimer()
+                    _install_stubs(timer, embedding_base, args.ocr_latency)
+                    runs.append(run_once(kind, pages, timer))
+                key = f"{kind}_{pages}p"
+                results["runs"][key] = _median_run(runs)
+                results["runs"][key]["peak_rss_mb"] = round(peak_rss_mb(), 1)
+                summary = results["runs"][key]
+                print(
+                    f"{key:>12}: {summary['pages_per_sec']:8.2f} pages/s  "
+                    f"{summary['chunks_per_sec']:8.2f} chunks/s  "
+                    f"peak RSS {summary['peak_rss_mb']:.0f} MB  stages {summary['stages']}"
+                )
+    finally:
+        shutil.rmtree(chroma_dir, ignore_errors=True)
+
+    write_report("ingestion", results, args.output)
+    if args.compare:
+        metrics = []
+        for key in results["runs"]:
+            metrics += [("runs", key, "pages_per_sec"), ("runs", key, "chunks_per_sec"), ("runs", key, "peak_rss_mb")]
+        compare_reports(args.compare, results, metrics)
+
+
+if __name__ == "__main__":
+    main()
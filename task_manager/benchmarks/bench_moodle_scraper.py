@@ -0,0 +1,120 @@
+"""
+Moodle scraper benchmark against the local mock server (benchmarks/mock_moodle.py).
+
+Runs the same sync flow as get_all_tasks (login, course list, then course
+contents and assignments) once per concurrency level and reports wall time,
+request counts and the peak number of requests the server saw in flight.
+`--mode html` refuses the course/assignment web-service functions on the mock
+server, so the HTML scraping fallback is measured instead. Each level is run
+cold and then again with the sync state of the cold run (incremental sync:
+unchanged pages answer 304 and are not re-parsed). Every run must produce the
+same tasks as the first one, and the peak must stay within the per-host
+limit; the script exits non-zero otherwise.
+
+Usage (from task_manager/):
+    python -m benchmarks.bench_moodle_scraper --concurrency 1 4 8 --latency 0.05
+    python -m benchmarks.bench_moodle_scraper --mode html --courses 12 --assignments 10 --delay 0.02
+"""
+import argparse
+import base64
+import os
+import sys
+import time
+
+from benchmarks._common import prepare_environment, write_report, compare_reports
+from benchmarks.mock_moodle import MockMoodle
+
+prepare_environment()
+# app.auth refuses to import without a Fernet key; the benchmark never decrypts anything
+os.environ.setdefault("ENCRYPTION_KEY", base64.urlsafe_b64encode(b"\0" * 32).decode())
+
+from app.utils import tasks as moodle_tasks  # noqa: E402
+
+
+def run_sync(server: MockMoodle, concurrency: int, delay: float, sync_state: dict) -> tuple[dict, dict]:
+    server.reset_counters()
+    start = time.perf_counter()
+    extractor = moodle_tasks.CollegeTaskExtractor(
+        server.base_url, MockMoodle.USERNAME, MockMoodle.PASSWORD,
+        max_concurrency=concurrency, request_delay=delay, sync_state=sync_state
+    )
+    if not extractor.login():
+        raise RuntimeError("Login against the mock server failed")
+    courses = extractor.filter_current_year_courses(extractor.extract_course_info())
+    all_tasks = []
+    for tasks, _ in extractor.extract_tasks_from_courses(courses):
+        all_tasks.extend(tasks)
+    completed, incomplete = extractor.separate_tasks(all_tasks)
+    elapsed = time.perf_counter() - start
+    stats = {
+        "seconds": round(elapsed, 3),
+        "courses": len(courses),
+        "tasks": len(all_tasks),
+        "requests": server.total_requests,
+        "requests_by_path": dict(server.requests),
+        "peak_in_flight": server.peak_in_flight,
+        "not_modified": server.not_modified,
+        "reused": extractor.sync_stats["unchanged"],
+    }
+    return {"completed": completed, "incomplete": incomplete}, stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Moodle scraper against a local mock server.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8])
+    parser.add_argument("--mode", choices=["ajax", "html"], default="ajax")
+    parser.add_argument("--courses", type=int, default=8)
+    parser.add_argument("--assignments", type=int, default=6, help="Assignments per course.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mock server latency per request (s).")
+    parser.add_argument("--delay", type=float, default=0.0, help="Politeness delay between request starts (s).")
+    parser.add_argument("--output", type=str, default=None)
+    parser.add_argument("--compare", type=str, default=None, help="Previous report to diff against.")
+    args = parser.parse_args()
+
+    disabled = ("mod_assign_get_assignments", "core_course_get_contents") if args.mode == "html" else ()
+    server = MockMoodle(
+        courses=args.courses, assignments_per_course=args.assignments,
+        latency=args.latency, disabled_functions=disabled, timezone=moodle_tasks.MOODLE_TIMEZONE
+    ).start()
+    results = {"config": vars(args).copy(), "runs": {}}
+    failures = []
+    baseline = None
+    try:
+        # Silence the scraper's progress prints while timing
+        stdout = sys.stdout
+        for concurrency in args.concurrency:
+            sync_state = {}
+            for phase in ("cold", "warm"):
+                sys.stdout = open(os.devnull, "w")
+                try:
+                    synced, stats = run_sync(server, concurrency, args.delay, sync_state)
+                finally:
+                    sys.stdout.close()
+                    sys.stdout = stdout
+                if baseline is None:
+                    baseline = synced
+                elif synced != baseline:
+                    failures.append(f"concurrency {concurrency} ({phase}): tasks differ from the first run")
+                if stats["peak_in_flight"] > concurrency:
+                    failures.append(f"concurrency {concurrency} ({phase}): {stats['peak_in_flight']} requests in flight")
+                results["runs"].setdefault(str(concurrency), {})[phase] = stats
+                print(
+                    f"concurrency {concurrency:>2} {phase}: {stats['seconds']:>7.3f}s  {stats['tasks']} tasks  "
+                    f"{stats['requests']} requests ({stats['not_modified']} not modified)  "
+                    f"peak in flight {stats['peak_in_flight']}"
+                )
+    finally:
+        server.stop()
+
+    write_report("moodle_scraper", results, args.output)
+    if args.compare:
+        compare_reports(args.compare, results, [
+            ("runs", str(c), phase, "seconds") for c in args.concurrency for phase in ("cold", "warm")
+        ])
+    if failures:
+        print("\n".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Retrieval quality and latency benchmark for the /ask path.
+
+Loads the labeled fixture corpus (benchmarks/fixtures/retrieval_corpus.json)
+into a throwaway Chroma directory, pads it with synthetic distractor documents
+and runs retrieve_tree_based_context + rerank_documents for every labeled
+question. Reports recall@k, MRR and p50/p95/p99 latency per corpus size, plus
+end-to-end /ask latency with an offline fake LLM.
+
+Usage (from task_manager/):
+    python -m benchmarks.bench_retrieval --scales 0 25 100 --reranker fake
+    python -m benchmarks.bench_retrieval --reranker cross-encoder --k 1 3 5
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from benchmarks._common import (
+    BENCH_DIR,
+    HashEmbeddings,
+    StageTimer,
+    compare_reports,
+    peak_rss_mb,
+    percentile,
+    prepare_environment,
+    write_report,
+)
+
+prepare_environment()
+
+from langchain.schema.document import Document  # noqa: E402
+from app.utils import populate_database as populate_db  # noqa: E402
+
+FIXTURE_PATH = os.path.join(BENCH_DIR, "fixtures", "retrieval_corpus.json")
+TAG = "bench"
+
+_DISTRACTOR_WORDS = (
+    "system data model process network memory value table layer algorithm "
+    "function result method analysis design structure example section figure "
+    "the of and to in is that for with as on by this be are from at an which "
+    "chemistry biology economics history literature geometry calculus optics"
+).split()
+
+
+class FakeCrossEncoder:
+    """Offline reranker: scores a pair by query-token overlap with the passage."""
+
+    def predict(self, pairs):
+        scores = []
+        for query, passage in pairs:
+            q_tokens = set(populate_db._tokenize_for_lexical(query))
+            p_tokens = set(populate_db._tokenize_for_lexical(passage))
+            scores.append(len(q_tokens & p_tokens) / (len(q_tokens) or 1))
+        return scores
+
+
+class FakeGenerativeModel:
+    """Stands in for genai.GenerativeModel; answers with the first context line."""
+
+    class _Response:
+        def __init__(self, text):
+            self.text = text
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        context = prompt.split("CONTEXT:", 1)[-1].strip()
+        return self._Response(context.split("\n", 1)[0][:300])
+
+
+def load_fixture() -> dict:
+    with open(FIXTURE_PATH, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def index_fixture(fixture: dict):
+    for doc in fixture["documents"]:
+        chunks = [
+            Document(
+                page_content=chunk["text"],
+                metadata={
+                    "source": doc["source"],
+                    "doc_id": doc["doc_id"],
+                    "user_id": "bench",
+                    "page": chunk["page"],
+                    "topic": chunk["topic"],
+                    "bench_key": chunk["key"],
+                },
+            )
+            for chunk in doc["chunks"]
+        ]
+        populate_db.add_to_chroma(TAG, chunks, doc["doc_id"])
+
+
+def add_distractors(start: int, stop: int, chunks_per_doc: int, seed: int = 11):
+    rng = random.Random(seed + start)
+    for n in range(start, stop):
+        doc_id = f"distractor-{n}"
+        chunks = []
+        for i in range(chunks_per_doc):
+            words = " ".join(rng.choice(_DISTRACTOR_WORDS) for _ in range(110))
+            chunks.append(
+                Document(
+                    page_content=words.capitalize() + ".",
+                    metadata={
+                        "source": f"{doc_id}.pdf",
+                        "doc_id": doc_id,
+                        "user_id": "bench",
+                        "page": i // 3 + 1,
+                        "topic": f"Unit {i // 10 + 1}",
+                    },
+                )
+            )
+        populate_db.add_to_chroma(TAG, chunks, doc_id)
+
+
+def evaluate(questions: list[dict], ks: list[int], repeat: int) -> dict:
+    max_k = max(ks)
+    timer = StageTimer()
+    original_rerank = populate_db.rerank_documents
+    populate_db.rerank_documents = timer.wrap("rerank", original_rerank)
+
+    retrieval_latencies, rerank_latencies, ask_latencies = [], [], []
+    recall_hits = {k: 0.0 for k in ks}
+    reciprocal_ranks = []
+    try:
+        for item in questions:
+            relevant = set(item["relevant"])
+            ranked_keys = []
+            for attempt in range(repeat):
+                rerank_before = timer.totals.get("rerank", 0.0)
+                start = time.perf_counter()
+                docs = populate_db.retrieve_tree_based_context(query=item["question"], tag=TAG, top_k=max_k)
+                elapsed = time.perf_counter() - start
+                rerank_elapsed = timer.totals.get("rerank", 0.0) - rerank_before
+                retrieval_latencies.append(elapsed)
+                rerank_latencies.append(rerank_elapsed)
+
+                # End-to-end /ask work after retrieval, with the fake LLM
+                context_text = "\n\n---\n\n".join(doc.page_content for doc in docs[:3])
+                populate_db.format_sources(docs[:3])
+                populate_db.query_llm(item["question"], context_text, [])
+                ask_latencies.append(time.perf_counter() - start)
+
+                if attempt == 0:
+                    ranked_keys = [doc.metadata.get("bench_key") for doc in docs]
+
+            for k in ks:
+                found = relevant & set(ranked_keys[:k])
+                recall_hits[k] += len(found) / len(relevant)
+            rank = next((i + 1 for i, key in enumerate(ranked_keys) if key in relevant), None)
+            reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+    finally:
+        populate_db.rerank_documents = original_rerank
+
+    def latency_summary(values):
+        return {
+            "p50_ms": round(percentile(values, 50) * 1000, 2),
+            "p95_ms": round(percentile(values, 95) * 1000, 2),
+            "p99_ms": round(percentile(values, 99) * 1000, 2),
+        }
+
+    return {
+        "questions": len(questions),
+        "recall": {f"@{k}": round(recall_hits[k] / len(questions), 4) for k in ks},
+        "mrr": round(sum(reciprocal_ranks) / len(reciprocal_ranks), 4),
+        "retrieval_latency": latency_summary(retrieval_latencies),
+        "rerank_latency": latency_summary(rerank_latencies),
+        "ask_latency": latency_summary(ask_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark retrieval quality and latency for /ask.")
+    parser.add_argument("--scales", type=int, nargs="+", default=[0, 25, 100], help="Number of distractor documents.")
+    parser.add_argument("--chunks-per-doc", type=int, default=40)
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 3, 5])
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per question.")
+    parser.add_argument("--reranker", choices=["cross-encoder", "fake"], default="fake")
+    parser.add_argument("--embeddings", choices=["hf", "fake"], default="fake")
+    parser.add_argument("--output", type=str, default=None)
+    parser.add_argument("--compare", type=str, default=None, help="Previous report to diff against.")
+    args = parser.parse_args()
+
+    chroma_dir = tempfile.mkdtemp(prefix="bench_chroma_")
+    populate_db.CHROMA_PATH = chroma_dir
+    if args.embeddings == "fake":
+        populate_db._EMBEDDING_FN = HashEmbeddings()
+    if args.reranker == "fake":
+        populate_db._CROSS_ENCODER_MODEL = FakeCrossEncoder()
+    populate_db.genai.GenerativeModel = FakeGenerativeModel
+
+    fixture = load_fixture()
+    fixture_chunks = sum(len(doc["chunks"]) for doc in fixture["documents"])
+    results = {"config": vars(args).copy(), "scales": {}}
+    try:
+        index_fixture(fixture)
+        # Warm the reranker so model loading is not counted as query latency
+        populate_db.rerank_documents("warmup", [Document(page_content="warmup", metadata={})])
+
+        indexed = 0
+        for scale in sorted(args.scales):
+            add_distractors(indexed, scale, args.chunks_per_doc)
+            indexed = scale
+            summary = evaluate(fixture["questions"], args.k, args.repeat)
+            summary["documents"] = len(fixture["documents"]) + scale
+            summary["chunks"] = fixture_chunks + scale * args.chunks_per_doc
+            summary["peak_rss_mb"] = round(peak_rss_mb(), 1)
+            results["scales"][str(scale)] = summary
+            print(
+                f"{summary['chunks']:>7} chunks: recall {summary['recall']}  MRR {summary['mrr']:.3f}  "
+                f"retrieval p50/p95/p99 {summary['retrieval_latency']['p50_ms']}/"
+                f"{summary['retrieval_latency']['p95_ms']}/{summary['retrieval_latency']['p99_ms']} ms"
+            )
+    finally:
+        shutil.rmtree(chroma_dir, ignore_errors=True)
+
+    write_report("retrieval", results, args.output)
+    if args.compare:
+        metrics = []
+        for scale in results["scales"]:
+            metrics += [
+                ("scales", scale, "mrr"),
+                ("scales", scale, "retrieval_latency", "p50_ms"),
+                ("scales", scale, "retrieval_latency", "p95_ms"),
+            ]
+            metrics += [("scales", scale, "recall", f"@{k}") for k in args.k]
+        compare_reports(args.compare, results, metrics)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Local mock of the Moodle pages and AJAX endpoints the scraper in
+app/utils/tasks.py talks to. Serves a deterministic set of courses and
+assignments with a configurable per-request latency, and records request
+counts and the peak number of requests in flight, so scraper benchmarks can
+check both speed and politeness.
+
+Stdlib only. Usage:
+    server = MockMoodle(courses=8, assignments_per_course=6, latency=0.05).start()
+    ... CollegeTaskExtractor(server.base_url, MockMoodle.USERNAME, MockMoodle.PASSWORD) ...
+    server.stop()
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+SESSION_COOKIE = "MoodleSession"
+
+
+class MockMoodle:
+    USERNAME = "student"
+    PASSWORD = "secret"
+    SESSKEY = "mocksesskey"
+    USER_ID = 4242
+
+    def __init__(self, courses: int = 8, assignments_per_course: int = 6, resources_per_course: int = 3,
+                 latency: float = 0.05, port: int = 0, disabled_functions: tuple = (),
+                 timezone: str = "Asia/Kolkata"):
+        self.latency = latency
+        self.disabled_functions = set(disabled_functions)
+        self.courses = []
+        self.assignments = {}  # cmid -> assignment dict
+        # Pages render due dates in the site's zone; the web services send timestamps
+        base_due = datetime(2025, 11, 3, 23, 59, tzinfo=ZoneInfo(timezone))
+        for c in range(courses):
+            course_id = 1000 + c
+            course = {
+                "id": course_id,
+                "fullname": f"Course {c + 1} 2025-26",
+                "shortname": f"C{c + 1}",
+                "assignments": [],
+                "resources": [],
+            }
+            for a in range(assignments_per_course):
+                cmid = course_id * 100 + a
+                self.assignments[cmid] = {
+                    "cmid": cmid,
+                    "id": cmid + 500000,
+                    "course_id": course_id,
+                    "name": f"Experiment {a + 1}",
+                    "due": base_due + timedelta(days=c + a),
+                    "submitted": (c + a) % 3 == 0,
+                    "intro": f"Lab work {a + 1} for course {c + 1}.",
+                    # Some use a view-based completion rule, which says nothing about submission
+                    "completionsubmit": 0 if a % 4 == 3 else 1,
+                }
+                course["assignments"].append(cmid)
+            for r in range(resources_per_course):
+                course["resources"].append(course_id * 100 + 50 + r)
+            self.courses.append(course)
+
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.not_modified = 0
+        self.requests = {}
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def total_requests(self) -> int:
+        return sum(self.requests.values())
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests = {}
+            self.peak_in_flight = 0
+            self.not_modified = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-moodle", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # --- Page rendering -------------------------------------------------
+
+    def _layout(self, body: str) -> str:
+        return (
+            "<html><head><script>M.cfg = {\"sesskey\":\"" + self.SESSKEY + "\"};</script></head><body>"
+            f"<a href=\"{self.base_url}/user/profile.php?id={self.USER_ID}\">Profile</a>"
+            f"<a href=\"{self.base_url}/login/logout.php?sesskey={self.SESSKEY}\">Logout</a>"
+            f"{body}</body></html>"
+        )
+
+    def _course_page(self, course: dict) -> str:
+        links = [
+            f"<a href=\"{self.base_url}/mod/assign/view.php?id={cmid}\">{self.assignments[cmid]['name']}</a>"
+            for cmid in course["assignments"]
+        ] + [
+            f"<a href=\"{self.base_url}/mod/resource/view.php?id={cmid}\">Notes {cmid}</a>"
+            for cmid in course["resources"]
+        ]
+        return self._layout(f"<h1>{course['fullname']}</h1>" + "".join(f"<li>{link}</li>" for link in links))
+
+    def _assignment_page(self, assignment: dict) -> str:
+        due = assignment["due"].strftime("%A, %d %B %Y, %I:%M %p")
+        status = "Submitted for grading" if assignment["submitted"] else "No submissions have been made yet"
+        return self._layout(
+            f"<div class=\"activity-dates\"><div>Opened: Monday, 1 September 2025, 12:00 AM</div>"
+            f"<div>Due: {due}</div></div>"
+            f"<div class=\"activity-description\"><p>{assignment['intro']}</p></div>"
+            f"<table class=\"generaltable\"><tr><th>Submission status</th><td>{status}</td></tr>"
+            f"<tr><th>Time remaining</th><td>2 days</td></tr></table>"
+        )
+
+    def _assignment_ws(self, assignment: dict) -> dict:
+        return {
+            "id": assignment["id"],
+            "cmid": assignment["cmid"],
+            "course": assignment["course_id"],
+            "name": assignment["name"],
+            "duedate": int(assignment["due"].timestamp()),
+            "completionsubmit": assignment["completionsubmit"],
+            "intro": f"<p>{assignment['intro']}</p>",
+        }
+
+    def _course_modules(self, course: dict) -> list:
+        modules = [{
+            "id": cmid,
+            "name": self.assignments[cmid]["name"],
+            "modname": "assign",
+            "url": f"{self.base_url}/mod/assign/view.php?id={cmid}",
+            "uservisible": True,
+            # A view-based rule reports complete whether or not anything was submitted
+            "completiondata": {"state": 1 if self.assignments[cmid]["submitted"]
+                               or not self.assignments[cmid]["completionsubmit"] else 0},
+        } for cmid in course["assignments"]]
+        modules += [{
+            "id": cmid,
+            "name": f"Notes {cmid}",
+            "modname": "resource",
+            "url": f"{self.base_url}/mod/resource/view.php?id={cmid}",
+            "uservisible": True,
+        } for cmid in course["resources"]]
+        return modules
+
+    def _ajax(self, calls: list) -> list:
+        responses = []
+        for call in calls:
+            method, args = call.get("methodname"), call.get("args", {})
+            if method in self.disabled_functions:
+                responses.append({"error": True, "exception": {"errorcode": "servicenotavailable"}})
+                continue
+            if method == "core_course_get_enrolled_courses_by_timeline_classification":
+                data = {"courses": [
+                    {"id": c["id"], "fullname": c["fullname"], "shortname": c["shortname"], "categoryname": "Mock"}
+                    for c in self.courses
+                ], "nextoffset": len(self.courses)}
+            elif method == "core_enrol_get_users_courses":
+                data = [{"id": c["id"], "fullname": c["fullname"], "shortname": c["shortname"]} for c in self.courses]
+            elif method == "mod_assign_get_assignments":
+                wanted = set(args.get("courseids") or [c["id"] for c in self.courses])
+                data = {"courses": [
+                    {"id": c["id"], "assignments": [self._assignment_ws(self.assignments[cmid]) for cmid in c["assignments"]]}
+                    for c in self.courses if c["id"] in wanted
+                ], "warnings": []}
+            elif method == "core_course_get_contents":
+                course = next((c for c in self.courses if c["id"] == args.get("courseid")), None)
+                if course is None:
+                    responses.append({"error": True, "exception": {"errorcode": "invalidrecord"}})
+                    continue
+                data = [{"id": course["id"] * 10, "name": "General", "modules": self._course_modules(course)}]
+            else:
+                responses.append({"error": True, "exception": {"message": f"Unknown method {method}"}})
+                continue
+            responses.append({"error": False, "data": data})
+        return responses
+
+    # --- HTTP handler ---------------------------------------------------
+
+    def _handler_class(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _track(self, fn):
+                url = urlparse(self.path)
+                with mock._lock:
+                    mock.in_flight += 1
+                    mock.peak_in_flight = max(mock.peak_in_flight, mock.in_flight)
+                    mock.requests[url.path] = mock.requests.get(url.path, 0) + 1
+                try:
+                    if mock.latency:
+                        time.sleep(mock.latency)
+                    fn(url)
+                finally:
+                    with mock._lock:
+                        mock.in_flight -= 1
+
+            def _send(self, status, body, content_type="text/html", headers=None):
+                payload = body.encode("utf-8")
+                if status == 200 and self.command == "GET" and content_type == "text/html":
+                    etag = '"' + hashlib.sha256(payload).hexdigest()[:16] + '"'
+                    if self.headers.get("If-None-Match") == etag:
+                        with mock._lock:
+                            mock.not_modified += 1
+                        self.send_response(304)
+                        self.send_header("ETag", etag)
+                        self.end_headers()
+                        return
+                    headers = {**(headers or {}), "ETag": etag}
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _logged_in(self):
+                return f"{SESSION_COOKIE}=ok" in (self.headers.get("Cookie") or "")
+
+            def do_GET(self):
+                self._track(self._get)
+
+            def do_POST(self):
+                self._track(self._post)
+
+            def _get(self, url):
+                query = parse_qs(url.query)
+                if url.path == "/login/index.php":
+                    return self._send(200, (
+                        "<html><body><form action=\"/login/index.php\" method=\"post\">"
+                        "<input type=\"hidden\" name=\"logintoken\" value=\"tok\">"
+                        "<input name=\"username\"><input name=\"password\" type=\"password\">"
+                        "</form></body></html>"
+                    ))
+                if not self._logged_in():
+                    return self._send(303, "", headers={"Location": f"{mock.base_url}/login/index.php"})
+                if url.path == "/my/courses.php":
+                    return self._send(200, mock._layout(
+                        "<section data-block=\"myoverview\"><div data-region=\"courses-view\"></div></section>"
+                    ))
+                if url.path == "/course/view.php":
+                    course = next((c for c in mock.courses if str(c["id"]) == query.get("id", [""])[0]), None)
+                    if course:
+                        return self._send(200, mock._course_page(course))
+                if url.path == "/mod/assign/view.php":
+                    assignment = mock.assignments.get(int(query.get("id", ["0"])[0] or 0))
+                    if assignment:
+                        return self._send(200, mock._assignment_page(assignment))
+                self._send(404, "Not found")
+
+            def _post(self, url):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length).decode("utf-8") if length else ""
+                if url.path == "/login/index.php":
+                    form = parse_qs(raw)
+                    if form.get("username") == [mock.USERNAME] and form.get("password") == [mock.PASSWORD]:
+                        return self._send(200, mock._layout("<h1>Dashboard</h1>"),
+                                          headers={"Set-Cookie": f"{SESSION_COOKIE}=ok; Path=/"})
+                    return self._send(200, "<html><body>Invalid login</body></html>")
+                if url.path == "/lib/ajax/service.php":
+                    query = parse_qs(url.query)
+                    if not self._logged_in() or query.get("sesskey") != [mock.SESSKEY]:
+                        body = [{"error": True, "exception": {"errorcode": "invalidsesskey"}}]
+                    else:
+                        body = mock._ajax(json.loads(raw or "[]"))
+                    return self._send(200, json.dumps(body), content_type="application/json")
+                self._send(404, "Not found")
+
+        return Handler